@@ -111,6 +111,10 @@ ROOT_URLCONF = 'DjangoWebServer.urls'
 WSGI_APPLICATION = 'DjangoWebServer.wsgi.application'
 
 
+#the blocks processed by the exchange server, see openexchangelib/stream.py. the website reads them as a consumer,
+#and only processes blocks itself when the stream can't give the next one
+EXCHANGE_STREAM_FOLDER = os.path.join(os.path.dirname(PROJ_DIR), 'ExchangeServer', 'data', 'stream')
+
 TEMPLATE_DIRS = (os.path.join(os.path.dirname(__file__), '..', 'templates').replace('\\','/'),)
 
 INSTALLED_APPS = (
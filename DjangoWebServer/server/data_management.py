@@ -1,4 +1,5 @@
-from openexchangelib import util
+from django.conf import settings
+from openexchangelib import util, journal, snapshot, tape
 from openexchangelib.types import OEBaseException
 import os
 
@@ -14,9 +15,18 @@ def ensure_dir(dir_path):
 data_path = os.path.join(os.path.abspath(os.path.dirname(os.path.dirname(__file__))), 'data')
 ASSET_FOLDER = os.path.join(data_path, 'assets')
 BLOCK_FOLDER = os.path.join(data_path, 'block')
+SNAPSHOT_FOLDER = os.path.join(data_path, 'snapshot')
+TAPE_FOLDER = os.path.join(data_path, 'tape')
+
+#the blocks processed by the exchange server, see openexchangelib/stream.py. the website reads them as consumer
+#STREAM_CONSUMER, and only processes blocks itself when the stream can't give the next one
+STREAM_FOLDER = settings.EXCHANGE_STREAM_FOLDER
+STREAM_CONSUMER = 'website'
 
 ensure_dir(ASSET_FOLDER)
 ensure_dir(BLOCK_FOLDER)
+ensure_dir(SNAPSHOT_FOLDER)
+ensure_dir(TAPE_FOLDER)
 
 
 class FileNotExistError(OEBaseException):
@@ -69,26 +79,205 @@ def data_file_max_index(base):
         return max(indexes)
 
 
-def pop_chained_state(remove=False):
+#chained states are checkpointed every CHECKPOINT_INTERVAL blocks, blocks in between go to the journal,
+#see openexchangelib/journal.py
+CHECKPOINT_INTERVAL = 100
+_checkpoint_height = None  # the checkpoint the journal in use follows
+
+#retention of old checkpoints, checked after every checkpoint: the last KEEP_LAST_CHECKPOINTS ones, and the first one of
+#every KEEP_EVERY_BLOCKS blocks are kept. all but the latest are compressed if COMPRESS_COLD_CHECKPOINTS
+KEEP_LAST_CHECKPOINTS = 20
+KEEP_EVERY_BLOCKS = 10000
+COMPRESS_COLD_CHECKPOINTS = True
+
+
+def pop_chained_state(remove=False, repair=False):
     """
+    the latest chained state: the latest checkpoint with its journal replayed
+    :param remove: also drop the latest block, so the next call loads the state before it
+    :param repair: drop the incomplete record at the end of the journal, only for the process appending to it
     :rtype: ChainedState
     """
-    max_index = data_file_max_index(BLOCK_FOLDER)
-    if max_index is None:
-        return None
-    else:
-        data = load_data(str(max_index), BLOCK_FOLDER)
-        if remove:
-            remove_data(str(max_index), BLOCK_FOLDER)
-        return data
+    global _checkpoint_height
+
+    chained_state, _checkpoint_height = journal.load_state(BLOCK_FOLDER, repair=repair or remove)
+    if repair and chained_state is not None:
+        #the trades of blocks the journal lost in a crash
+        _truncate_tapes(chained_state.exchange.processed_block_height)
+    if remove and chained_state is not None:
+        rewind_chained_state()
+    return chained_state
+
+
+def rewind_chained_state():
+    """
+    drops the latest block
+    """
+    global _checkpoint_height
+
+    if not journal.rewind(BLOCK_FOLDER):
+        raise FileNotExistError(folder=BLOCK_FOLDER)
+    _checkpoint_height = None
+    _truncate_tapes(latest_chained_height())
+    _republish_snapshot()
+
+
+def load_chained_state(height):
+    """
+    :type height: int
+    :rtype: ChainedState
+    """
+    return journal.load_state(BLOCK_FOLDER, height)[0]
+
+
+def latest_chained_height():
+    """
+    :rtype: int or None
+    """
+    return journal.latest_height(BLOCK_FOLDER)
 
 
-def push_chained_state(chained_state):
+def push_chained_state(chained_state, record=None, publish=True):
     """
+    saves the chained state right after a block is processed: the journal record of the block, or a checkpoint if the
+    journal is long enough (or there's no record)
     :type chained_state: ChainedState
+    :param record: see journal.dump_entry
+    :type record: str or None
+    :param publish: also publish the snapshot for the web workers, see publish_snapshot
+    :type publish: bool
     """
+    global _checkpoint_height
+
     height = chained_state.exchange.processed_block_height
-    save_data(chained_state, str(height), BLOCK_FOLDER)
+    _record_trades(chained_state)
+    if record is None or _checkpoint_height is None or height - _checkpoint_height >= CHECKPOINT_INTERVAL:
+        _sync_tapes()
+        journal.save_checkpoint(BLOCK_FOLDER, util.dump_obj(chained_state), height)
+        journal.maintain(BLOCK_FOLDER, KEEP_LAST_CHECKPOINTS, KEEP_EVERY_BLOCKS, COMPRESS_COLD_CHECKPOINTS)
+        _checkpoint_height = height
+    else:
+        journal.journal_of(BLOCK_FOLDER, _checkpoint_height).append(record)
+    if publish:
+        publish_snapshot(chained_state)
+
+
+def remove_chained_from(height):
+    """
+    :return: heights of the removed checkpoints
+    :rtype: list of int
+    """
+    removed = journal.remove_from(BLOCK_FOLDER, height)
+    _truncate_tapes(height - 1)
+    _republish_snapshot()
+    return removed
+
+
+#every trade, stored by column, see openexchangelib/tape.py. the trades of a block are appended when it's pushed, and
+#cut when it's dropped. the tapes are synced with the checkpoints
+_tape_writers = {}
+
+
+def _tape_writer(asset_name):
+    """
+    :rtype: tape.TapeWriter
+    """
+    if asset_name not in _tape_writers:
+        _tape_writers[asset_name] = tape.TapeWriter(tape.tape_folder(TAPE_FOLDER, asset_name))
+    return _tape_writers[asset_name]
+
+
+def _record_trades(chained_state):
+    """
+    appends the trades of the blocks applied since the state was pushed, see ChainedState.trade_rows
+    :type chained_state: ChainedState
+    """
+    for asset_name, rows in chained_state.__dict__.pop('trade_rows', {}).iteritems():
+        _tape_writer(asset_name).append(rows)
+
+
+def _sync_tapes():
+    """
+    before a checkpoint: the trades of the blocks after it are appended again after a crash, see ChainedState.trade_rows
+    """
+    for asset_name in tape.asset_names(TAPE_FOLDER):
+        _tape_writer(asset_name).sync()
+
+
+def _truncate_tapes(height):
+    """
+    :param height: the latest block left, None if there's none
+    :type height: int or None
+    """
+    for asset_name in tape.asset_names(TAPE_FOLDER):
+        _tape_writer(asset_name).truncate(-1 if height is None else height)
+
+
+def open_tape(asset_name):
+    """
+    :rtype: tape.Tape
+    """
+    return tape.Tape(tape.tape_folder(TAPE_FOLDER, asset_name))
+
+
+#the web workers do not load the chained state, they query a read-only snapshot of it in place, shared through mmap,
+#see openexchangelib/snapshot.py. one is published for every block, the last KEEP_SNAPSHOTS ones are kept
+KEEP_SNAPSHOTS = 3
+
+
+def publish_snapshot(chained_state):
+    """
+    the pieces the block didn't change are copied from the latest snapshot, see ChainedState.snapshot_items
+    :type chained_state: ChainedState
+    """
+    previous = snapshot.open_latest(SNAPSHOT_FOLDER)
+    try:
+        data = snapshot.dump_snapshot(chained_state.snapshot_items(previous))
+    finally:
+        if previous is not None:
+            previous.close()
+    snapshot.save_snapshot(SNAPSHOT_FOLDER, data, chained_state.exchange.processed_block_height, KEEP_SNAPSHOTS)
+
+
+def _republish_snapshot():
+    """
+    after blocks are dropped: back to the snapshot of the latest block left, it is written again if it's not kept
+    """
+    height = latest_chained_height()
+    if height is None or height == snapshot.latest_height(SNAPSHOT_FOLDER):
+        return
+    if height in snapshot.snapshot_heights(SNAPSHOT_FOLDER):
+        snapshot.set_latest(SNAPSHOT_FOLDER, height)
+    else:
+        publish_snapshot(load_chained_state(height))
+
+
+def snapshot_version():
+    """
+    O(1), changes whenever a snapshot is published
+    :rtype: tuple or None
+    """
+    return snapshot.version(SNAPSHOT_FOLDER)
+
+
+def open_snapshot(height=None):
+    """
+    :param height: the latest snapshot if None
+    :type height: int or None
+    :return: None if there's none, or it's not kept any more
+    :rtype: Snapshot or None
+    """
+    if height is None:
+        return snapshot.open_latest(SNAPSHOT_FOLDER)
+    return snapshot.open_snapshot(SNAPSHOT_FOLDER, height)
+
+
+def remove_chained_to(height):
+    """
+    :return: heights of the removed checkpoints
+    :rtype: list of int
+    """
+    return journal.remove_to(BLOCK_FOLDER, height)
 
 
 def load_static_data():
@@ -100,9 +289,11 @@ def save_static_data(static_data):
 
 
 def assets_data(chained_state):
-    indexes = [int(f) for f in os.listdir(ASSET_FOLDER)
-               if os.path.isfile(os.path.join(ASSET_FOLDER, f)) and f.isdigit()]
-    return {i: util.load_obj(os.path.join(ASSET_FOLDER, str(i))) for i in set(indexes)-chained_state.used_asset_init_ids}
+    """
+    the unused init data, loaded only when a request asks for them
+    :rtype: AssetInitData
+    """
+    return util.AssetInitData(ASSET_FOLDER, chained_state.used_asset_init_ids)
 
 
 def save_asset_data(obj, index):
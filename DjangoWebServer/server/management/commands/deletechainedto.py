@@ -1,7 +1,6 @@
 #https://docs.djangoproject.com/en/dev/howto/custom-management-commands/#howto-custom-management-commands
 from django.core.management.base import BaseCommand, CommandError
 from server import data_management as dm
-import os
 
 
 class Command(BaseCommand):
@@ -14,12 +13,7 @@ class Command(BaseCommand):
 
         from_height = int(args[0])
 
-        indexes = [int(f) for f in os.listdir(dm.BLOCK_FOLDER)
-                   if os.path.isfile(os.path.join(dm.BLOCK_FOLDER, f)) and f.isdigit()]
-        for index in indexes:
-            if index <= from_height:
-                self.stdout.write('removing %d' % index)
-                dm.remove_data(str(index), dm.BLOCK_FOLDER, silent=True)
-                self.stdout.write('%d removed' % index)
+        for index in dm.remove_chained_to(from_height):
+            self.stdout.write('%d removed' % index)
 
         self.stdout.write('done')
\ No newline at end of file
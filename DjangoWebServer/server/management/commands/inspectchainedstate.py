@@ -1,7 +1,6 @@
 #https://docs.djangoproject.com/en/dev/howto/custom-management-commands/#howto-custom-management-commands
 from django.core.management.base import BaseCommand, CommandError
 from server import data_management as dm
-import os
 
 
 class Command(BaseCommand):
@@ -13,6 +12,6 @@ class Command(BaseCommand):
             raise CommandError('must have one int argument')
 
         block_height = int(args[0])
-        chained_block = dm.load_data(str(block_height), dm.BLOCK_FOLDER)
+        chained_block = dm.load_chained_state(block_height)
 
         self.stdout.write(str(chained_block))
\ No newline at end of file
@@ -1,10 +1,7 @@
 #https://docs.djangoproject.com/en/dev/howto/custom-management-commands/#howto-custom-management-commands
 from django.core.management.base import NoArgsCommand, CommandError
-import openexchangelib
 import server.data_management as dm
-from openexchangelib import types
-from openexchangelib import util
-from server.models import UserPayLog
+from openexchangelib import journal, stream
 import pybit
 import pybit.settings as pybit_settings
 
@@ -13,39 +10,16 @@ bitcoin_config_file = None
 
 
 class Command(NoArgsCommand):
-    help = 'process one more block (if possible)'
+    help = 'apply the blocks processed by the exchange server, or process one more block (if possible)'
 
     def handle_noargs(self, **options):
-        def build_display_order_book(raw_order_book):
-            """
-            :raw_order_book: list of BuyLimitOrder or SellLimitOrder
-            """
-            def add_item(display_book, unit_price, amount):
-                display_book.append([unit_price/100000000.0, amount, unit_price * amount / 100000000.0])
-
-            display_book = []
-            unit_price = None
-            total_amount = 0
-
-            for order in raw_order_book:
-                if order.unit_price != unit_price:
-                    if unit_price is not None:
-                        add_item(display_book, unit_price, total_amount)
-                        if len(display_book) >= 100:
-                            return display_book
-                    unit_price = order.unit_price
-                    total_amount = order.volume_unfulfilled
-                else:
-                    total_amount += order.volume_unfulfilled
-
-            if unit_price is not None:
-                add_item(display_book, unit_price, total_amount)
-            return display_book
-
-        chained_state = dm.pop_chained_state(remove=False)
+        chained_state = dm.pop_chained_state(repair=True)
         if chained_state is None:
             raise CommandError('ChainedState is not initialized yet')
 
+        if stream.exists(dm.STREAM_FOLDER) and self.consume_stream(chained_state):
+            return
+
         latest_block_height = pybit.get_block_count(source=pybit_settings.SOURCE_LOCAL,
                                                     config_file_name=bitcoin_config_file)
         assert latest_block_height >= chained_state.exchange.processed_block_height
@@ -62,104 +36,64 @@ class Command(NoArgsCommand):
 
         if new_block.previous_hash != chained_state.exchange.processed_block_hash:
             self.stdout.write('blockchain is changed, we fall back one block')
-            dm.pop_chained_state(remove=True)
+            dm.rewind_chained_state()
             return
 
         self.stdout.write('working on the new block ...')
-        requests = openexchangelib.process_block(chained_state.exchange, new_block, dm.assets_data(chained_state))
-        address_book = openexchangelib.address_book(chained_state.exchange)
-
-        self.stdout.write('updating all history and used file ids...')
-        for req in requests:
-            assert req.state != types.Request.STATE_NOT_PROCESSED
-
-            assert isinstance(req.transaction, types.Transaction)
-            user_address = req.transaction.input_addresses[0]
-            asset_name = address_book[req.service_address][0]
-
-            #asset related requests
-            if asset_name is not None:
-                if asset_name not in chained_state.recent_requests:
-                    chained_state.recent_requests[asset_name] = []
-                chained_state.recent_requests[asset_name].insert(0, req)
-                if len(chained_state.recent_requests[asset_name]) > 50:
-                    chained_state.recent_requests[asset_name] = chained_state.recent_requests[asset_name][0:50]
-
-            #failed requests history
-            if req.state == types.Request.STATE_FATAL:
-                chained_state.failed_requests.append(req)
-                continue
-
-            #used file ids
-            if isinstance(req, types.CreateAssetRequest):
-                chained_state.used_asset_init_ids.add(req.file_id)
-            if isinstance(req, types.AssetStateControlRequest) and req.request_state%10 in [3, 4]:
-                chained_state.used_asset_init_ids.add(req.request_state // 10)
-
-            #exchange history
-            if isinstance(req, (types.CreateAssetRequest, types.ExchangeStateControlRequest)):
-                chained_state.exchange_history.append(req)
-            elif isinstance(req,
-                            (types.BuyLimitOrderRequest, types.SellLimitOrderRequest, types.BuyMarketOrderRequest,
-                             types.SellMarketOrderRequest, types.ClearOrderRequest, types.TransferRequest,
-                             types.UserVoteRequest)):
-                #user history
-                if asset_name not in chained_state.user_history:
-                    chained_state.user_history[asset_name] = {}
-                if user_address not in chained_state.user_history[asset_name]:
-                    chained_state.user_history[asset_name][user_address] = []
-                chained_state.user_history[asset_name][user_address].append(req)
-
-                if asset_name not in chained_state.recent_trades:
-                        chained_state.recent_trades[asset_name] = []
-                if asset_name not in chained_state.chart_data:
-                        chained_state.chart_data[asset_name] = []
-
-                if isinstance(req, (types.BuyLimitOrderRequest, types.SellLimitOrderRequest)):
-                    #recent trades
-                    chained_state.recent_trades[asset_name] += [ti for ti in req.immediate_executed_trades]
-                    chained_state.recent_trades[asset_name] = chained_state.recent_trades[asset_name][-100:]
-
-                    #chart data
-                    chained_state.chart_data[asset_name] += \
-                        [[util.datetime_to_timestamp(ti.timestamp)*1000, ti.unit_price/100000000.0, ti.amount]
-                            for ti in req.immediate_executed_trades]
-                elif isinstance(req, (types.BuyMarketOrderRequest, types.SellMarketOrderRequest)):
-                    #recent trades
-                    chained_state.recent_trades[asset_name] += [ti for ti in req.trade_history]
-                    chained_state.recent_trades[asset_name] = chained_state.recent_trades[asset_name][-100:]
-
-                    #chart data
-                    chained_state.chart_data[asset_name] += \
-                        [[util.datetime_to_timestamp(ti.timestamp)*1000, ti.unit_price/100000000.0, ti.amount]
-                            for ti in req.trade_history]
-
-            elif isinstance(req, (types.CreateVoteRequest, types.PayRequest, types.AssetStateControlRequest)):
-                #asset history
-                if asset_name not in chained_state.asset_history:
-                    chained_state.asset_history[asset_name] = []
-                chained_state.asset_history[asset_name].append(req)
-
-                #dividend-related
-                if isinstance(req, types.PayRequest):
-                    for ua, u in chained_state.exchange.assets[asset_name].users.iteritems():
-                        if asset_name not in chained_state.user_history:
-                            chained_state.user_history[asset_name] = {}
-                        if ua not in chained_state.user_history[asset_name]:
-                            chained_state.user_history[asset_name][ua] = []
-                        chained_state.user_history[asset_name][ua].append(
-                            UserPayLog(req.transaction, req.block_timestamp, req.DPS, u.total))
-
-        self.stdout.write('rebuilding order book')
-        del chained_state.order_book
-        chained_state.order_book = {}
-
-        for asset_name, asset in chained_state.exchange.assets.iteritems():
-            if asset.sell_order_book or asset.buy_order_book:
-                sell_orders = build_display_order_book(asset.sell_order_book)
-                buy_orders = build_display_order_book(asset.buy_order_book)
-                chained_state.order_book[asset_name] = {'ask': sell_orders, 'bid': buy_orders}
+        asset_init_data = dm.assets_data(chained_state)
+        # taken before processing, the block may change the init data
+        record = journal.dump_entry(chained_state.exchange, new_block, asset_init_data)
+        chained_state.apply_block(new_block, asset_init_data)
 
         self.stdout.write('saving the new chained_state')
-        dm.push_chained_state(chained_state)
+        dm.push_chained_state(chained_state, record)
         self.stdout.write('complete. we advanced one block further to %d' % new_block.height)
+
+    def consume_stream(self, chained_state):
+        """
+        applies the blocks the exchange server published after our cursor, and follows its rewinds
+        :type chained_state: ChainedState
+        :return: False if the stream doesn't have the next block, e.g. it's behind, or pruned past it
+        :rtype: bool
+        """
+        reader = stream.StreamReader(dm.STREAM_FOLDER, dm.STREAM_CONSUMER)
+        #the snapshot is published for the last block applied, or before dropping blocks
+        unpublished = None
+        for seq, item in reader.items():
+            height = chained_state.exchange.processed_block_height
+            if unpublished is not None and (isinstance(item, stream.Rewind) or
+                                            item.previous_hash != chained_state.exchange.processed_block_hash):
+                dm.publish_snapshot(unpublished)
+                unpublished = None
+
+            if isinstance(item, stream.Rewind):
+                if height >= item.height:
+                    self.stdout.write('the exchange server dropped block %d, we fall back' % item.height)
+                    while height >= item.height:
+                        dm.rewind_chained_state()
+                        height -= 1
+                    chained_state = dm.pop_chained_state(repair=True)
+            elif item.height > height + 1:
+                break
+            elif item.height == height + 1:
+                if item.previous_hash != chained_state.exchange.processed_block_hash:
+                    self.stdout.write('blockchain is changed, we fall back one block')
+                    dm.rewind_chained_state()
+                    return True
+
+                record = journal.dump_record(item.height, (item, None))
+                chained_state.apply_block(item, None)
+                dm.push_chained_state(chained_state, record, publish=False)
+                unpublished = chained_state
+                self.stdout.write('applied the processed block at height %d' % item.height)
+            #an item for a block we already have is skipped
+            reader.commit(seq)
+        else:
+            item = None
+
+        if unpublished is not None:
+            dm.publish_snapshot(unpublished)
+        if item is not None:
+            return False
+        self.stdout.write('complete. we are at height %d' % chained_state.exchange.processed_block_height)
+        return True
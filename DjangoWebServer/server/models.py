@@ -1,6 +1,9 @@
-from threading import Lock
-from openexchangelib import types as oel_types
-import os
+from threading import Lock, Thread, Event
+from itertools import islice
+from decimal import Decimal
+import openexchangelib
+from openexchangelib import util, stream, observers, snapshot, candles, tape, types as oel_types
+from openexchangelib.observers import Observer
 import data_management as dm
 
 
@@ -8,10 +11,125 @@ class ChainedStateNotInitError(oel_types.OEBaseException):
     pass
 
 
-class ChainedState(object):
+class StateReloader(object):
+    """
+    keeps the latest state of a web worker: a background thread polls the version, loads a new state aside (the
+    standby buffer), then swaps it in. request threads only take the current one, they never check files or unpickle
+    a state, but the very first time
+    """
+    POLL_INTERVAL = 1.0  # seconds
+
+    def __init__(self, version, load, name):
+        """
+        :param version: function returning something that changes whenever there's a new state, see
+            data_management.snapshot_version
+        :param load: function returning the latest state, or None if there's none yet
+        :param name: of the thread
+        """
+        self._version = version
+        self._load = load
+        self.name = name
+
+        self.current = None
+        self.current_version = None
+        self._lock = Lock()
+        self._thread = None
+        self._stopped = Event()
+
+    def get(self):
+        """
+        :raise ChainedStateNotInitError: if there's no state yet
+        """
+        current = self.current
+        if current is None:
+            self.reload()
+            current = self.current
+            if current is None:
+                raise ChainedStateNotInitError()
+        if self._thread is None:
+            self.start()
+        return current
+
+    def reload(self):
+        """
+        :return: whether a new state is swapped in
+        :rtype: bool
+        """
+        with self._lock:
+            version = self._version()
+            if self.current is not None and version == self.current_version:
+                return False
+            standby = self._load()
+            if standby is None:
+                return False
+            self.current, self.current_version = standby, version
+            return True
+
+    def start(self):
+        import atexit
+
+        with self._lock:
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name=self.name)
+                self._thread.daemon = True
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        logger = util.get_logger('django_server')
+        write_log = util.write_log
+        while not self._stopped.wait(self.POLL_INTERVAL):
+            try:
+                self.reload()
+            except Exception, e:
+                write_log(logger, '%s: reloading failed: %s' % (self.name, e), level='error')
+
+
+#the json apis served from the snapshot, rendered once per block, see ChainedState.api_data: name -> the data
+#returned for an asset without any
+API_DEFAULTS = {
+    'order_book': {'ask': [], 'bid': []},
+    'recent_trades': [],
+    'recent_requests': [],
+}
+_default_payloads = {}
+
+#blocks whose changed users are kept for snapshot_items. a snapshot older than that is rendered in full again
+USER_CHANGES_KEPT = 100
+#trades of the recent_trades api, read from the trade tape
+RECENT_TRADES = 100
+
+
+def json_payload(data):
+    """
+    :return: (json, gzipped json)
+    :rtype: tuple of str
+    """
+    import json
+    import gzip
+    from cStringIO import StringIO
+
+    data = json.dumps(data)
+    buf = StringIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=9, mtime=0) as f:
+        f.write(data)
+    return data, buf.getvalue()
+
+
+def _display_order_book(raw_order_book):
+    """
+    :type raw_order_book: OrderBook
+    """
+    return [[unit_price / 100000000.0, amount, unit_price * amount / 100000000.0]
+            for unit_price, amount in islice(raw_order_book.levels(), 100)]
+
+
+class ChainedState(Observer):
     _lock = Lock()
-    _global_instance = None
-    """:type: ChainedState"""
 
     def __init__(self, lib_exchange, **kwargs):
         """
@@ -28,16 +146,39 @@ class ChainedState(object):
         """:type: list"""
         self.failed_requests = kwargs.get('failed_requests', [])
         """:type: list"""
-        self.recent_trades = kwargs.get('recent_trades', {})
-        """:type: dict from str to list of TradeItem"""
         self.recent_requests = kwargs.get('recent_requests', {})  # asset related orders
         """:type: dict from str to list of Request"""
         self.order_book = kwargs.get('order_book', {})
         """:type: dict"""
-        self.chart_data = kwargs.get('chart_data', {})
+        #candles[asset_name][resolution name], see openexchangelib/candles.py
+        self.candles = kwargs.get('candles', {})
         """:type: dict"""
         self.used_asset_init_ids = kwargs.get('used_asset_init_ids', set())
         """:type: set"""
+        self.processed_block_timestamp = kwargs.get('processed_block_timestamp')
+        """:type: datetime"""
+        #the height each piece of the snapshot last changed at: ('asset', asset_name), ('users', asset_name) when all
+        #its users changed, or ('failed_requests', address), so only the changed pieces are rendered again, see
+        #snapshot_items. kept from block tracked_from on
+        self.changed_at = kwargs.get('changed_at', {})
+        """:type: dict from tuple to int"""
+        #height -> set of (asset_name, user_address) of the users the block changed, of the last USER_CHANGES_KEPT
+        #blocks
+        self.user_changes = kwargs.get('user_changes', {})
+        """:type: dict from int to set"""
+        self.tracked_from = kwargs.get('tracked_from', lib_exchange.processed_block_height)
+        """:type: int"""
+        #the trades of the block being processed
+        self.block_trades = {}
+        """:type: dict from str to list of (TradeItem, order index)"""
+        #the trades of the blocks applied since the state was pushed as rows of the trade tape, see tape.trade_row: the
+        #block just processed, after a crash also the blocks replayed from the journal, which the tape may have lost.
+        #taken out for the tape when the state is pushed, see data_management.push_chained_state
+        self.trade_rows = {}
+        """:type: dict from str to list of tuple"""
+        #the pieces the block being processed changes, see changed_at
+        self.block_changes = set()
+        """:type: set of tuple"""
 
     @classmethod
     def acquire_lock(cls):
@@ -47,28 +188,325 @@ class ChainedState(object):
     def release_lock(cls):
         cls._lock.release()
 
-    @classmethod
-    def get_latest_state(cls):
-        if cls._global_instance:
-            height = cls._global_instance.exchange.processed_block_height
-            if not os.path.isfile(os.path.join(dm.BLOCK_FOLDER, str(height+1))):
-                return cls._global_instance
+    def _user_history(self, asset_name, user_address):
+        """
+        :rtype: list
+        """
+        return self.user_history.setdefault(asset_name, {}).setdefault(user_address, [])
+
+    def _upgrade(self):
+        """
+        a state saved by an older version: the changes are tracked from now on, every trade it kept as chart data is
+        only kept in its candles, and the candles of resolutions added or dropped since are built again from the tape.
+        the recent trades are read from the tape
+        """
+        if 'changed_at' not in self.__dict__:
+            self.changed_at, self.tracked_from = {}, self.exchange.processed_block_height
+        if 'user_changes' not in self.__dict__:
+            self.user_changes, self.tracked_from = {}, self.exchange.processed_block_height
+        self.__dict__.pop('recent_trades', None)
+        if 'chart_data' in self.__dict__:
+            all_candles = self.__dict__.setdefault('candles', {})
+            for asset_name, points in self.__dict__.pop('chart_data').iteritems():
+                if asset_name not in all_candles and points:
+                    all_candles[asset_name] = candles.build(points)
+        for asset_name, asset_candles in self.candles.items():
+            if sorted(asset_candles) != sorted(candles.RESOLUTIONS):
+                trade_tape = dm.open_tape(asset_name)
+                try:
+                    self.candles[asset_name] = candles.build_from_tape(
+                        trade_tape, trade_tape.first_after(self.exchange.processed_block_height))
+                finally:
+                    trade_tape.close()
+
+    def _candles(self, asset_name):
+        """
+        :rtype: dict from str to candles.Candles
+        """
+        if asset_name not in self.candles:
+            self.candles[asset_name] = candles.build([])
+        return self.candles[asset_name]
+
+    def _user_request(self, req, asset_name):
+        self._user_history(asset_name, req.transaction.input_addresses[0]).append(req)
+
+    def on_request(self, req, asset_name):
+        assert req.state != oel_types.Request.STATE_NOT_PROCESSED
+        assert isinstance(req.transaction, oel_types.Transaction)
+
+        #asset related requests
+        if asset_name is not None:
+            self.block_changes.add(('asset', asset_name))
+            recent_requests = self.recent_requests.setdefault(asset_name, [])
+            recent_requests.insert(0, req)
+            del recent_requests[50:]
 
-        latest_cs = dm.pop_chained_state()
-        if latest_cs is None:
-            raise ChainedStateNotInitError()
+    def on_failed(self, req, asset_name):
+        self.failed_requests.append(req)
+        self.block_changes.add(('failed_requests', req.transaction.input_addresses[0]))
+
+    def on_init_data_used(self, req, asset_name, index):
+        self.used_asset_init_ids.add(index)
+
+    def on_asset_created(self, req, asset_name):
+        self.exchange_history.append(req)
+
+    def on_state_control(self, req, asset_name):
+        if asset_name is None:
+            self.exchange_history.append(req)
         else:
-            cls.acquire_lock()
-            cls._global_instance = latest_cs
-            cls.release_lock()
-        return cls._global_instance
+            self.asset_history.setdefault(asset_name, []).append(req)
+
+    def on_order_placed(self, req, asset_name):
+        self._user_request(req, asset_name)
+
+    def on_trade(self, req, asset_name, trades):
+        order_index = getattr(req, 'order_index', None)
+        self.block_trades.setdefault(asset_name, []).extend((trade, order_index) for trade in trades)
+
+    def on_cancel(self, req, asset_name):
+        self._user_request(req, asset_name)
+
+    def on_transfer(self, req, asset_name):
+        self._user_request(req, asset_name)
+
+    def on_vote(self, req, asset_name):
+        if isinstance(req, oel_types.UserVoteRequest):
+            self._user_request(req, asset_name)
+        else:
+            self.asset_history.setdefault(asset_name, []).append(req)
+
+    def on_dividend(self, req, asset_name, asset):
+        self.block_changes.add(('users', asset_name))
+        self.asset_history.setdefault(asset_name, []).append(req)
+        for ua, u in asset.users.iteritems():
+            self._user_history(asset_name, ua).append(UserPayLog(req.transaction, req.block_timestamp, req.DPS, u.total))
+
+    def apply_block(self, block, asset_init_data):
+        """
+        processes the block, or takes it processed from the stream. the chained state observes the requests to update
+        histories and used init ids, then the display order books of the changed assets are rebuilt
+        :type block: Block or stream.ProcessedBlock
+        :param asset_init_data: None for a processed block
+        :type asset_init_data: dict or None
+        :rtype: list of Request
+        """
+        self._upgrade()
+        self.block_trades = {}
+        self.block_changes = set()
+        trade_rows = self.__dict__.setdefault('trade_rows', {})
+        assets_before = dict(self.exchange.assets)
+        if isinstance(block, stream.ProcessedBlock):
+            requests = block.apply_to(self.exchange)
+            observers.notify_all([self], requests, self.exchange)
+            reinitialized, user_addresses = set(block.new_assets), block.users
+        else:
+            changes = stream.ChangeCollector(self.exchange)
+            requests = openexchangelib.process_block(self.exchange, block, asset_init_data, [self, changes])
+            reinitialized, user_addresses = set(changes.reinitialized), changes.user_addresses
+        self.processed_block_timestamp = block.timestamp
+
+        #created or re-initialized assets
+        for asset_name, asset in self.exchange.assets.iteritems():
+            if assets_before.get(asset_name) is not asset:
+                reinitialized.add(asset_name)
+        for asset_name in reinitialized:
+            self.block_changes.update([('asset', asset_name), ('users', asset_name)])
+        height = self.exchange.processed_block_height
+        for change in self.block_changes:
+            self.changed_at[change] = height
+        self.user_changes[height] = set((asset_name, user_address)
+                                        for asset_name, addresses in user_addresses.iteritems()
+                                        for user_address in addresses)
+        for old_height in [h for h in self.user_changes if h <= height - USER_CHANGES_KEPT]:
+            del self.user_changes[old_height]
+        self.tracked_from = max(self.tracked_from, height - USER_CHANGES_KEPT)
+        #the trades go to the tape when the state is pushed, the candles take the same rows
+        for asset_name, trades in self.block_trades.iteritems():
+            rows = [tape.trade_row(trade, height, order_index) for trade, order_index in trades]
+            trade_rows.setdefault(asset_name, []).extend(rows)
+            candles.add_rows(self._candles(asset_name), rows)
+
+        #rebuild the order books of the changed assets
+        for kind, asset_name in self.block_changes:
+            if kind != 'asset':
+                continue
+            asset = self.exchange.assets[asset_name]
+            if asset.sell_order_book or asset.buy_order_book:
+                sell_orders = _display_order_book(asset.sell_order_book)
+                buy_orders = _display_order_book(asset.buy_order_book)
+                self.order_book[asset_name] = {'ask': sell_orders, 'bid': buy_orders}
+            else:
+                self.order_book.pop(asset_name, None)
+        self.block_trades = {}
+        self.block_changes = set()
+
+        return requests
+
+    def _changed_since(self, previous):
+        """
+        :type previous: snapshot.Snapshot or None
+        :return: the height of the previous snapshot, None if it can't be reused: the changes after it are not all
+        tracked, or it's not older than the state
+        :rtype: int or None
+        """
+        import cPickle
+
+        if previous is None or snapshot.key('block') not in previous:
+            return None
+        height = cPickle.loads(previous.get(snapshot.key('block')))[0]
+        if height is None or not self.tracked_from <= height < self.exchange.processed_block_height:
+            return None
+        return height
+
+    def snapshot_items(self, previous=None):
+        """
+        the chained state cut into the pieces the views ask for, see SharedState. given the snapshot of an earlier
+        block, only the assets and users changed since are rendered again, the other pieces are copied from it
+        :type previous: snapshot.Snapshot or None
+        :return: generator of (key, value)
+        """
+        self._upgrade()
+        dump = util.dump_obj
+        key = snapshot.key
+        assets = self.exchange.assets
+        since = self._changed_since(previous)
+        if since is None:
+            asset_names = list(assets)
+            whole_assets = set(assets)
+            changed_users = []
+            failed_addresses = None
+        else:
+            changes = [change for change, height in self.changed_at.iteritems() if height > since]
+            asset_names = [name for kind, name in changes if kind == 'asset' and name in assets]
+            #the assets whose users all changed, the other users are rendered again one by one
+            whole_assets = set(name for kind, name in changes if kind == 'users' and name in assets)
+            changed_users = set()
+            for height in xrange(since + 1, self.exchange.processed_block_height + 1):
+                changed_users.update(self.user_changes.get(height, ()))
+            changed_users = [(asset_name, user_address) for asset_name, user_address in changed_users
+                             if asset_name in assets and asset_name not in whole_assets]
+            failed_addresses = set(address for kind, address in changes if kind == 'failed_requests')
+
+        user_addresses = set(user_address for asset_name, user_address in changed_users)
+        for asset_name in whole_assets:
+            user_addresses.update(assets[asset_name].users)
+
+        if since is not None:
+            #users who left a re-initialized asset
+            for asset_name in whole_assets:
+                prefix = key('user', asset_name, '')
+                user_addresses.update(k[len(prefix):] for k in previous.keys(prefix))
+            replaced = set([key('block'), key('assets')])
+            replaced.update(key('asset', asset_name) for asset_name in asset_names)
+            replaced.update(key(kind, name, asset_name) for asset_name in asset_names
+                            for kind in ['json', 'json.gz'] for name in API_DEFAULTS)
+            replaced.update(key(kind, asset_name, user_address) for asset_name, user_address in changed_users
+                            for kind in ['user', 'user_history'])
+            replaced.update(key('user_assets', user_address) for user_address in user_addresses)
+            replaced.update(key('failed_requests', user_address) for user_address in failed_addresses)
+            replaced_prefixes = tuple(key(kind, asset_name, '') for asset_name in asset_names
+                                      for kind in ['vote', 'candles'])
+            replaced_prefixes += tuple(key(kind, asset_name, '') for asset_name in whole_assets
+                                       for kind in ['user', 'user_history'])
+            for k, value in previous.items():
+                if k not in replaced and not k.startswith(replaced_prefixes):
+                    yield k, value
+
+        yield key('block'), dump((self.exchange.processed_block_height, self.exchange.processed_block_hash,
+                                  self.__dict__.get('processed_block_timestamp')))
+        yield key('assets'), dump(list(assets))
+        for asset_name in asset_names:
+            asset = assets[asset_name]
+            yield key('asset', asset_name), dump({k: v for k, v in asset.__dict__.iteritems() if k.endswith('_address')})
+            for vote_id, vote in asset.votes.iteritems():
+                yield key('vote', asset_name, vote_id), dump(vote)
+        for asset_name in whole_assets:
+            for user_address, user in assets[asset_name].users.iteritems():
+                yield key('user', asset_name, user_address), dump(user)
+        for asset_name, user_address in changed_users:
+            if user_address in assets[asset_name].users:
+                yield key('user', asset_name, user_address), dump(assets[asset_name].users[user_address])
+        for user_address in user_addresses:
+            user_assets = [asset_name for asset_name, asset in assets.iteritems() if user_address in asset.users]
+            if user_assets:
+                yield key('user_assets', user_address), dump(user_assets)
+
+        for asset_name in whole_assets:
+            for user_address, history in self.user_history.get(asset_name, {}).iteritems():
+                yield key('user_history', asset_name, user_address), dump(history)
+        for asset_name, user_address in changed_users:
+            if user_address in self.user_history.get(asset_name, {}):
+                yield key('user_history', asset_name, user_address), dump(self.user_history[asset_name][user_address])
+        if failed_addresses is None or failed_addresses:
+            failed_requests = {}
+            for req in self.failed_requests:
+                user_address = req.transaction.input_addresses[0]
+                if failed_addresses is None or user_address in failed_addresses:
+                    failed_requests.setdefault(user_address, []).append(req)
+            for user_address, requests in failed_requests.iteritems():
+                yield key('failed_requests', user_address), dump(requests)
+
+        for asset_name in asset_names:
+            if asset_name in self.candles:
+                for resolution, c in self.candles[asset_name].iteritems():
+                    yield key('candles', asset_name, resolution), c.dump()
+
+        for name in API_DEFAULTS:
+            for asset_name in asset_names:
+                data = self.api_data(name, asset_name)
+                if data is not None:
+                    payload, gzip_payload = json_payload(data)
+                    yield key('json', name, asset_name), payload
+                    yield key('json.gz', name, asset_name), gzip_payload
+
+    def _recent_trade_rows(self, asset_name):
+        """
+        the latest RECENT_TRADES trades of the asset on its trade tape, up to the block of the state
+        :rtype: list of tuple
+        """
+        trade_tape = dm.open_tape(asset_name)
+        try:
+            end = trade_tape.first_after(self.exchange.processed_block_height)
+            return trade_tape.rows(max(0, end - RECENT_TRADES), end)
+        finally:
+            trade_tape.close()
+
+    def api_data(self, name, asset_name):
+        """
+        the data of an asset the json apis return, see API_DEFAULTS
+        :type name: str
+        :type asset_name: str
+        :return: None if the asset has none
+        """
+        if name == 'recent_trades':
+            return [
+                [
+                    util.timestamp_to_datetime(time // 1000).strftime("%a, %d-%b-%Y %H:%M:%S GMT"),
+                    'Buy' if side == oel_types.TradeItem.TRADE_TYPE_BUY else 'Sell',
+                    str(Decimal(price) / 100000000),
+                    volume,
+                    str(Decimal(price) * volume / 100000000),
+                ] for time, price, volume, side, height, order_index in self._recent_trade_rows(asset_name)
+            ] or None
+        value = getattr(self, name).get(asset_name)
+        if value is None:
+            return None
+        if name == 'recent_requests':
+            return [{
+                        'time': d.block_timestamp.strftime("%d-%b-%Y %H:%M:%S GMT"),
+                        'tx': d.transaction.hash,
+                        'in': d.transaction.input_addresses[0],
+                        'error_msg': d.readable_message() if d.message else None
+                    } for d in value
+            ]
+        return value
 
     def __str__(self):
         return "Exchange: %s\nUser history: %s\nAsset history: %s\nExchange history: %s\nFailed requests: %s\n" \
-               "Recent trades:%s\nOrder book: %s\nChart data: %s\nUsed asset init IDs: %s\n" % \
+               "Order book: %s\nUsed asset init IDs: %s\n" % \
                (str(self.exchange), str(self.user_history), str(self.asset_history), str(self.exchange_history),
-               str(self.failed_requests), str(self.recent_trades), str(self.order_book), str(self.chart_data),
-               str(self.used_asset_init_ids))
+               str(self.failed_requests), str(self.order_book), str(self.used_asset_init_ids))
 
     def __unicode__(self):
         return unicode(str(self))
@@ -77,6 +515,119 @@ class ChainedState(object):
         return str(self)
 
 
+class SharedState(object):
+    """
+    the latest chained state as the web workers see it: the published snapshot, mapped into memory and shared by all
+    the workers. the pieces are unpickled on demand, see ChainedState.snapshot_items. a new block swaps the snapshot
+    """
+    _lock = Lock()
+    _reloader = None
+    """:type: StateReloader"""
+    #the states of the older snapshots asked for by height, while the latest state stays the same
+    _older_states = {}
+    _older_states_of = None
+
+    def __init__(self, state_snapshot):
+        """
+        :type state_snapshot: snapshot.Snapshot
+        """
+        self.snapshot = state_snapshot
+        self.height, self.block_hash, self.block_timestamp = self.get(('block',), (None, None, None))
+
+    @classmethod
+    def _load_latest(cls):
+        """
+        :return: None if no snapshot of a block is published yet
+        :rtype: SharedState or None
+        """
+        latest_snapshot = dm.open_snapshot()
+        if latest_snapshot is None:
+            return None
+        latest = cls(latest_snapshot)
+        if latest.height is None:
+            latest_snapshot.close()
+            return None
+        return latest
+
+    @classmethod
+    def get_latest_state(cls):
+        """
+        the state kept up to date by a StateReloader, the old snapshot is unmapped once no request uses it
+        :rtype: SharedState
+        """
+        if cls._reloader is None:
+            with cls._lock:
+                if cls._reloader is None:
+                    cls._reloader = StateReloader(dm.snapshot_version, cls._load_latest, 'snapshot reloader')
+        return cls._reloader.get()
+
+    @classmethod
+    def get_state_at(cls, height):
+        """
+        the state after block `height`, if its snapshot is still kept, see data_management.KEEP_SNAPSHOTS
+        :type height: int
+        :rtype: SharedState or None
+        :raise ChainedStateNotInitError: if there's no state yet
+        """
+        latest = cls.get_latest_state()
+        if latest.height == height:
+            return latest
+        with cls._lock:
+            if cls._older_states_of is not latest:
+                cls._older_states, cls._older_states_of = {}, latest
+            state = cls._older_states.get(height)
+            if state is None and height < latest.height:
+                # only the snapshots found are kept, a miss costs one failed open and takes no memory
+                older_snapshot = dm.open_snapshot(height)
+                if older_snapshot is not None:
+                    state = cls._older_states[height] = cls(older_snapshot)
+            return state
+
+    def get(self, key_parts, default=None):
+        """
+        :param key_parts: e.g. ('user_history', asset_name, user_address)
+        :type key_parts: tuple
+        """
+        import cPickle
+
+        value = self.snapshot.get(snapshot.key(*key_parts))
+        return default if value is None else cPickle.loads(value)
+
+    def get_candles(self, asset_name, resolution, from_time=None, to_time=None, limit=None):
+        """
+        read in place from the snapshot, see candles.query
+        :type asset_name: str
+        :param resolution: see candles.RESOLUTIONS
+        :type resolution: str
+        :rtype: list of list
+        """
+        packed = self.snapshot.get_buffer(snapshot.key('candles', asset_name, resolution))
+        return [] if packed is None else candles.query(packed, from_time, to_time, limit)
+
+    def count_candles(self, asset_name, resolution, from_time=None, to_time=None):
+        """
+        see get_candles and candles.count
+        :rtype: int
+        """
+        packed = self.snapshot.get_buffer(snapshot.key('candles', asset_name, resolution))
+        return 0 if packed is None else candles.count(packed, from_time, to_time)
+
+    def get_json(self, name, asset_name, gzipped=False):
+        """
+        the payload of a json api as rendered by the block processor, see ChainedState.api_data
+        :type name: str
+        :type asset_name: str
+        :param gzipped: the gzipped payload
+        :rtype: str
+        """
+        payload = self.snapshot.get(snapshot.key('json.gz' if gzipped else 'json', name, asset_name))
+        if payload is None:
+            if name not in _default_payloads:
+                _default_payloads[name] = json_payload(API_DEFAULTS[name])
+            payload = _default_payloads[name][1 if gzipped else 0]
+        return payload
+
+
 class StaticData(object):
     """
     data have nothing to do with bitcoin block chain
@@ -28,6 +28,13 @@ urlpatterns = patterns('',
        (r'^user/auth$', auth),
        (r'^asset/(?P<asset_name>[A-Za-z\-_0-9]+)/recent-trades$', recent_trades),
        (r'^asset/(?P<asset_name>[A-Za-z\-_0-9]+)/recent-requests', recent_requests),
+       #the same apis at a block, given by <height>-<block hash>, their responses never change. once the state of the
+       #block is not kept, they redirect to the apis above
+       (r'^h/(?P<block>[0-9]+-[0-9a-f]+)/chart-data/(?P<asset_name>[A-Za-z\-_0-9]+)$', chart_data),
+       (r'^h/(?P<block>[0-9]+-[0-9a-f]+)/orderbook/(?P<asset_name>[A-Za-z\-_0-9]+)$', asset_order_book),
+       (r'^h/(?P<block>[0-9]+-[0-9a-f]+)/vote/(?P<asset_name>[A-Za-z\-_0-9]+)/(?P<vote_id>[1-9][0-9]*)$', vote_status),
+       (r'^h/(?P<block>[0-9]+-[0-9a-f]+)/asset/(?P<asset_name>[A-Za-z\-_0-9]+)/recent-trades$', recent_trades),
+       (r'^h/(?P<block>[0-9]+-[0-9a-f]+)/asset/(?P<asset_name>[A-Za-z\-_0-9]+)/recent-requests$', recent_requests),
        ##################### for local testing, delete or comment out these handlers in production
         (r'^403$', handler403),
         (r'^404$', handler404),
@@ -1,10 +1,11 @@
-from django.http import HttpResponse, Http404
+from django.http import HttpResponse, HttpResponseNotModified, HttpResponseBadRequest, HttpResponseRedirect, Http404
+from django.utils.http import http_date
 from django.shortcuts import render_to_response
 import json
 from openexchangelib import util
-from openexchangelib import types
+from openexchangelib import types, candles
 import functools
-from models import ChainedState, UserPayLog, StaticData
+from models import SharedState, UserPayLog, StaticData
 import helpers
 from decimal import Decimal
 
@@ -12,6 +13,8 @@ from decimal import Decimal
 logger = util.get_logger('django_server')
 write_log = functools.partial(util.write_log, logger)
 OneHundredMillionF = 100000000.0
+MAX_CANDLES = 1000  # per chart-data response
+EXPIRED_MAX_AGE = 60  # seconds, of the redirect from a block qualified url whose state is not kept
 
 ####################custmize some default pages#######
 def forbidden_403(request):
@@ -37,7 +40,7 @@ def market(request):
             'name': asset_name,
             'url': '/asset/' + asset_name,
             'img_url': '/static/img/' + asset_name + '.jpg'
-        } for asset_name in ChainedState.get_latest_state().exchange.assets
+        } for asset_name in SharedState.get_latest_state().get(('assets',), [])
     ]
     asset_rows = [
         assets[i * 3: i * 3 + 3]
@@ -88,33 +91,25 @@ def account(request, asset_name, user_address):
             else:
                 raise NotImplementedError()
 
-    chained_state = ChainedState.get_latest_state()
+    shared_state = SharedState.get_latest_state()
+    user_history = shared_state.get(('user_history', asset_name, user_address), [])
 
-    try:
-        tradings = [t for t in chained_state.user_history[asset_name][user_address]
-                    if
-                    isinstance(t, (types.BuyLimitOrderRequest, types.SellLimitOrderRequest, types.BuyMarketOrderRequest,
-                                   types.SellMarketOrderRequest, types.TransferRequest))]
-    except:
-        tradings = []
+    tradings = [t for t in user_history
+                if
+                isinstance(t, (types.BuyLimitOrderRequest, types.SellLimitOrderRequest, types.BuyMarketOrderRequest,
+                               types.SellMarketOrderRequest, types.TransferRequest))]
     if tradings:
         trade_html = get_html(tradings)
     else:
         trade_html = "<ul><li>Empty</li></ul>"
 
-    try:
-        pays = [t for t in chained_state.user_history[asset_name][user_address] if isinstance(t, UserPayLog)]
-    except:
-        pays = []
+    pays = [t for t in user_history if isinstance(t, UserPayLog)]
     if pays:
         pay_html = get_html(pays)
     else:
         pay_html = "<ul><li>Empty</li></ul>"
 
-    try:
-        failures = [t for t in chained_state.failed_requests if t.transaction.input_addresses[0] == user_address]
-    except:
-        failures = []
+    failures = shared_state.get(('failed_requests', user_address), [])
     if failures:
         failures_html = "<ul>%s</ul>" % (''.join(
             ["<li>%s  Transaction hash: <a href=\"http://blockchain.info/tx/%s\" target=\"_blank\">%s</a> Reason: %s</li>" %
@@ -136,11 +131,10 @@ def help(request):
 
 
 def asset(request, asset_name):
-    chained_state = ChainedState.get_latest_state()
-    if asset_name not in chained_state.exchange.assets:
+    asset = SharedState.get_latest_state().get(('asset', asset_name))
+    if asset is None:
         raise Http404
 
-    asset = chained_state.exchange.assets[asset_name]
     static_data = StaticData.get_static_data()
     try:
         asset_intro = static_data.asset_descriptions[asset_name]
@@ -150,82 +144,187 @@ def asset(request, asset_name):
     return render_to_response('asset.html',
                               {
                                   'asset_name': asset_name,
-                                  'limit_buy_address': asset.limit_buy_address,
-                                  'limit_sell_address': asset.limit_sell_address,
-                                  'market_buy_address': asset.market_buy_address,
-                                  'market_sell_address': asset.market_sell_address,
-                                  'clear_order_address': asset.clear_order_address,
+                                  'limit_buy_address': asset['limit_buy_address'],
+                                  'limit_sell_address': asset['limit_sell_address'],
+                                  'market_buy_address': asset['market_buy_address'],
+                                  'market_sell_address': asset['market_sell_address'],
+                                  'clear_order_address': asset['clear_order_address'],
                                   'asset_intro': asset_intro
                               })
 
 #########################apis####################
 
 
-def chart_data(request, asset_name):
+def _shared_state(block):
+    """
+    :param block: '<height>-<block hash>' from a block qualified url, None for the latest state
+    :type block: str or None
+    :return: None if the state of the block is not kept any more, see _latest_redirect
+    :rtype: SharedState or None
+    """
+    if block is None:
+        return SharedState.get_latest_state()
+    height, block_hash = block.split('-', 1)
+    shared_state = SharedState.get_state_at(int(height))
+    #a block dropped by a reorg is not found, even if a block of the same height is
+    if shared_state is None or shared_state.block_hash != block_hash:
+        return None
+    return shared_state
+
+
+def _latest_redirect(request, block):
+    """
+    only the latest snapshots are kept, a block qualified url outlives the state of its block: it's sent to the same
+    api of the latest state. the redirect is cached briefly, unlike the immutable responses of the block
+    :param block: see _shared_state
+    """
+    response = HttpResponseRedirect(request.get_full_path().replace('/h/%s/' % block, '/', 1))
+    response['Cache-Control'] = 'public, max-age=%d' % EXPIRED_MAX_AGE
+    return response
+
+
+def _not_modified(request, etag, last_modified):
+    """
+    If-None-Match wins over If-Modified-Since. block times are not monotonic, so Last-Modified only matches exactly
+    """
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        tags = [t.strip() for t in if_none_match.split(',')]
+        return '*' in tags or etag in [t[2:] if t.startswith('W/') else t for t in tags]
+    return last_modified is not None and request.META.get('HTTP_IF_MODIFIED_SINCE') == last_modified
+
+
+def _cached_api(request, shared_state, immutable, render, can_gzip=False):
+    """
+    a json api response with validators derived from the block of the state: a client polling between blocks gets
+    304 Not Modified. the responses of block qualified urls never change, they may be cached forever
+    :type shared_state: SharedState
+    :param immutable: whether the url is block qualified
+    :type immutable: bool
+    :param render: function(gzipped) returning the body
+    :param can_gzip: whether render can return a gzipped body
+    """
+    gzipped = can_gzip and 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+    if shared_state.height is None:
+        etag = last_modified = None
+    else:
+        #the leading digits of a block hash are zeros, the whole of it tells the blocks apart
+        etag = '"%s%s"' % (shared_state.block_hash, '-gz' if gzipped else '')
+        last_modified = None if shared_state.block_timestamp is None \
+            else http_date(util.datetime_to_timestamp(shared_state.block_timestamp))
+
+    if etag is not None and _not_modified(request, etag, last_modified):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(render(gzipped), mimetype="application/json")
+        if gzipped:
+            response['Content-Encoding'] = 'gzip'
+    if etag is not None:
+        response['ETag'] = etag
+        response['X-Block-Height'] = str(shared_state.height)
+        response['X-Block-Hash'] = shared_state.block_hash
+    if last_modified is not None:
+        response['Last-Modified'] = last_modified
+    response['Cache-Control'] = 'public, max-age=31536000, immutable' if immutable else 'no-cache'
+    if can_gzip:
+        response['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def _json_api(request, name, asset_name, block):
     """
+    returns the payload rendered by the block processor as is, gzipped if the client accepts it
+    :type name: str
     :type asset_name: str
+    :param block: see _shared_state
+    """
+    shared_state = _shared_state(block)
+    if shared_state is None:
+        return _latest_redirect(request, block)
+    return _cached_api(request, shared_state, block is not None,
+                       lambda gzipped: shared_state.get_json(name, asset_name, gzipped), can_gzip=True)
+
+
+def _chart_resolution(shared_state, asset_name, from_time, to_time):
+    """
+    the finest resolution that shows the whole range in MAX_CANDLES candles, else the coarsest one
+    :rtype: str
     """
-    return HttpResponse(json.dumps(ChainedState.get_latest_state().chart_data.get(asset_name, [])),
-                        mimetype="application/json")
+    by_length = sorted(candles.RESOLUTIONS, key=candles.RESOLUTIONS.get)
+    for resolution in by_length[:-1]:
+        if shared_state.count_candles(asset_name, resolution, from_time, to_time) <= MAX_CANDLES:
+            return resolution
+    return by_length[-1]
 
 
-def vote_status(request, asset_name, vote_id):
-    chained_state = ChainedState.get_latest_state()
+def chart_data(request, asset_name, block=None):
+    """
+    the candles of a range: ?res=1m|1h|1d&from=&to=, times in milliseconds, all optional. at most MAX_CANDLES, the
+    latest ones of the range. without ?res=, the candles of _chart_resolution as [open time, close, volume] points,
+    so the whole history is shown by default
+    :type asset_name: str
+    """
+    resolution = request.GET.get('res')
     try:
-        vote = chained_state.exchange.assets[asset_name].votes[int(vote_id)]
-    except:
-        vote = types.Vote(start_time=None, expire_time=None, vote_stat={})
+        from_time, to_time = [int(request.GET[p]) if request.GET.get(p) else None for p in ['from', 'to']]
+    except ValueError:
+        return HttpResponseBadRequest()
+    if resolution is not None and resolution not in candles.RESOLUTIONS:
+        return HttpResponseBadRequest()
+
+    shared_state = _shared_state(block)
+    if shared_state is None:
+        return _latest_redirect(request, block)
+
+    def render(gzipped):
+        if resolution is not None:
+            return json.dumps(shared_state.get_candles(asset_name, resolution, from_time, to_time, MAX_CANDLES))
+        rows = shared_state.get_candles(asset_name, _chart_resolution(shared_state, asset_name, from_time, to_time),
+                                        from_time, to_time, MAX_CANDLES)
+        return json.dumps([[row[0], row[4], row[5]] for row in rows])
+
+    return _cached_api(request, shared_state, block is not None, render)
+
+
+def vote_status(request, asset_name, vote_id, block=None):
+    shared_state = _shared_state(block)
+    if shared_state is None:
+        return _latest_redirect(request, block)
+
+    def render(gzipped):
+        try:
+            vote = shared_state.get(('vote', asset_name, int(vote_id)))
+        except ValueError:
+            vote = None
+        if vote is None:
+            vote = types.Vote(start_time=None, expire_time=None, vote_stat={})
 
-    data = {
-        'start_time': None if vote.start_time is None else vote.start_time.strftime("%a, %d-%b-%Y %H:%M:%S GMT"),
-        'expire_time': None if vote.expire_time is None else vote.expire_time.strftime("%a, %d-%b-%Y %H:%M:%S GMT"),
-        'stat': vote.vote_stat
-    }
+        data = {
+            'start_time': None if vote.start_time is None else vote.start_time.strftime("%a, %d-%b-%Y %H:%M:%S GMT"),
+            'expire_time': None if vote.expire_time is None else vote.expire_time.strftime("%a, %d-%b-%Y %H:%M:%S GMT"),
+            'stat': vote.vote_stat
+        }
+        return json.dumps(data)
 
-    return HttpResponse(json.dumps(data), mimetype="application/json")
+    return _cached_api(request, shared_state, block is not None, render)
 
 
-def asset_order_book(request, asset_name):
-    return HttpResponse(json.dumps(ChainedState.get_latest_state().order_book.get(asset_name, {'ask': [], 'bid': []})),
-                        mimetype="application/json")
+def asset_order_book(request, asset_name, block=None):
+    return _json_api(request, 'order_book', asset_name, block)
 
 
-def recent_trades(request, asset_name):
+def recent_trades(request, asset_name, block=None):
     """
     :type asset_name: str
     """
-    chained_state = ChainedState.get_latest_state()
-    raw_data = chained_state.recent_trades.get(asset_name, [])
-    """:type: list of types.TradeItem"""
-
-    data = [
-        [
-            d.timestamp.strftime("%a, %d-%b-%Y %H:%M:%S GMT"),
-            'Buy' if d.trade_type == types.TradeItem.TRADE_TYPE_BUY else 'Sell',
-            str(Decimal(d.unit_price) / 100000000),
-            d.amount,
-            str(Decimal(d.unit_price) * d.amount / 100000000),
-        ] for d in raw_data
-    ]
-    return HttpResponse(json.dumps(data), mimetype="application/json")
+    return _json_api(request, 'recent_trades', asset_name, block)
 
 
-def recent_requests(request, asset_name):
+def recent_requests(request, asset_name, block=None):
     """
     :type asset_name: str
     """
-    chained_state = ChainedState.get_latest_state()
-    raw_data = chained_state.recent_requests.get(asset_name, [])
-    """:type: list of types.Request"""
-
-    data = [{
-                'time': d.block_timestamp.strftime("%d-%b-%Y %H:%M:%S GMT"),
-                'tx': d.transaction.hash,
-                'in': d.transaction.input_addresses[0],
-                'error_msg': d.readable_message() if d.message else None
-            } for d in raw_data
-    ]
-    return HttpResponse(json.dumps(data), mimetype="application/json")
+    return _json_api(request, 'recent_requests', asset_name, block)
 
 
 def asset_page_login(request, asset_name, user_address):
@@ -233,18 +332,15 @@ def asset_page_login(request, asset_name, user_address):
     :type asset_name: str
     :type user_address: str
     """
-    assets = ChainedState.get_latest_state().exchange.assets
+    user = SharedState.get_latest_state().get(('user', asset_name, user_address))
     default_data = {
         'balance': 'Total:0, Available:0, Freeze:0',
         'active_orders': []
     }
 
-    if asset_name not in assets:
-        data = default_data
-    elif user_address not in assets[asset_name].users:
+    if user is None:
         data = default_data
     else:
-        user = assets[asset_name].users[user_address]
         data = {
             'balance': 'Total:%d Available:%d In Order Book:%d' % (
                 user.total, user.available, user.total - user.available),
@@ -271,17 +367,19 @@ def auth(request):
             request.session['address'] = address
         address = request.session.get('address')
 
+        shared_state = SharedState.get_latest_state()
+        assets = []
+        for asset_name in shared_state.get(('user_assets', address), []):
+            user = shared_state.get(('user', asset_name, address))
+            assets.append({
+                'asset_name': asset_name,
+                'asset_transfer_address': shared_state.get(('asset', asset_name))['transfer_address'],
+                'total': user.total,
+                'available': user.available,
+            })
         return HttpResponse(json.dumps({
             'address': address,
-            'assets': [
-                {
-                    'asset_name': asset_name,
-                    'asset_transfer_address': asset.transfer_address,
-                    'total': asset.users[address].total,
-                    'available': asset.users[address].available,
-                } for asset_name, asset in ChainedState.get_latest_state().exchange.assets.iteritems() if
-                address in asset.users
-            ]}), mimetype="application/json")
+            'assets': assets}), mimetype="application/json")
     else:
         for key in request.session.keys():
             del request.session[key]
@@ -1,14 +1,14 @@
-from openexchangelib import util
+from openexchangelib import util, journal, stream
 import openexchangelib.settings as oel_settings
 import os
-from ext_types import DataFileDoesNotExistError, FileAlreadyExistError
+from ext_types import DataFileDoesNotExistError
 
 
 data_path = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'data')
 ASSETS_FOLDER = os.path.join(data_path, 'assets')
 BLOCKS_FOLDER = os.path.join(data_path, 'blocks')
 PAYMENTS_FOLDER = os.path.join(data_path, 'payments')
-PAYMENTS_FILE_NAME = 'payments'
+STREAM_FOLDER = os.path.join(data_path, 'stream')
 
 
 def load_data(file_name, base):
@@ -19,10 +19,17 @@ def load_data(file_name, base):
     return util.load_obj(file_name)
 
 
-def save_data(obj, file_name, base):
+def save_data(obj, file_name, base, writer=None):
+    """
+    :param writer: if given, obj is serialized now and written later by the writer
+    :type writer: BackgroundWriter or None
+    """
     assert isinstance(file_name, str)
     file_name = os.path.join(base, file_name)
-    return util.save_obj(obj, file_name)
+    if writer is None:
+        return util.save_obj(obj, file_name)
+    else:
+        writer.submit(util.save_bytes, util.dump_obj(obj), file_name)
 
 
 def remove_data(file_name, base, silent=False):
@@ -57,63 +64,133 @@ def asset_reinitialize_data(index):
     return load_data(str(index), ASSETS_FOLDER)
 
 
-def _data_file_max_index(base):
-    indexes = [int(f) for f in os.listdir(base) if os.path.isfile(os.path.join(base, f)) and f.isdigit()]
-    if not indexes:
-        return None
-    else:
-        return max(indexes)
+#the state is checkpointed every CHECKPOINT_INTERVAL blocks, blocks in between go to the journal, see journal.py
+CHECKPOINT_INTERVAL = 100
+_checkpoint_height = None  # the checkpoint the journal in use follows
+
+#retention of old checkpoints, checked after every checkpoint: the last KEEP_LAST_CHECKPOINTS ones, and the first one of
+#every KEEP_EVERY_BLOCKS blocks are kept. all but the latest are compressed if COMPRESS_COLD_CHECKPOINTS
+KEEP_LAST_CHECKPOINTS = 20
+KEEP_EVERY_BLOCKS = 10000
+COMPRESS_COLD_CHECKPOINTS = True
+
+
+def _save_checkpoint(data, height):
+    """
+    :param data: pickled ExchangeServer
+    :type data: str
+    :type height: int
+    """
+    journal.save_checkpoint(BLOCKS_FOLDER, data, height)
+    journal.maintain(BLOCKS_FOLDER, KEEP_LAST_CHECKPOINTS, KEEP_EVERY_BLOCKS, COMPRESS_COLD_CHECKPOINTS)
 
 
 def pop_exchange(remove=False):
     """
+    the latest state: the latest checkpoint with its journal replayed
+    :param remove: also drop the latest block, so the next call loads the state before it
     :rtype: ExchangeServer
     """
-    max_index = _data_file_max_index(BLOCKS_FOLDER)
-    if max_index is None:
-        return None
-    else:
-        data = load_data(str(max_index), BLOCKS_FOLDER)
-        if remove:
-            remove_data(str(max_index), BLOCKS_FOLDER)
-        return data
+    global _checkpoint_height
+
+    exchange, _checkpoint_height = journal.load_state(BLOCKS_FOLDER, repair=True)
+    if remove and exchange is not None:
+        rewind_exchange()
+    return exchange
+
+
+def rewind_exchange():
+    """
+    drops the latest block
+    """
+    global _checkpoint_height
+
+    if not journal.rewind(BLOCKS_FOLDER):
+        raise DataFileDoesNotExistError(folder=BLOCKS_FOLDER)
+    _checkpoint_height = None
+
 
+def load_exchange(height=None):
+    """
+    read-only load of the state after block `height`, or the latest one
+    :type height: int or None
+    :rtype: ExchangeServer
+    """
+    return journal.load_state(BLOCKS_FOLDER, height)[0]
 
-def push_exchange(exchange):
+
+def push_exchange(exchange, record=None, writer=None):
     """
+    saves the state right after a block is processed: the journal record of the block, or a checkpoint if the journal
+    is long enough (or there's no record). with a writer, old checkpoints are pruned in the background too
     :type exchange: ExchangeServer
+    :param record: see journal.dump_entry
+    :type record: str or None
+    :type writer: BackgroundWriter or None
     """
+    global _checkpoint_height
+
     height = exchange.exchange.processed_block_height
-    save_data(exchange, str(height), BLOCKS_FOLDER)
+    if record is None or _checkpoint_height is None or height - _checkpoint_height >= CHECKPOINT_INTERVAL:
+        func, args = _save_checkpoint, (util.dump_obj(exchange), height)
+        _checkpoint_height = height
+    else:
+        func, args = journal.journal_of(BLOCKS_FOLDER, _checkpoint_height).append, (record,)
+
+    if writer is None:
+        func(*args)
+    else:
+        writer.submit(func, *args)
+
+
+#every processed block is published to the stream in STREAM_FOLDER, for the web server and other consumers,
+#see openexchangelib/stream.py
+_stream_writer = None
+
+
+def publish(item, writer=None):
+    """
+    :type item: ProcessedBlock or Rewind
+    :type writer: BackgroundWriter or None
+    """
+    global _stream_writer
+
+    if _stream_writer is None:
+        _stream_writer = stream.StreamWriter(STREAM_FOLDER)
+    _stream_writer.append(item, writer)
 
 
 def assets_data(exchange):
     """
+    the unused init data, loaded only when a request asks for them
     :type exchange: ExchangeServer
+    :rtype: AssetInitData
     """
-    indexes = [int(f) for f in os.listdir(ASSETS_FOLDER)
-               if os.path.isfile(os.path.join(ASSETS_FOLDER, f)) and f.isdigit()]
-    return {index: util.load_obj(os.path.join(ASSETS_FOLDER, str(index)))
-            for index in set(indexes) - exchange.used_init_data_indexes}
+    return util.AssetInitData(ASSETS_FOLDER, exchange.used_init_data_indexes)
 
 
-def load_payments():
-    return load_data(PAYMENTS_FILE_NAME, PAYMENTS_FOLDER)
+#payment records are journaled, see payment_book.py. the snapshot is compacted every PAYMENT_COMPACT_INTERVAL changes,
+#settled records of the last PAYMENT_KEEP_RECENT heights stay in it
+PAYMENT_COMPACT_INTERVAL = 1000
+PAYMENT_KEEP_RECENT = 1000
 
 
-def save_payments(payments, over_written=True):
-    if not over_written:
-        file_name = os.path.join(PAYMENTS_FOLDER, PAYMENTS_FILE_NAME)
-        if os.path.isfile(file_name):
-            raise FileAlreadyExistError(file_name=file_name)
+def load_payments(repair=False):
+    """
+    :param repair: only for the process making payments, see PaymentBook.load
+    :rtype: PaymentBook
+    """
+    from payment_book import PaymentBook
 
-    return save_data(payments, PAYMENTS_FILE_NAME, PAYMENTS_FOLDER)
+    return PaymentBook.load(PAYMENTS_FOLDER, repair, compact_interval=PAYMENT_COMPACT_INTERVAL,
+                            keep_recent=PAYMENT_KEEP_RECENT)
 
 
 def initialize_payments():
     from ext_types import PaymentRecord
+    from payment_book import PaymentBook
 
-    save_payments({
+    PaymentBook.create(PAYMENTS_FOLDER, {
         #block height -> PaymentRecord
         oel_settings.EXCHANGE_INIT_BLOCK_HEIGHT: PaymentRecord(),
-    }, False)
\ No newline at end of file
+    })
@@ -8,26 +8,32 @@ __author__ = "Rex"
 #
 #  1 load the latest state.
 #  2 load the payment records (block_height -> (payments made, unpaid payments, transaction_hashes)),
-#    if damaged, rebuild it via blockchain
+#    if damaged, rebuild it via blockchain. changes to the records are journaled, see payment_book.py
 #  3 assert state.height in records
-#    if unpaid payments is not {}, which means the payment process may go wrong last time, go to 'make_payments'
+#    if unpaid payments of any height are not {}, which means the payment process may go wrong (or was deferred)
+#    last time, go to 'make_payments'
 #    if unpaid is {}, go to 4
 #  4 process the next block according to the state, get all processed requests
 #  5 update used-init-assets-id according to all the requests
 #  6 aggregate all payments according to all the requests
-#  7 add payment records [state.height+1] = ({}, unpaid = aggregate payments); save payment records
-#  8 update state for the new height; save state;
-#  9 while unpaid: (make_payments)
+#  7 add payment records [state.height+1] = ({}, unpaid = aggregate payments), appended to the payment journal
+#  8 update state for the new height; save state (a journal record, or a checkpoint every CHECKPOINT_INTERVAL blocks);
+#    publish the processed block to the stream the web server reads, see openexchangelib/stream.py
+#  9 while unpaid: (make_payments, the unpaid payments of several heights may be coalesced)
 #        make payment using pybit
-#        update payments made & unpaid; save payment record
+#        update payments made & unpaid, appended to the payment journal
 
-#use cron job to run the server script repeatedly
+#use cron job to run the server script repeatedly, or run "python exchange_server.py daemon" to keep the state in
+#memory between blocks, see run_daemon
+#when the server is many blocks behind, run "python exchange_server.py catchup" to fetch, process and persist blocks
+#in a pipeline, see catch_up
 #cPickle benchmark:
 #http://stackoverflow.com/questions/8514020/marshal-dumps-faster-cpickle-loads-faster
 #so we should be OK with cPickle for a pretty long time
 
 import openexchangelib
-from openexchangelib import util, types as oel_types
+from openexchangelib import util, journal, stream
+from openexchangelib.observers import Observer
 import data_management as dm
 from ext_types import ExchangeServer, PaymentRecordNeedRebuildError, PaymentRecord, PaymentInconsistentError
 import pybit
@@ -40,6 +46,8 @@ PROJ_DIR = os.path.abspath(os.path.dirname(__file__))
 logger = util.get_logger('exchange_server', file_name=os.path.join(PROJ_DIR, 'exchange_server.log'))
 #bitcoin_config_file = '/mnt/openexchange/openexchange/Docs/bitcoin.conf'
 bitcoin_config_file = None
+#the wallet payouts are made from, see utxo_pool.py. None for bitcoind, as configured by bitcoin_config_file
+payment_backend = None
 
 
 def add_payment(all_payments, payments):
@@ -60,67 +68,130 @@ def add_payment(all_payments, payments):
             all_payments[address] = amount
 
 
-MAX_PAYMENT_BATCH = 50
+class PaymentCollector(Observer):
+    def __init__(self):
+        #address -> amount, the payments of all the requests processed
+        self.payments = {}
 
+    def on_request(self, req, asset_name):
+        add_payment(self.payments, req.related_payments)
+
+
+#payouts are coalesced: the unpaid payments of all pending heights are merged per address, and paid by as few
+#transactions as possible, of at most MAX_PAYMENT_BATCH outputs each. a transaction pays PAYMENT_FEE_PER_KB for every
+#started kB of its size, and at least MIN_PAYMENT_FEE.
+#the batch is derived from the size: a transaction of MAX_PAYMENT_INPUTS inputs, MAX_PAYMENT_BATCH payments, the
+#payment log output and the change fits in MAX_PAYMENT_TX_SIZE, the largest transaction bitcoind relays
+PAYMENT_FEE_PER_KB = Decimal('0.0001')
+MIN_PAYMENT_FEE = Decimal('0.0005')
+_TX_BASE_SIZE = 10
+_TX_INPUT_SIZE = 148
+_TX_OUTPUT_SIZE = 34
+MAX_PAYMENT_TX_SIZE = 100000
+MAX_PAYMENT_INPUTS = 100
+MAX_PAYMENT_BATCH = (MAX_PAYMENT_TX_SIZE - _TX_BASE_SIZE - _TX_INPUT_SIZE * MAX_PAYMENT_INPUTS) // _TX_OUTPUT_SIZE - 2
+
+#while catching up, payouts wait for more blocks until a full transaction, or MAX_DEFERRED_PAYMENT_HEIGHTS heights,
+#are pending. everything pending is paid once we are caught up
+MAX_DEFERRED_PAYMENT_HEIGHTS = 20
 
-def make_payments(payment_records, height, exchange):
-    """
 
-    :param payment_records:
-    :param height:
-    :param exchange:
-    :type payment_records: list of tuple
-    :type height: int
+def _payment_fee(inputs_n, outputs_n):
     """
-    #make payments (may be multiple times), save payment_records
-    global amount
-    record = payment_records[height]
-    """:type: PaymentRecord"""
+    :type inputs_n: int
+    :type outputs_n: int
+    :return: fee in satoshi
+    :rtype: int
+    """
+    size = _TX_BASE_SIZE + _TX_INPUT_SIZE * inputs_n + _TX_OUTPUT_SIZE * outputs_n
+    return int(max(MIN_PAYMENT_FEE, PAYMENT_FEE_PER_KB * ((size - 1) // 1000 + 1)) * 100000000)
 
-    if not record.unpaid:
-        return
+
+def make_payments(payment_records, heights, exchange):
+    """
+    pays the unpaid payments of the heights, an address gets one output for all of them. the batches are as even as
+    possible. all transactions are built and signed from a UTXOPool first, each spending the change of the previous
+    ones, then broadcast one by one. every transaction is recorded when it's broadcast, with each height it pays and
+    that height's own amounts
+    :type payment_records: PaymentBook
+    :type heights: list of int
+    :type exchange: Exchange
+    """
+    from utxo_pool import UTXOPool, RpcBackend
 
     address_book = openexchangelib.address_book(exchange)
-    from_addresses = exchange.open_exchange_address
-    change_address = exchange.open_exchange_address
     log_address = exchange.payment_log_address
 
-    assert log_address not in record.unpaid
-    batch_n = (len(record.unpaid) - 1) // MAX_PAYMENT_BATCH + 1
+    #address -> height -> amount
+    unpaid = {}
+    for height in heights:
+        record = payment_records[height]
+        """:type: PaymentRecord"""
+        assert log_address not in record.unpaid
+        for address, amount in record.unpaid.iteritems():
+            #we don't want to make payment to addresses that in address_book, or this may lead to an infinite loop
+            if address not in address_book:
+                unpaid.setdefault(address, {})[height] = amount
+    if not unpaid:
+        return
 
-    addresses = record.unpaid.keys()
-    batch_addresses = [addresses[i * MAX_PAYMENT_BATCH: (i + 1) * MAX_PAYMENT_BATCH] for i in xrange(batch_n)]
-    batches = [{address: record.unpaid[address] / Decimal('100000000') for address in l} for l in batch_addresses]
+    addresses = sorted(unpaid)
+    batch_n = (len(addresses) - 1) // MAX_PAYMENT_BATCH + 1
+    batch_size = (len(addresses) - 1) // batch_n + 1
 
-    for batch in batches:
-        batch[log_address] = height / Decimal('100000000')
-        #we don't want to make payment to addresses that in address_book, or this may lead to an infinite loop
-        batch = {address:amount for address, amount in batch.iteritems() if address not in address_book}
-        if not batch:
-            continue
+    pool = UTXOPool(payment_backend or RpcBackend(bitcoin_config_file), exchange.open_exchange_address)
+    transactions = []
+    for i in xrange(batch_n):
+        batch_addresses = addresses[i * batch_size: (i + 1) * batch_size]
+        outputs = {address: sum(unpaid[address].itervalues()) for address in batch_addresses}
+        #the payment log output tells the latest height paid by the transaction
+        outputs[log_address] = max(max(unpaid[address]) for address in batch_addresses)
 
-        tx_hash, signed_tx = pybit.send_from_local(batch, from_addresses=from_addresses, change_address=change_address,
-                                              fee=Decimal('0.0005'),
-                                              return_signed_transaction=True, min_conf=0,
-                                              config_file_name=bitcoin_config_file)
+        paid = {}
+        for address in batch_addresses:
+            for height, amount in unpaid[address].iteritems():
+                paid.setdefault(height, {})[address] = amount
+        transactions.append((outputs, paid) + pool.build(outputs, _payment_fee, MAX_PAYMENT_INPUTS))
 
+    for outputs, paid, tx_hash, signed_tx in transactions:
+        pool.backend.broadcast(signed_tx)
+
+        batch = {address: amount / Decimal('100000000') for address, amount in outputs.iteritems()}
         util.write_log(logger, batch=batch, tx_hash=tx_hash, signed_tx=signed_tx)
+        payment_records.pay(paid, {'hash': tx_hash, 'signed_tx': signed_tx})
 
-        for address, amount in batch.iteritems():
-            if address == log_address:
-                continue
-            else:
-                del record.unpaid[address]
-                record.paid[address] = record.paid.get(address, 0) + int(amount * Decimal('100000000'))
 
-        record.transactions.append({'hash': tx_hash, 'signed_tx': signed_tx})
-        dm.save_payments(payment_records)
+def _pay_pending(exchange, payment_records, writer=None, defer=False):
+    """
+    step 9 for all heights with unpaid payments
+    :type exchange: ExchangeServer
+    :type payment_records: PaymentBook
+    :type writer: BackgroundWriter or None
+    :param defer: wait for more blocks unless a full transaction or MAX_DEFERRED_PAYMENT_HEIGHTS heights are pending
+    :type defer: bool
+    """
+    heights = payment_records.unpaid_heights()
+    if not heights:
+        return
+    if defer and len(heights) < MAX_DEFERRED_PAYMENT_HEIGHTS:
+        addresses = set()
+        for height in heights:
+            addresses.update(payment_records[height].unpaid)
+        if len(addresses) < MAX_PAYMENT_BATCH:
+            return
 
+    util.write_log(logger, 'making payments', heights=heights)
+    if writer is not None:
+        # records and state must be on disk before any bitcoin is sent
+        writer.flush()
+    make_payments(payment_records, heights, exchange=exchange.exchange)
 
-def process_next_block(min_confirmations=6):
+
+def _load_state():
     """
-    :return: if we can process next block immediately
-    :rtype: bool
+    step 1 and 2
+    :return: (exchange, payment_records), or None if the exchange is just initialized
+    :rtype: tuple or None
     """
     #1 load the latest state
     exchange = dm.pop_exchange()
@@ -132,71 +203,98 @@ def process_next_block(min_confirmations=6):
         util.write_log(logger, 'creating the initial payment records.')
         dm.initialize_payments()
         util.write_log(logger, 'initial data done. ')
-        return True
+        return None
     else:
         util.write_log(logger, 'exchange loaded. height = %d' % exchange.exchange.processed_block_height)
 
     #2 load the payment records
     util.write_log(logger, 'loading payment records')
     try:
-        payment_records = dm.load_payments()
+        payment_records = dm.load_payments(repair=True)
     except:
         raise PaymentRecordNeedRebuildError('cannot load payment records, please rebuild the records using '
-                                            'transactions in the block chain if necessary')
+                                            'transactions in the block chain if necessary, see '
+                                            'tools/rebuild_payments.py')
+    return exchange, payment_records
+
 
+def _settle_unpaid(exchange, payment_records):
+    """
+    step 3
+    :type exchange: ExchangeServer
+    :return: if there were unpaid payments
+    :rtype: bool
+    """
     #3 assert state.height in records
-    #if unpaid payments is not {}, which means the payment process may go wrong last time, go to 'make_payments'
+    #if unpaid payments are not {}, which means the payment process may go wrong or was deferred last time,
+    #go to 'make_payments'
     #if unpaid is {}, go to 4
     assert exchange.exchange.processed_block_height in payment_records
-    if payment_records[exchange.exchange.processed_block_height].unpaid != {}:
+    unpaid_heights = payment_records.unpaid_heights()
+    if unpaid_heights:
         util.write_log(logger, 'unpaid payments are non-empty, is there anything go wrong last time?',
-                       payment_record=payment_records[exchange.exchange.processed_block_height])
-        make_payments(payment_records, exchange.exchange.processed_block_height,
-                      exchange=exchange.exchange)
+                       unpaid_heights=unpaid_heights)
+        make_payments(payment_records, unpaid_heights, exchange=exchange.exchange)
         return True
     else:
         util.write_log(logger, 'unpaid checking passed.')
-
-    #4 process the next block according to the state, get all processed requests
-    latest_block_height = pybit.get_block_count(source=pybit_settings.SOURCE_LOCAL,
-                                                config_file_name=bitcoin_config_file)
-    if latest_block_height - exchange.exchange.processed_block_height < min_confirmations:
-        util.write_log(logger, 'no need to update')
         return False
 
-    util.write_log(logger, 'getting the new block')
-    new_block = pybit.get_block_by_height(exchange.exchange.processed_block_height + 1,
-                                          source=pybit_settings.SOURCE_LOCAL,
-                                          config_file_name=bitcoin_config_file)
 
+def _check_fork(exchange, payment_records, new_block, writer=None):
+    """
+    the new block must follow the processed one, on testnet we rewind one block if it doesn't
+    :type exchange: ExchangeServer
+    :type new_block: Block
+    :type writer: BackgroundWriter or None
+    :return: False if the block chain is forked and we rewind one block
+    :rtype: bool
+    """
     if new_block.previous_hash != exchange.exchange.processed_block_hash:
         rpc = pybit.local_rpc_channel(bitcoin_config_file)
         if rpc.getinfo().testnet:
             util.write_log(logger, 'testnet is attacked. rewind one block')
-            dm.pop_exchange(remove=True)
-            del payment_records[new_block.height-1]
-            dm.save_payments(payment_records)
-            return
+            dm.publish(stream.Rewind(new_block.height-1), writer)
+            if writer is not None:
+                writer.flush()
+            dm.rewind_exchange()
+            payment_records.remove(new_block.height-1)
+            return False
         else:
             raise RuntimeError('BlockChain is attacked')
+    return True
+
 
+def _prepare_block(exchange, new_block):
+    """
+    everything taken right before the block is processed
+    :type exchange: ExchangeServer
+    :type new_block: Block
+    :return: asset init data, journal entry, PaymentCollector, ChangeCollector
+    :rtype: tuple
+    """
     util.write_log(logger, 'processing the new block')
-    requests = openexchangelib.process_block(exchange.exchange, new_block, dm.assets_data(exchange))
-
-    #5 update used-init-assets-id according to all the requests
-    util.write_log(logger, 'updating exchange.used_init_data_indexes')
-    for req in requests:
-        if isinstance(req, oel_types.CreateAssetRequest) and req.state == oel_types.Request.STATE_OK:
-            exchange.used_init_data_indexes.add(req.file_id)
-        elif isinstance(req, oel_types.AssetStateControlRequest) and req.state == oel_types.Request.STATE_OK \
-            and req.request_state % 10 in [3, 4]:
-            exchange.used_init_data_indexes.add(req.request_state // 10)
-
-    #6 aggregate all payments according to all the requests
-    util.write_log(logger, 'aggregating payments')
-    payments = {}
-    for req in requests:
-        add_payment(payments, req.related_payments)
+    asset_init_data = dm.assets_data(exchange)
+    # taken before processing, the block may change the init data
+    entry = journal.dump_entry(exchange.exchange, new_block, asset_init_data)
+    #5 update used-init-assets-id according to all the requests, done by the exchange server as an observer
+    #6 aggregate all payments according to all the requests, while they are processed
+    return asset_init_data, entry, PaymentCollector(), stream.ChangeCollector(exchange.exchange)
+
+
+def _finish_block(exchange, payment_records, new_block, requests, prepared, writer=None, defer_payments=False):
+    """
+    step 7 to 9 for a processed block
+    :type exchange: ExchangeServer
+    :type new_block: Block
+    :type requests: list of Request
+    :param prepared: what _prepare_block returned for the block
+    :type prepared: tuple
+    :type writer: BackgroundWriter or None
+    :type defer_payments: bool
+    """
+    asset_init_data, entry, collector, changes = prepared
+    payments = collector.payments
 
     #7 add payment records; save payment records
     util.write_log(logger, 'adding payments to payment records')
@@ -220,22 +318,217 @@ def process_next_block(min_confirmations=6):
                                                old_payments=_payments, payments=payments, height=new_block.height)
         util.write_log(logger, 'payments already exists and valid. we will ignore the payment step.')
     else:
-        payment_records[new_block.height] = PaymentRecord(unpaid=payments)
-        dm.save_payments(payment_records)
+        payment_records.add(new_block.height, PaymentRecord(unpaid=payments), writer)
 
-    #8 update state for the new height; save state;
+    #8 update state for the new height; save state; publish the block for the consumers of the stream
     util.write_log(logger, 'saving exchange')
-    dm.push_exchange(exchange)
+    dm.publish(stream.ProcessedBlock(exchange.exchange, new_block, requests, changes), writer)
+    dm.push_exchange(exchange, entry, writer)
 
     #9 make payments
-    util.write_log(logger, 'making payments')
-    make_payments(payment_records, new_block.height,
-                  exchange=exchange.exchange)
+    _pay_pending(exchange, payment_records, writer, defer_payments)
 
     util.write_log(logger, 'all done for block at height %d' % exchange.exchange.processed_block_height)
 
+
+def _process_new_block(exchange, payment_records, new_block, writer=None, defer_payments=False):
+    """
+    step 4 to 9 for a block already fetched
+    :type exchange: ExchangeServer
+    :type new_block: Block
+    :param writer: if given, the exchange state is written in the background. it's flushed before any payment is made
+    :type writer: BackgroundWriter or None
+    :param defer_payments: the payments may wait for the next blocks, see _pay_pending
+    :type defer_payments: bool
+    :return: False if the block chain is forked and we rewind one block
+    :rtype: bool
+    """
+    if not _check_fork(exchange, payment_records, new_block, writer):
+        return False
+
+    prepared = _prepare_block(exchange, new_block)
+    asset_init_data, entry, collector, changes = prepared
+    requests = exchange.apply_block(new_block, asset_init_data, [collector, changes])
+    _finish_block(exchange, payment_records, new_block, requests, prepared, writer, defer_payments)
+    return True
+
+
+def _latest_block_height():
+    return pybit.get_block_count(source=pybit_settings.SOURCE_LOCAL, config_file_name=bitcoin_config_file)
+
+
+def process_next_block(min_confirmations=6):
+    """
+    :return: if we can process next block immediately
+    :rtype: bool
+    """
+    #1 and 2
+    state = _load_state()
+    if state is None:
+        return True
+    exchange, payment_records = state
+
+    #3
+    if _settle_unpaid(exchange, payment_records):
+        return True
+
+    #4 process the next block according to the state, get all processed requests
+    latest_block_height = _latest_block_height()
+    if latest_block_height - exchange.exchange.processed_block_height < min_confirmations:
+        util.write_log(logger, 'no need to update')
+        return False
+
+    util.write_log(logger, 'getting the new block')
+    new_block = pybit.get_block_by_height(exchange.exchange.processed_block_height + 1,
+                                          source=pybit_settings.SOURCE_LOCAL,
+                                          config_file_name=bitcoin_config_file)
+
+    if not _process_new_block(exchange, payment_records, new_block):
+        return
     return True
 
 
+def _advance(exchange, payment_records, min_confirmations, prefetch_n, writer):
+    """
+    processes all blocks with enough confirmations by process_blocks, the next prefetch_n blocks are fetched from
+    bitcoind while the current one is processed. payments are coalesced over the blocks, and all made before it returns
+    :type exchange: ExchangeServer
+    :type writer: BackgroundWriter
+    :return: number of blocks processed, or None if the block chain is forked and we rewind one block
+    :rtype: int or None
+    """
+    from pipeline import BlockPrefetcher
+
+    first_height = exchange.exchange.processed_block_height + 1
+    last_height = _latest_block_height() - min_confirmations + 1
+    if last_height < first_height:
+        util.write_log(logger, 'no need to update')
+        return 0
+
+    util.write_log(logger, 'catching up from %d to %d' % (first_height, last_height))
+    forked = []
+    prepared = {}
+
+    def unforked_blocks():
+        for new_block in BlockPrefetcher(first_height, last_height, prefetch_n, bitcoin_config_file):
+            if not _check_fork(exchange, payment_records, new_block, writer):
+                forked.append(new_block.height)
+                return
+            yield new_block
+
+    def prepare(new_block):
+        prepared[new_block.height] = _prepare_block(exchange, new_block)
+        asset_init_data, entry, collector, changes = prepared[new_block.height]
+        #the exchange server observes the blocks too, as in ExchangeServer.apply_block
+        return asset_init_data, [exchange, collector, changes]
+
+    processed_n = 0
+    for new_block, requests in openexchangelib.process_blocks(exchange.exchange, unforked_blocks(), prepare=prepare):
+        _finish_block(exchange, payment_records, new_block, requests, prepared.pop(new_block.height), writer,
+                      defer_payments=True)
+        processed_n += 1
+
+    _pay_pending(exchange, payment_records, writer)
+    return None if forked else processed_n
+
+
+def catch_up(min_confirmations=6, prefetch_n=8):
+    """
+    pipelined process_next_block for a server that is many blocks behind. the state is loaded only once, the next
+    prefetch_n blocks are fetched from bitcoind while the current one is processed, and the state is saved in the
+    background while the next block is processed
+    :type min_confirmations: int
+    :type prefetch_n: int
+    :return: number of blocks processed
+    :rtype: int
+    """
+    from pipeline import BackgroundWriter
+
+    state = _load_state()
+    if state is None:
+        state = _load_state()
+    exchange, payment_records = state
+
+    if _settle_unpaid(exchange, payment_records) and payment_records.unpaid_heights():
+        util.write_log(logger, 'unpaid payments are still non-empty, stop catching up')
+        return 0
+
+    writer = BackgroundWriter()
+    try:
+        processed_n = _advance(exchange, payment_records, min_confirmations, prefetch_n, writer) or 0
+    finally:
+        writer.close()
+
+    util.write_log(logger, 'caught up %d blocks, height = %d' % (processed_n,
+                                                                 exchange.exchange.processed_block_height))
+    return processed_n
+
+
+#if bitcoind is started with blocknotify=touch <this file>, the daemon wakes up as soon as a block arrives
+BLOCK_NOTIFY_FILE = os.path.join(PROJ_DIR, 'data', 'blocknotify')
+
+
+def _wait_for_block(poll_interval):
+    """
+    sleeps poll_interval seconds, or less if BLOCK_NOTIFY_FILE is touched in the meantime
+    """
+    import time
+
+    def notify_mtime():
+        try:
+            return os.path.getmtime(BLOCK_NOTIFY_FILE)
+        except OSError:
+            return None
+
+    mtime = notify_mtime()
+    deadline = time.time() + poll_interval
+    while time.time() < deadline:
+        time.sleep(min(1, poll_interval))
+        if notify_mtime() != mtime:
+            return
+
+
+def run_daemon(min_confirmations=6, poll_interval=60, prefetch_n=8):
+    """
+    long running alternative to running process_next_block from cron. the exchange state and the payment records are
+    loaded once and stay in memory; blocks and changes of payment records are written to their journals
+    :type min_confirmations: int
+    :param poll_interval: seconds between two checks of the block count
+    :type poll_interval: int
+    :type prefetch_n: int
+    """
+    from pipeline import BackgroundWriter
+
+    state = _load_state()
+    if state is None:
+        state = _load_state()
+    exchange, payment_records = state
+
+    writer = BackgroundWriter()
+    try:
+        while True:
+            if _settle_unpaid(exchange, payment_records) and payment_records.unpaid_heights():
+                util.write_log(logger, 'unpaid payments are still non-empty, retry later')
+                _wait_for_block(poll_interval)
+                continue
+
+            processed_n = _advance(exchange, payment_records, min_confirmations, prefetch_n, writer)
+            if processed_n is None:
+                # we rewound on disk, so does the state in memory
+                writer.flush()
+                exchange, payment_records = _load_state()
+            elif processed_n == 0:
+                _wait_for_block(poll_interval)
+    finally:
+        writer.close()
+
+
 if __name__ == "__main__":
-    process_next_block()
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'catchup':
+        catch_up()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'daemon':
+        run_daemon()
+    else:
+        process_next_block()
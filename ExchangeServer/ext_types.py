@@ -1,6 +1,7 @@
 #do not use types as module name, it conflicts
 
 from openexchangelib import types as oel_types
+from openexchangelib.observers import Observer
 from pybit.types import Printable
 
 
@@ -20,6 +21,14 @@ class PaymentInconsistentError(oel_types.OEBaseException):
     pass
 
 
+class InsufficientFundsError(oel_types.OEBaseException):
+    pass
+
+
+class TransactionNotSignedError(oel_types.OEBaseException):
+    pass
+
+
 class PaymentRecord(Printable):
     def __init__(self, paid=None, unpaid=None, transactions=None):
         """
@@ -33,7 +42,7 @@ class PaymentRecord(Printable):
         self.transactions = transactions if transactions is not None else []
 
 
-class ExchangeServer(object):
+class ExchangeServer(Observer):
     def __init__(self, exchange):
         """
         :type exchange: Exchange
@@ -43,3 +52,35 @@ class ExchangeServer(object):
         #used assets creation data / re-init data indexes
         self.used_init_data_indexes = set()
 
+    def __getstate__(self):
+        # the exchange is kept in the compact binary format, see openexchangelib/serialization.py
+        from openexchangelib import serialization
+
+        state = self.__dict__.copy()
+        state['exchange'] = serialization.dumps(self.exchange)
+        return state
+
+    def __setstate__(self, state):
+        from openexchangelib import serialization
+
+        self.__dict__.update(state)
+        # exchange servers pickled before the binary format keep the exchange as an object
+        if isinstance(self.exchange, str):
+            self.exchange = serialization.loads(self.exchange)
+
+    def apply_block(self, block, asset_init_data, observers=()):
+        """
+        processes the block, the exchange server observes it to update used_init_data_indexes
+        :type block: Block
+        :type asset_init_data: dict
+        :param observers: more observers of the block, see openexchangelib/observers.py
+        :type observers: list of Observer
+        :rtype: list of Request
+        """
+        import openexchangelib
+
+        return openexchangelib.process_block(self.exchange, block, asset_init_data, [self] + list(observers))
+
+    def on_init_data_used(self, req, asset_name, index):
+        self.used_init_data_indexes.add(index)
+
@@ -0,0 +1,255 @@
+__author__ = 'Rex'
+
+#  payment records (block height -> PaymentRecord) as an append-only journal, so recording a payout does not rewrite
+#  the whole history.
+#
+#  <folder>/payments           the snapshot: (generation, archived_height, {height: PaymentRecord}) of recent heights.
+#                              a plain {height: PaymentRecord}, as written before the journal, is generation 0
+#  <folder>/journal.<gen>      every change after snapshot <gen>, each appended once: a new record with its unpaid
+#                              payments, a payout transaction, or a record dropped for a fork
+#  <folder>/history            settled records of old heights, moved out of the snapshot by compact
+#
+#  the records in memory are the index, they are only changed through the journal. every compact_interval changes the
+#  snapshot is rewritten, so loading it costs the recent heights and a bounded journal, whatever the exchange's age
+
+import os
+from openexchangelib import journal, util
+from ext_types import DataFileDoesNotExistError, FileAlreadyExistError
+
+SNAPSHOT_FILE_NAME = 'payments'
+HISTORY_FILE_NAME = 'history'
+
+_ADD, _PAY, _REMOVE = range(3)
+
+
+def _apply(records, height, change):
+    """
+    :type records: dict from int to PaymentRecord
+    :type height: int
+    :param change: (_ADD, record), (_PAY, paid, transaction) or (_REMOVE,). a payout is journaled at its latest height
+    :type change: tuple
+    """
+    kind = change[0]
+    if kind == _ADD:
+        records[height] = change[1]
+    elif kind == _PAY:
+        _, paid, transaction = change
+        for paid_height, height_paid in paid.iteritems():
+            record = records[paid_height]
+            for address, amount in height_paid.iteritems():
+                record.unpaid.pop(address, None)
+                record.paid[address] = record.paid.get(address, 0) + amount
+            record.transactions.append(transaction)
+    elif kind == _REMOVE:
+        del records[height]
+
+
+class PaymentBook(object):
+    def __init__(self, folder, compact_interval=1000, keep_recent=1000):
+        """
+        use load or create
+        :type folder: str
+        :param compact_interval: the snapshot is rewritten after this many changes
+        :type compact_interval: int
+        :param keep_recent: settled records of this many latest heights stay in the snapshot when it's compacted
+        :type keep_recent: int
+        """
+        self.folder = folder
+        self.compact_interval = compact_interval
+        self.keep_recent = keep_recent
+
+        self.records = {}
+        """:type: dict from int to PaymentRecord"""
+        #records up to this height are in the history file, except those still in self.records
+        self.archived_height = None
+        self.generation = 0
+        self._changes_n = 0
+        #height -> offset of the record in the history file, read once when an archived record is first asked for
+        self._archived = None
+        self._history_end = 0
+        #archived records whose history write is still pending in the background
+        self._unwritten = {}
+
+    @classmethod
+    def load(cls, folder, repair=False, **kwargs):
+        """
+        :param repair: drop the change cut by a crash at the end of the journal, and the journals of older snapshots.
+            only for the process making payments
+        :type repair: bool
+        :rtype: PaymentBook
+        """
+        import cPickle
+
+        file_name = os.path.join(folder, SNAPSHOT_FILE_NAME)
+        if not os.path.isfile(file_name):
+            raise DataFileDoesNotExistError(file_name=file_name)
+
+        book = cls(folder, **kwargs)
+        with open(file_name, 'rb') as f:
+            snapshot = cPickle.load(f)
+        if isinstance(snapshot, dict):
+            book.records = snapshot
+        else:
+            book.generation, book.archived_height, book.records = snapshot
+
+        changes = book._journal()
+        if repair:
+            changes.truncate()
+            for f in os.listdir(folder):
+                if f.startswith(journal.JOURNAL_PREFIX) and f != os.path.basename(changes.file_name):
+                    os.remove(os.path.join(folder, f))
+        for height, change in changes.items():
+            _apply(book.records, height, change)
+            book._changes_n += 1
+        return book
+
+    @classmethod
+    def create(cls, folder, records, **kwargs):
+        """
+        :type records: dict from int to PaymentRecord
+        :rtype: PaymentBook
+        """
+        file_name = os.path.join(folder, SNAPSHOT_FILE_NAME)
+        if os.path.isfile(file_name):
+            raise FileAlreadyExistError(file_name=file_name)
+
+        book = cls(folder, **kwargs)
+        book.records = records
+        util.save_obj((book.generation, book.archived_height, book.records), file_name)
+        return book
+
+    def _journal(self, generation=None):
+        return journal.journal_of(self.folder, self.generation if generation is None else generation)
+
+    def _history(self):
+        return journal.BlockJournal(os.path.join(self.folder, HISTORY_FILE_NAME))
+
+    def _archive_index(self):
+        """
+        :return: height -> offset of its record in the history file
+        :rtype: dict from int to int
+        """
+        if self._archived is None:
+            self._archived, self._history_end = self._history().offsets()
+        return self._archived
+
+    def _is_archived(self, height):
+        return self.archived_height is not None and height <= self.archived_height and \
+            (height in self._unwritten or height in self._archive_index())
+
+    def __contains__(self, height):
+        return height in self.records or self._is_archived(height)
+
+    def __getitem__(self, height):
+        """
+        an archived record is read from the history file, at the offset kept by the index
+        :rtype: PaymentRecord
+        """
+        if height in self.records:
+            return self.records[height]
+        if self._is_archived(height):
+            if height in self._unwritten:
+                return self._unwritten[height]
+            return self._history().read_at(self._archived[height])
+        raise KeyError(height)
+
+    def latest_height(self):
+        return max(self.records)
+
+    def unpaid_heights(self):
+        """
+        archived records are settled, so only the recent ones are checked
+        :rtype: list of int
+        """
+        return sorted(h for h, record in self.records.iteritems() if record.unpaid)
+
+    def items(self):
+        """
+        all records including the archived ones, by height. reads the whole history
+        """
+        records = dict(self._history().items()) if self.archived_height is not None else {}
+        records.update(self.records)
+        return sorted(records.iteritems())
+
+    def _change(self, height, change, writer=None):
+        """
+        journals and applies a change. journal writes, in the background or not, stay in order. payments must not be
+        made while some are pending
+        :type writer: BackgroundWriter or None
+        """
+        record = journal.dump_record(height, change)
+        _apply(self.records, height, change)
+        self._submit(writer, self._journal().append, record)
+
+        self._changes_n += 1
+        if self._changes_n >= self.compact_interval:
+            self.compact(writer)
+
+    @staticmethod
+    def _submit(writer, func, *args):
+        if writer is None:
+            func(*args)
+        else:
+            writer.submit(func, *args)
+
+    def add(self, height, record, writer=None):
+        """
+        :type height: int
+        :type record: PaymentRecord
+        :type writer: BackgroundWriter or None
+        """
+        assert height not in self.records
+        self._change(height, (_ADD, record), writer)
+
+    def pay(self, paid, transaction):
+        """
+        moves the addresses in `paid` from unpaid to paid, and adds the transaction to every height it pays. it's one
+        change however many heights the transaction pays, always written before it returns
+        :param paid: height -> address -> the amount sent to it for that height
+        :type paid: dict from int to dict
+        :param transaction: {'hash': tx_hash, 'signed_tx': signed_transaction}
+        :type transaction: dict
+        """
+        self._change(max(paid), (_PAY, paid, transaction))
+
+    def remove(self, height):
+        """
+        :type height: int
+        """
+        self._change(height, (_REMOVE,))
+
+    def compact(self, writer=None):
+        """
+        moves settled records older than keep_recent heights to the history, and starts a new snapshot and journal
+        :type writer: BackgroundWriter or None
+        """
+        latest_height = self.latest_height()
+        archived = sorted(h for h, record in self.records.iteritems()
+                          if h <= latest_height - self.keep_recent and not record.unpaid)
+        dumped = [journal.dump_record(h, self.records[h]) for h in archived]
+        if archived:
+            # the history is appended after the end of its complete records, see _write_compaction
+            offsets = self._archive_index()
+            for h, record in zip(archived, dumped):
+                offsets[h] = self._history_end
+                self._history_end += len(record)
+                self._unwritten[h] = self.records.pop(h)
+        history = ''.join(dumped)
+        if archived and (self.archived_height is None or archived[-1] > self.archived_height):
+            self.archived_height = archived[-1]
+
+        self.generation += 1
+        self._changes_n = 0
+        snapshot = util.dump_obj((self.generation, self.archived_height, self.records))
+        self._submit(writer, self._write_compaction, history, archived, snapshot, self._journal(self.generation - 1))
+
+    def _write_compaction(self, history, archived, snapshot, old_journal):
+        # the history goes first: after a crash the archived records are either still in the old snapshot, or in
+        # the history (maybe twice, which is harmless)
+        if history:
+            self._history().truncate()
+            self._history().append(history)
+            for h in archived:
+                self._unwritten.pop(h, None)
+        util.save_bytes(snapshot, os.path.join(self.folder, SNAPSHOT_FILE_NAME))
+        old_journal.remove()
@@ -0,0 +1,98 @@
+__author__ = 'Rex'
+
+#  pipeline pieces for catching up when the server is many blocks behind:
+#  blocks are fetched and decoded ahead by a thread pool, while persistence runs in a background thread.
+#  block processing itself stays in the main thread and strictly in block order.
+#  states are pickled in the main thread when their job is submitted, the writer only puts the bytes on disk, and
+#  util.save_bytes makes every file replace atomic, so readers never see a partly written file.
+
+from collections import deque
+from multiprocessing.pool import ThreadPool
+from Queue import Queue
+from threading import Thread
+import pybit
+import pybit.settings as pybit_settings
+
+
+def _fetch_block(height, config_file_name):
+    return pybit.get_block_by_height(height, source=pybit_settings.SOURCE_LOCAL, config_file_name=config_file_name)
+
+
+class BlockPrefetcher(object):
+    def __init__(self, first_height, last_height, prefetch_n=8, config_file_name=None):
+        """
+        iterates blocks of [first_height, last_height] in order, with up to prefetch_n blocks being fetched ahead
+        :type first_height: int
+        :type last_height: int
+        :type prefetch_n: int
+        :type config_file_name: str or None
+        """
+        self.first_height = first_height
+        self.last_height = last_height
+        self.prefetch_n = prefetch_n
+        self.config_file_name = config_file_name
+
+    def __iter__(self):
+        pool = ThreadPool(self.prefetch_n)
+        pending = deque()
+        next_height = self.first_height
+        try:
+            while pending or next_height <= self.last_height:
+                while next_height <= self.last_height and len(pending) < self.prefetch_n:
+                    pending.append(pool.apply_async(_fetch_block, (next_height, self.config_file_name)))
+                    next_height += 1
+                yield pending.popleft().get()
+        finally:
+            # the consumer may stop early, e.g. on a block chain fork
+            pool.terminate()
+
+
+class BackgroundWriter(object):
+    def __init__(self, max_pending=4):
+        """
+        runs persistence jobs in a background thread, one by one and in the order they are submitted.
+        submit blocks when max_pending jobs are waiting, so the writer can never fall far behind
+        :type max_pending: int
+        """
+        self._queue = Queue(max_pending)
+        self._error = None
+        self._thread = Thread(target=self._run, name='BackgroundWriter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                if self._error is None:  # after a failure, later jobs are dropped to keep the files in order
+                    func, args = job
+                    func(*args)
+            except Exception, e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _raise_error(self):
+        """
+        the writer stays failed: every later submit, flush or close raises the first error again
+        """
+        if self._error is not None:
+            raise self._error
+
+    def submit(self, func, *args):
+        self._raise_error()
+        self._queue.put((func, args))
+
+    def flush(self):
+        """
+        waits until everything submitted is written
+        """
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_error()
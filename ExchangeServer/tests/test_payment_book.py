@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from ext_types import PaymentRecord, FileAlreadyExistError
+from payment_book import PaymentBook, HISTORY_FILE_NAME
+from pipeline import BackgroundWriter
+
+
+def _tx(n):
+    return {'hash': 'tx%d' % n, 'signed_tx': 'signed%d' % n}
+
+
+class PaymentBookTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def load(self, repair=False):
+        return PaymentBook.load(self.folder, repair=repair, compact_interval=1000, keep_recent=2)
+
+    def test_add_pay_and_reload(self):
+        book = PaymentBook.create(self.folder, {1: PaymentRecord()}, keep_recent=2)
+        self.assertRaises(FileAlreadyExistError, PaymentBook.create, self.folder, {})
+        book.add(2, PaymentRecord(unpaid={'a': 5, 'b': 3}))
+        book.add(3, PaymentRecord(unpaid={'a': 1}))
+        self.assertEqual(book.unpaid_heights(), [2, 3])
+
+        book.pay({2: {'a': 5}, 3: {'a': 1}}, _tx(1))
+        self.assertEqual(book.unpaid_heights(), [2])
+        book.add(4, PaymentRecord())
+        book.remove(4)
+
+        loaded = self.load()
+        self.assertEqual(sorted(loaded.records), [1, 2, 3])
+        self.assertEqual((loaded[2].paid, loaded[2].unpaid), ({'a': 5}, {'b': 3}))
+        self.assertEqual(loaded[3].transactions, [_tx(1)])
+        self.assertEqual(loaded[2].transactions, [_tx(1)])
+        self.assertNotIn(4, loaded)
+
+    def test_compact_archives_settled_records(self):
+        book = PaymentBook.create(self.folder, {}, keep_recent=2)
+        for h in xrange(1, 8):
+            book.add(h, PaymentRecord(unpaid={'a': h}) if h == 3 else PaymentRecord(paid={'a': h}))
+        book.compact()
+        self.assertEqual(sorted(book.records), [3, 6, 7])
+        self.assertEqual(book.archived_height, 5)
+
+        for book in [book, self.load()]:
+            for h in xrange(1, 8):
+                self.assertIn(h, book)
+            self.assertEqual(book[4].paid, {'a': 4})
+            self.assertEqual(book[3].unpaid, {'a': 3})
+            self.assertEqual([h for h, _ in book.items()], range(1, 8))
+
+    def test_heights_never_recorded(self):
+        book = PaymentBook.create(self.folder, {}, keep_recent=0)
+        for h in [2, 4]:
+            book.add(h, PaymentRecord())
+        book.compact()
+        self.assertEqual(book.archived_height, 4)
+        for book in [book, self.load()]:
+            self.assertNotIn(3, book)
+            self.assertRaises(KeyError, book.__getitem__, 3)
+            self.assertIn(2, book)
+
+    def test_compact_in_the_background(self):
+        book = PaymentBook.create(self.folder, {}, keep_recent=1)
+        writer = BackgroundWriter()
+        for h in xrange(1, 4):
+            book.add(h, PaymentRecord(paid={'a': h}), writer)
+        book.compact(writer)
+        self.assertEqual(book[1].paid, {'a': 1})
+        book.add(4, PaymentRecord(paid={'a': 4}), writer)
+        book.add(5, PaymentRecord(paid={'a': 5}), writer)
+        book.compact(writer)
+        writer.close()
+        self.assertEqual([book[h].paid for h in xrange(1, 6)], [{'a': h} for h in xrange(1, 6)])
+        self.assertEqual([h for h, _ in self.load().items()], range(1, 6))
+
+    def test_crash_during_compaction(self):
+        book = PaymentBook.create(self.folder, {}, keep_recent=1)
+        for h in xrange(1, 5):
+            book.add(h, PaymentRecord(paid={'a': h}))
+        book.compact()
+        history = os.path.join(self.folder, HISTORY_FILE_NAME)
+        with open(history, 'ab') as f:
+            f.write('\x05\x00\x00')
+
+        book = self.load(repair=True)
+        book.add(5, PaymentRecord(paid={'a': 5}))
+        book.add(6, PaymentRecord(paid={'a': 6}))
+        book.compact()
+        self.assertEqual([book[h].paid for h in xrange(1, 7)], [{'a': h} for h in xrange(1, 7)])
+        self.assertEqual([h for h, _ in self.load().items()], range(1, 7))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+
+from pipeline import BackgroundWriter
+
+
+class BackgroundWriterTest(unittest.TestCase):
+    def test_jobs_run_in_order(self):
+        done = []
+        writer = BackgroundWriter(max_pending=2)
+        for i in xrange(20):
+            writer.submit(done.append, i)
+        writer.flush()
+        self.assertEqual(done, range(20))
+        writer.close()
+
+    def test_failed_writer_stays_failed(self):
+        done = []
+
+        def fail():
+            raise IOError('disk full')
+
+        writer = BackgroundWriter()
+        writer.submit(done.append, 1)
+        writer.submit(fail)
+        writer.submit(done.append, 2)
+        self.assertRaises(IOError, writer.flush)
+        self.assertRaises(IOError, writer.submit, done.append, 3)
+        self.assertRaises(IOError, writer.flush)
+        self.assertRaises(IOError, writer.close)
+        self.assertEqual(done, [1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from StringIO import StringIO
+
+import pybit
+from pybit.types import Block, Transaction
+import openexchangelib
+from openexchangelib import types, util, journal
+import data_management as dm
+import exchange_server as es
+from ext_types import ExchangeServer
+from utxo_pool import MemoryBackend
+from tools import rebuild_payments as rb
+
+ISSUER = 'iss'
+DIVIDEND = 4000 * 1000 + 5  # 1000 satoshi a share, 5 back to the issuer
+
+
+def _asset():
+    return types.Asset(4000, 'a_lb', 'a_ls', 'a_mb', 'a_ms', 'a_co', 'a_tr', 'a_pay', 'a_cv', 'a_uv', 'a_sc', ISSUER,
+                       users={'u%d' % i: types.User(initial_asset=1000) for i in xrange(4)})
+
+
+class RebuildPaymentsTest(unittest.TestCase):
+    #the transactions of the blocks processed, dividends are paid at the heights 2, 3, 5, 8 and 9 after the init height
+    BLOCKS = [['list'], ['pay'], ['pay'], [], ['pay'], [], [], ['pay', 'pay'], ['pay']]
+    #the payouts are made after these blocks, each pays all the heights pending. the last one is in a block after the
+    #latest one processed
+    PAYOUTS_AFTER = [3, 6, 8, 9]
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.saved = [(dm, name, getattr(dm, name)) for name in [
+            'ASSETS_FOLDER', 'BLOCKS_FOLDER', 'PAYMENTS_FOLDER', 'STREAM_FOLDER', 'CHECKPOINT_INTERVAL',
+            '_checkpoint_height', '_stream_writer']]
+        self.saved += [(es, 'payment_backend', es.payment_backend), (rb, '_get_block', rb._get_block),
+                       (rb, 'SCAN_BLOCKS_PER_TASK', rb.SCAN_BLOCKS_PER_TASK),
+                       (pybit, 'get_block_count', pybit.get_block_count), (es.logger, 'disabled', es.logger.disabled)]
+        for name in ['assets', 'blocks', 'payments', 'stream']:
+            os.mkdir(os.path.join(self.folder, name))
+            setattr(dm, name.upper() + '_FOLDER', os.path.join(self.folder, name))
+        dm.CHECKPOINT_INTERVAL = 3
+        dm._checkpoint_height = None
+        dm._stream_writer = None
+        rb.SCAN_BLOCKS_PER_TASK = 4
+        es.logger.disabled = True
+
+        self.exchange = openexchangelib.exchange0()
+        self.init_height = self.exchange.processed_block_height
+        self.backend = MemoryBackend({self.exchange.open_exchange_address: [('fund', 0, 10 ** 10)]})
+        es.payment_backend = self.backend
+        self.chain = {}
+        rb._get_block = self.chain.__getitem__
+        pybit.get_block_count = lambda **kwargs: max(self.chain)
+
+        self.original = self.run_exchange()
+
+    def tearDown(self):
+        for module, name, value in self.saved:
+            setattr(module, name, value)
+        shutil.rmtree(self.folder)
+
+    def transaction(self, kind, n):
+        exchange = self.exchange
+        address, amount = {'list': (exchange.create_asset_address, 1), 'pay': ('a_pay', DIVIDEND)}[kind]
+        if kind == 'list':
+            #resume the exchange, list asset A from the init data 1, and resume it
+            return [Transaction('%s%d' % (kind, n), [exchange.open_exchange_address], [(0, address, amount)])
+                    for address, amount in [(exchange.state_control_address, 1), (address, amount), ('a_sc', 1)]]
+        return [Transaction('%s%d' % (kind, n), [ISSUER], [(0, address, amount)])]
+
+    def run_exchange(self):
+        """
+        processes BLOCKS as the server does, the payouts broadcast to the MemoryBackend are in the next block
+        :return: the payment book, as records of plain values
+        """
+        util.save_obj(['A', _asset()], os.path.join(dm.ASSETS_FOLDER, '1'))
+        state = ExchangeServer(self.exchange)
+        dm.push_exchange(state)
+        dm.initialize_payments()
+        book = dm.load_payments()
+
+        height, previous_hash = self.exchange.processed_block_height, self.exchange.processed_block_hash
+        payouts = []
+        for n, kinds in enumerate(self.BLOCKS + [[]]):
+            transactions = sum([self.transaction(kind, n * 10 + i) for i, kind in enumerate(kinds)], [])
+            for tx_hash, inputs, outputs in payouts:
+                transactions.append(Transaction(tx_hash, [state.exchange.open_exchange_address],
+                                                [(i, address, outputs[address])
+                                                 for i, address in enumerate(sorted(outputs))]))
+            height += 1
+            block = Block(height, 'h%d' % height, previous_hash, datetime(2014, 1, 1) + timedelta(minutes=n),
+                          transactions)
+            self.chain[height] = block
+            previous_hash = block.hash
+            if n == len(self.BLOCKS):
+                break  #only to put the last payouts in the chain
+
+            sent_n = len(self.backend.sent)
+            self.assertTrue(es._process_new_block(state, book, block, defer_payments=True))
+            if n + 1 in self.PAYOUTS_AFTER:
+                es._pay_pending(state, book)
+            payouts = self.backend.sent[sent_n:]
+        self.assertEqual(book.unpaid_heights(), [])
+        return self.plain(dm.load_payments())
+
+    def plain(self, book):
+        return [(height, record.paid, record.unpaid, [t['hash'] for t in record.transactions])
+                for height, record in sorted(book.items())]
+
+    def test_payouts_cover_several_heights(self):
+        init_height = self.init_height
+        self.assertEqual(len(self.backend.sent), len(self.PAYOUTS_AFTER))
+        owed = dict((height - init_height, paid) for height, paid, unpaid, hashes in self.original if paid)
+        self.assertEqual(sorted(owed), [2, 3, 5, 8, 9])
+        self.assertEqual(owed[8], dict([('u%d' % i, 2 * 1000 * 1000) for i in xrange(4)] + [(ISSUER, 10)]))
+        #the first payout is for the heights 2 and 3 in one transaction, every address gets one output
+        first = self.backend.sent[0][2]
+        self.assertEqual(first['u0'], 2 * 1000 * 1000)
+        self.assertEqual(first[self.exchange.payment_log_address], init_height + 3)
+
+    def test_rebuild(self):
+        self.assertGreater(len(journal.checkpoint_heights(dm.BLOCKS_FOLDER)), 2)  #replayed by several tasks
+        records, problems = rb.rebuild(2)
+        self.assertEqual(problems, [])
+        self.assertEqual(self.plain(records), self.original)
+
+    def test_rebuild_without_the_journal(self):
+        #the blocks after the first checkpoint come from bitcoind, with the init data of the assets folder
+        journal.journal_of(dm.BLOCKS_FOLDER, journal.checkpoint_heights(dm.BLOCKS_FOLDER)[0]).remove()
+        records, problems = rb.rebuild(2)
+        self.assertEqual(problems, [])
+        self.assertEqual(self.plain(records), self.original)
+
+    def test_paid_for_the_oldest_heights_first(self):
+        #the first payout pays u0 one height less, every later payout of u0 pays the oldest height still owed instead
+        init_height = self.init_height
+        block = self.chain[init_height + 4]
+        payout = block.transactions[-1]
+        block.transactions[-1] = Transaction(payout.hash, payout.input_addresses,
+                                             [(n, address, amount - 1000 * 1000 if address == 'u0' else amount)
+                                              for n, address, amount in payout.outputs])
+        records, problems = rb.rebuild(2)
+
+        hashes = [tx_hash for tx_hash, inputs, outputs in self.backend.sent]
+        self.assertEqual([records[init_height + h].transactions[-1]['hash'] for h in [2, 3, 5, 8, 9]],
+                         [hashes[0], hashes[1], hashes[2], hashes[3], hashes[3]])
+        self.assertEqual(records[init_height + 8].paid['u0'], 2 * 1000 * 1000)
+        self.assertEqual(records[init_height + 9].unpaid, {'u0': 1000 * 1000})
+        self.assertEqual(problems, ['height %d is not fully paid: %s' % (init_height + 9, {'u0': 1000 * 1000})])
+
+    def test_write(self):
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            self.assertEqual(rb.main(['2', '--write']), 1)  #the payment book is still there
+            shutil.rmtree(dm.PAYMENTS_FOLDER)
+            os.mkdir(dm.PAYMENTS_FOLDER)
+            self.assertEqual(rb.main(['2', '--write']), 0)
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(self.plain(dm.load_payments()), self.original)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+
+from ext_types import InsufficientFundsError
+from utxo_pool import UTXOPool, MemoryBackend, WalletBackend, DUST_AMOUNT
+
+
+def _fee(inputs_n, outputs_n):
+    return 1000 * inputs_n + 100 * outputs_n
+
+
+class UTXOPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.backend = MemoryBackend({'ex': [('a', 0, 50000), ('b', 0, 20000), ('c', 1, 10000)],
+                                      'other': [('d', 0, 90000)]})
+        self.pool = UTXOPool(self.backend, 'ex')
+
+    def test_backend_is_abstract(self):
+        self.assertRaises(TypeError, WalletBackend)
+
+    def test_largest_coins_first(self):
+        self.assertEqual(self.pool.balance(), 80000)
+        tx_hash, signed_tx = self.pool.build({'u1': 45000, 'u2': 10000}, _fee)
+        # 50000 is not enough with the fee, 50000 + 20000 is
+        inputs, outputs = self.backend._signed[signed_tx][1:3]
+        self.assertEqual(inputs, [('a', 0), ('b', 0)])
+        self.assertEqual(outputs, {'u1': 45000, 'u2': 10000, 'ex': 70000 - 55000 - _fee(2, 3)})
+
+        # the change is a coin of the pool at once, the spent coins are gone
+        self.assertEqual(self.pool.balance(), 10000 + outputs['ex'])
+        self.backend.broadcast(signed_tx)
+        self.assertEqual(sorted(self.backend.list_unspent('ex')), sorted(
+            [('c', 1, 10000), (tx_hash, 0, outputs['ex'])]))
+
+    def test_spending_the_change(self):
+        first = self.pool.build({'u1': 60000}, _fee)[1]
+        second = self.pool.build({'u2': 15000}, _fee)[1]
+        self.backend.broadcast(first)
+        self.backend.broadcast(second)
+        self.pool.refresh()
+        self.assertEqual(self.pool.balance(), 80000 - 75000 - _fee(2, 2) - _fee(2, 2))
+
+    def test_dust_change_goes_to_the_fee(self):
+        amount = 80000 - _fee(3, 2) - (DUST_AMOUNT - 1)
+        signed_tx = self.pool.build({'u1': amount}, _fee)[1]
+        self.assertEqual(self.backend._signed[signed_tx][2], {'u1': amount})
+        self.assertEqual(self.pool.balance(), 0)
+
+    def test_insufficient_funds(self):
+        self.assertRaises(InsufficientFundsError, self.pool.build, {'u1': 80000}, _fee)
+        self.assertEqual(self.pool.balance(), 80000)
+        self.assertEqual(self.backend._signed, {})
+
+    def test_too_many_inputs(self):
+        self.assertRaises(InsufficientFundsError, self.pool.build, {'u1': 60000}, _fee, 1)
+        self.assertEqual(self.pool.balance(), 80000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,27 @@
+__author__ = 'Rex'
+
+
+# usage:
+#   python convert_blockdata
+# rewrites the checkpoints in data/blocks, so the exchanges pickled in them use the compact binary format
+
+import sys
+sys.path.append('..')
+
+import os
+import zlib
+from openexchangelib import util, journal
+import data_management as dm
+
+
+if __name__ == "__main__":
+    for height in journal.checkpoint_heights(dm.BLOCKS_FOLDER):
+        file_name = os.path.join(dm.BLOCKS_FOLDER, str(height))
+        if not os.path.isfile(file_name):
+            file_name += journal.COMPRESSED_SUFFIX
+        size = os.path.getsize(file_name)
+        data = util.dump_obj(journal.load_checkpoint(dm.BLOCKS_FOLDER, height))
+        if file_name.endswith(journal.COMPRESSED_SUFFIX):
+            data = zlib.compress(data)
+        util.save_bytes(data, file_name)
+        print '%d: %d -> %d bytes' % (height, size, os.path.getsize(file_name))
@@ -1,7 +1,7 @@
 __author__ = 'Rex'
 
 if __name__ == "__main__":
-    from exchange_server import process_next_block
+    from exchange_server import catch_up
 
-    while process_next_block():
-        print '\n' + '='*30 + '\n'
\ No newline at end of file
+    while catch_up():
+        print '\n' + '='*30 + '\n'
@@ -13,9 +13,9 @@ import data_management as dm
 if __name__ == "__main__":
     try:
         height = int(sys.argv[1])
-        exchange = dm.load_data(str(height),dm.BLOCKS_FOLDER)
+        exchange = dm.load_exchange(height)
     except:
-        exchange = dm.pop_exchange()
+        exchange = dm.load_exchange()
 
     print exchange.exchange
 
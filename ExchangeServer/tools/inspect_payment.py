@@ -20,9 +20,9 @@ if __name__ == "__main__":
     if height is not None:
         print payments[height]
     else:
-        print 'max processed height: %d' % max(payments.keys())
+        print 'max processed height: %d' % payments.latest_height()
         print 'last payment'
-        h = max(payments.keys())
+        h = payments.latest_height()
         while h>0:
             try:
                 record = payments[h]
@@ -0,0 +1,182 @@
+__author__ = 'Rex'
+
+
+# usage:
+#   python rebuild_payments [processes] [--write]
+# rebuilds the payment records from the block chain, when dm.load_payments fails.
+# worker processes replay the exchange between checkpoints to get the payments every height owes, and scan the block
+# chain for the payout transactions: the ones from the open exchange address with an output to the payment log
+# address, whose amount is the latest height paid. the payouts are matched to the owed payments in chain order, every
+# address is paid for its oldest heights first, as make_payments does. without --write it only prints the report,
+# with it the records are written to data/payments, which must not have any payment file
+
+import sys
+sys.path.append('..')
+
+import os
+from multiprocessing import Pool
+import openexchangelib
+import openexchangelib.settings as oel_settings
+from openexchangelib import journal
+import pybit
+import pybit.settings as pybit_settings
+import data_management as dm
+from ext_types import ExchangeServer, PaymentRecord
+
+SCAN_BLOCKS_PER_TASK = 1000
+bitcoin_config_file = None
+
+
+def _get_block(height):
+    return pybit.get_block_by_height(height, source=pybit_settings.SOURCE_LOCAL, config_file_name=bitcoin_config_file)
+
+
+def replay(first_checkpoint_height, last_height):
+    """
+    processes the blocks after a checkpoint again, from its journal or from bitcoind where the journal is pruned
+    :return: ('owed', {height: {address: amount}})
+    """
+    from exchange_server import PaymentCollector
+
+    if first_checkpoint_height is None:
+        state = ExchangeServer(openexchangelib.exchange0())
+        first_checkpoint_height = state.exchange.processed_block_height
+    else:
+        state = journal.load_checkpoint(dm.BLOCKS_FOLDER, first_checkpoint_height)
+    entries = dict(journal.journal_of(dm.BLOCKS_FOLDER, first_checkpoint_height).items(last_height))
+
+    owed = {}
+    for height in xrange(first_checkpoint_height + 1, last_height + 1):
+        if height in entries:
+            block, asset_init_data = entries[height]
+        else:
+            block, asset_init_data = _get_block(height), dm.assets_data(state)
+        collector = PaymentCollector()
+        state.apply_block(block, asset_init_data, [collector])
+        owed[height] = collector.payments
+    return 'owed', owed
+
+
+def scan(first_height, last_height, from_address, log_address):
+    """
+    :return: ('payouts', list of (block height, tx hash, height paid, {address: amount}))
+    """
+    payouts = []
+    for height in xrange(first_height, last_height + 1):
+        for tx in _get_block(height).transactions:
+            if from_address not in tx.input_addresses:
+                continue
+            outputs = {}
+            for n, address, value in tx.outputs:
+                outputs[address] = outputs.get(address, 0) + value
+            if log_address in outputs:
+                paid_height = outputs.pop(log_address)
+                outputs.pop(from_address, None)  # the change
+                payouts.append((height, tx.hash, paid_height, outputs))
+    return 'payouts', payouts
+
+
+def _run(task):
+    func, args = task
+    return func(*args)
+
+
+def rebuild(processes=None):
+    """
+    :return: (records, problems), records is height -> PaymentRecord, problems is a list of str
+    :rtype: tuple
+    """
+    from collections import deque
+
+    latest_height = journal.latest_height(dm.BLOCKS_FOLDER)
+    exchange = journal.load_checkpoint(dm.BLOCKS_FOLDER, journal.latest_checkpoint_height(dm.BLOCKS_FOLDER)).exchange
+    init_height = oel_settings.EXCHANGE_INIT_BLOCK_HEIGHT
+    chain_height = pybit.get_block_count(source=pybit_settings.SOURCE_LOCAL, config_file_name=bitcoin_config_file)
+
+    checkpoints = [h for h in journal.checkpoint_heights(dm.BLOCKS_FOLDER) if h < latest_height]
+    if not checkpoints or checkpoints[0] > init_height:
+        checkpoints.insert(0, None)
+    ends = checkpoints[1:] + [latest_height]
+    tasks = [(replay, (start, end)) for start, end in zip(checkpoints, ends)]
+    tasks += [(scan, (h, min(h + SCAN_BLOCKS_PER_TASK - 1, chain_height), exchange.open_exchange_address,
+                      exchange.payment_log_address))
+              for h in xrange(init_height + 1, chain_height + 1, SCAN_BLOCKS_PER_TASK)]
+
+    owed, payouts = {}, []
+    pool = Pool(processes)
+    try:
+        for kind, result in pool.imap_unordered(_run, tasks):
+            if kind == 'owed':
+                owed.update(result)
+            else:
+                payouts.extend(result)
+    finally:
+        pool.close()
+        pool.join()
+    payouts.sort(key=lambda p: p[0])  # stable, so transactions of a block stay in order
+
+    records = {height: PaymentRecord(unpaid=dict(payments)) for height, payments in owed.iteritems()}
+    records[init_height] = PaymentRecord()
+
+    #address -> deque of the heights it is owed by, oldest first
+    owed_heights = {}
+    for height in sorted(owed):
+        for address in owed[height]:
+            owed_heights.setdefault(address, deque()).append(height)
+
+    problems = []
+    for block_height, tx_hash, paid_height, outputs in payouts:
+        transaction = {'hash': tx_hash, 'signed_tx': None}
+        for address, amount in outputs.iteritems():
+            heights = owed_heights.get(address, deque())
+            while amount > 0 and heights and heights[0] <= paid_height:
+                record = records[heights[0]]
+                part = min(amount, record.unpaid[address])
+                record.unpaid[address] -= part
+                record.paid[address] = record.paid.get(address, 0) + part
+                if transaction not in record.transactions:
+                    record.transactions.append(transaction)
+                if record.unpaid[address] == 0:
+                    del record.unpaid[address]
+                    heights.popleft()
+                amount -= part
+            if amount > 0:
+                problems.append('%s in block %d pays %s %d more than owed up to height %d'
+                                % (tx_hash, block_height, address, amount, paid_height))
+
+    for height in sorted(records):
+        if records[height].unpaid:
+            problems.append('height %d is not fully paid: %s' % (height, records[height].unpaid))
+    return records, problems
+
+
+def main(argv):
+    """
+    :param argv: [processes] [--write]
+    :return: exit status
+    :rtype: int
+    """
+    from payment_book import PaymentBook
+
+    write = '--write' in argv
+    args = [a for a in argv if a != '--write']
+    processes = int(args[0]) if args else None
+
+    if write and [f for f in os.listdir(dm.PAYMENTS_FOLDER) if f != 'readme']:
+        print 'move the payment files in %s away first' % dm.PAYMENTS_FOLDER
+        return 1
+
+    records, problems = rebuild(processes)
+    for problem in problems:
+        print problem
+    print '%d heights, %d payout transactions, %d problems' % (
+        len(records), len(set(t['hash'] for r in records.itervalues() for t in r.transactions)), len(problems))
+
+    if write:
+        PaymentBook.create(dm.PAYMENTS_FOLDER, records)
+        print 'written to %s' % dm.PAYMENTS_FOLDER
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
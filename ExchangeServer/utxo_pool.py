@@ -0,0 +1,178 @@
+__author__ = 'Rex'
+
+#  coin selection for payouts on the exchange side.
+#  the pool is filled from the wallet once, then tracks the outputs itself: inputs leave it when a transaction is built,
+#  the change of the transaction enters it at once. so a whole payout run can be built and signed in a row, every
+#  transaction spending the change of the previous ones, without asking the wallet again.
+#  amounts are in satoshi. the wallet is behind a backend: RpcBackend talks to bitcoind, MemoryBackend is a wallet in
+#  memory for tests and dry runs
+
+from abc import ABCMeta, abstractmethod
+from decimal import Decimal
+from ext_types import InsufficientFundsError, TransactionNotSignedError
+
+DUST_AMOUNT = 546  # change below it goes to the fee
+
+
+def _to_satoshi(btc):
+    return int((Decimal(str(btc)) * 100000000).to_integral_value())
+
+
+def _to_btc(satoshi):
+    return Decimal(satoshi) / Decimal('100000000')
+
+
+class WalletBackend(object):
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def list_unspent(self, address):
+        """
+        unconfirmed outputs included
+        :type address: str
+        :return: list of (txid, vout, amount)
+        :rtype: list of tuple
+        """
+
+    @abstractmethod
+    def sign(self, inputs, outputs):
+        """
+        :param inputs: list of (txid, vout)
+        :type inputs: list of tuple
+        :param outputs: address -> amount
+        :type outputs: dict from str to int
+        :return: (tx_hash, signed_tx, vouts), vouts is address -> index of its output
+        :rtype: tuple
+        """
+
+    @abstractmethod
+    def broadcast(self, signed_tx):
+        """
+        :type signed_tx: str
+        """
+
+
+class RpcBackend(WalletBackend):
+    def __init__(self, config_file_name=None):
+        import pybit
+
+        self.rpc = pybit.local_rpc_channel(config_file_name)
+
+    def list_unspent(self, address):
+        return [(u['txid'], u['vout'], _to_satoshi(u['amount'])) for u in self.rpc.listunspent(0, 9999999, [address])]
+
+    def sign(self, inputs, outputs):
+        raw_tx = self.rpc.createrawtransaction([{'txid': txid, 'vout': vout} for txid, vout in inputs],
+                                               {address: _to_btc(amount) for address, amount in outputs.iteritems()})
+        signed = self.rpc.signrawtransaction(raw_tx)
+        if not signed['complete']:
+            raise TransactionNotSignedError(inputs=inputs, outputs=outputs)
+
+        decoded = self.rpc.decoderawtransaction(signed['hex'])
+        vouts = {vout['scriptPubKey']['addresses'][0]: vout['n'] for vout in decoded['vout']}
+        return decoded['txid'], signed['hex'], vouts
+
+    def broadcast(self, signed_tx):
+        self.rpc.sendrawtransaction(signed_tx)
+
+
+class MemoryBackend(WalletBackend):
+    def __init__(self, unspent=None):
+        """
+        :param unspent: address -> list of (txid, vout, amount)
+        :type unspent: dict
+        """
+        #(txid, vout) -> (address, amount)
+        self.unspent = {}
+        for address, outputs in (unspent or {}).iteritems():
+            for txid, vout, amount in outputs:
+                self.unspent[(txid, vout)] = (address, amount)
+        #(tx_hash, inputs, outputs) of the broadcast transactions
+        self.sent = []
+        self._signed = {}
+
+    def list_unspent(self, address):
+        return [(txid, vout, amount) for (txid, vout), (a, amount) in sorted(self.unspent.iteritems()) if a == address]
+
+    def sign(self, inputs, outputs):
+        import hashlib
+
+        signed_tx = repr((sorted(inputs), sorted(outputs.iteritems())))
+        tx_hash = hashlib.sha256(signed_tx).hexdigest()
+        vouts = {address: n for n, address in enumerate(sorted(outputs))}
+        self._signed[signed_tx] = (tx_hash, list(inputs), dict(outputs), vouts)
+        return tx_hash, signed_tx, vouts
+
+    def broadcast(self, signed_tx):
+        tx_hash, inputs, outputs, vouts = self._signed.pop(signed_tx)
+        if any(i not in self.unspent for i in inputs):
+            raise InsufficientFundsError('spending an unknown or spent output', tx_hash=tx_hash)
+        for i in inputs:
+            del self.unspent[i]
+        for address, amount in outputs.iteritems():
+            self.unspent[(tx_hash, vouts[address])] = (address, amount)
+        self.sent.append((tx_hash, inputs, outputs))
+
+
+class UTXOPool(object):
+    def __init__(self, backend, address):
+        """
+        :type backend: WalletBackend
+        :param address: the address paying, and getting the change
+        :type address: str
+        """
+        self.backend = backend
+        self.address = address
+        #(txid, vout) -> amount
+        self.coins = {}
+        self.refresh()
+
+    def refresh(self):
+        """
+        forgets the tracked outputs and asks the wallet again, e.g. when a built transaction is not broadcast
+        """
+        self.coins = {(txid, vout): amount for txid, vout, amount in self.backend.list_unspent(self.address)}
+
+    def balance(self):
+        return sum(self.coins.itervalues())
+
+    def build(self, outputs, fee, max_inputs=None):
+        """
+        selects the largest coins first, so the transaction has as few inputs as possible. the coins are spent in the
+        pool right away, and the change output becomes a coin
+        :param outputs: address -> amount
+        :type outputs: dict from str to int
+        :param fee: (number of inputs, number of outputs) -> fee
+        :type fee: function
+        :param max_inputs: the transaction is refused if it needs more inputs, the wallet needs consolidating then
+        :type max_inputs: int or None
+        :return: (tx_hash, signed_tx)
+        :rtype: tuple
+        """
+        total = sum(outputs.itervalues())
+        outputs_n = len(outputs) + (0 if self.address in outputs else 1)
+
+        inputs, selected = [], 0
+        for coin, amount in sorted(self.coins.iteritems(), key=lambda c: (-c[1], c[0])):
+            if selected >= total + fee(len(inputs), outputs_n):
+                break
+            inputs.append(coin)
+            selected += amount
+        tx_fee = fee(len(inputs), outputs_n)
+        if selected < total + tx_fee:
+            raise InsufficientFundsError(address=self.address, balance=selected, amount=total, fee=tx_fee)
+        if max_inputs is not None and len(inputs) > max_inputs:
+            raise InsufficientFundsError('too many small coins, consolidate them first', address=self.address,
+                                         inputs_n=len(inputs), max_inputs=max_inputs)
+
+        outputs = dict(outputs)
+        change = selected - total - tx_fee
+        if change >= DUST_AMOUNT:
+            outputs[self.address] = outputs.get(self.address, 0) + change
+
+        tx_hash, signed_tx, vouts = self.backend.sign(inputs, outputs)
+        for coin in inputs:
+            del self.coins[coin]
+        if self.address in outputs:
+            self.coins[(tx_hash, vouts[self.address])] = outputs[self.address]
+        return tx_hash, signed_tx
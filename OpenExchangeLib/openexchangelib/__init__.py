@@ -9,87 +9,102 @@ def exchange0():
 
 def address_book(exchange):
     """
+    the address book maintained by the exchange, it's not rebuilt on every call
     :type exchange: OpenExchange
     :rtype: dict
+    :return: dict from address to (asset_name, service), see Exchange.address_book
     """
-    from openexchangelib import requesthandlers as handlers
-    from openexchangelib import types
-
-    service_dict = {
-        exchange.create_asset_address: (None, None, handlers.create_asset),
-        exchange.state_control_address: (None, None, handlers.exchange_state_control)
-    }
-
-    for asset_name, asset in exchange.assets.iteritems():
-        assert isinstance(asset_name, str)
-        assert isinstance(asset, types.Asset)
+    return exchange.address_book()
 
-        assert asset.limit_buy_address not in service_dict
-        service_dict[asset.limit_buy_address] = (asset_name, asset, handlers.limit_buy)
 
-        assert asset.limit_sell_address not in service_dict
-        service_dict[asset.limit_sell_address] = (asset_name, asset, handlers.limit_sell)
-
-        assert asset.market_buy_address not in service_dict
-        service_dict[asset.market_buy_address] = (asset_name, asset, handlers.market_buy)
-
-        assert asset.market_sell_address not in service_dict
-        service_dict[asset.market_sell_address] = (asset_name, asset, handlers.market_sell)
+def _registry_addresses(exchange):
+    """
+    addresses of the requests that may list or re-initialize an asset, i.e. the only ones using asset init data
+    :type exchange: OpenExchange
+    :rtype: frozenset
+    """
+    return frozenset([exchange.create_asset_address] +
+                     [asset.state_control_address for asset in exchange.assets.itervalues()])
 
-        assert asset.clear_order_address not in service_dict
-        service_dict[asset.clear_order_address] = (asset_name, asset, handlers.clear_order)
 
-        assert asset.transfer_address not in service_dict
-        service_dict[asset.transfer_address] = (asset_name, asset, handlers.transfer)
+def candidate_transactions(exchange, transactions):
+    """
+    for block sources to hand over only the transactions that may be requests, irrelevant ones are discarded without
+    looping over their outputs in python.
+    addresses of an asset listed or re-initialized inside the block are unknown beforehand, so once a transaction pays
+    the create asset address or an asset state control address, every transaction after it is kept.
+    :type exchange: OpenExchange
+    :type transactions: list of Transaction
+    :rtype: list of Transaction
+    """
+    from itertools import imap
+    from operator import itemgetter
 
-        assert asset.create_vote_address not in service_dict
-        service_dict[asset.create_vote_address] = (asset_name, asset, handlers.create_vote)
+    service_addresses = exchange.service_addresses()
+    registry_addresses = _registry_addresses(exchange)
+    output_address = itemgetter(1)
 
-        assert asset.vote_address not in service_dict
-        service_dict[asset.vote_address] = (asset_name, asset, handlers.user_vote)
+    candidates = []
+    for i, tx in enumerate(transactions):
+        if not service_addresses.isdisjoint(imap(output_address, tx.outputs)):
+            candidates.append(tx)
+            if not registry_addresses.isdisjoint(imap(output_address, tx.outputs)):
+                candidates.extend(transactions[i + 1:])
+                break
+    return candidates
 
-        assert asset.pay_address not in service_dict
-        service_dict[asset.pay_address] = (asset_name, asset, handlers.pay)
 
-        assert asset.state_control_address not in service_dict
-        service_dict[asset.state_control_address] = (asset_name, asset, handlers.asset_state_control)
+def _service_handlers():
+    """
+    :rtype: dict
+    :return: dict from service name to its request handler
+    """
+    from openexchangelib import requesthandlers as handlers
 
-    return service_dict
+    return {service: getattr(handlers, service) for service in [
+        'create_asset', 'exchange_state_control', 'limit_buy', 'limit_sell', 'market_buy', 'market_sell',
+        'clear_order', 'transfer', 'create_vote', 'user_vote', 'pay', 'asset_state_control']}
 
 
-def process_block(exchange, block, asset_init_data=None):
+def _process_block(exchange, block, asset_init_data, service_handlers, requests, observers=None):
     """
-    be aware that the exchange object is changed in-place, and this should be run in a stand-clone process for efficiency
-    also no history management is involved for memory efficiency, but one can implement that for their use with ease
-    :param exchange: current exchange state
+    the body of process_block, everything that can be prepared once for many blocks is passed in
     :type exchange: OpenExchange
-    :param block:  next block
     :type block: Block
     :type asset_init_data: dict
-    :param asset_init_data: the content depend on whether it's on asset creation or asset re-initialization
-    :return: list of processed requests
-    :rtype: list of Request
+    :type service_handlers: dict
+    :param requests: processed requests are appended to it, or dropped if it's None
+    :type requests: list or None
+    :type observers: list of Observer or None
     """
     from openexchangelib import types
-    from pybit.types import Block
-    from openexchangelib import requesthandlers as handlers
+    from openexchangelib.observers import notify
+    from itertools import imap
+    from operator import itemgetter
 
     #make some basic check
     assert exchange.processed_block_height == block.height - 1
     assert exchange.processed_block_hash == block.previous_hash
 
-    service_dict = address_book(exchange)
+    # kept up to date by the exchange itself when assets are created or re-initialized
+    service_dict = exchange.address_book()
+    service_addresses = exchange.service_addresses()
+    output_address = itemgetter(1)
 
     # then process the transactions one by one
-    requests = []
-
-    assert isinstance(block, Block)
     for tx in block.transactions:
+        # almost no transaction touches the exchange, skip them before looping over outputs in python
+        if service_addresses.isdisjoint(imap(output_address, tx.outputs)):
+            continue
+
         for n, address, sbtc_amount in tx.outputs:  # a transaction can have multiple purposes
             if address in service_dict:
-                asset_name, asset, handler = service_dict[address]
+                asset_name, service = service_dict[address]
+                asset = exchange.assets[asset_name] if asset_name is not None else None
+                handler = service_handlers[service]
                 assert isinstance(asset_name, str) or asset_name is None
                 assert isinstance(asset, types.Asset) or asset is None
+                touched_orders = [] if observers else None
 
                 if exchange.state == types.Exchange.STATE_PAUSED:
                     #in this case, only exchange state control order is accepted
@@ -107,15 +122,71 @@ def process_block(exchange, block, asset_init_data=None):
                                                             types.Request.MSG_IGNORED_SINCE_ASSET_PAUSED)
                 else:
                     req = handler(tx, address, block.timestamp, exchange=exchange, asset_name=asset_name, asset=asset,
-                                  asset_init_data=asset_init_data, sbtc_amount=sbtc_amount)
+                                  asset_init_data=asset_init_data, sbtc_amount=sbtc_amount,
+                                  touched_orders=touched_orders)
+
+                if observers:
+                    notify(observers, req, asset_name, asset, touched_orders)
+                if requests is not None:
+                    requests.append(req)
 
-                requests.append(req)
-                #rebuild service_dict when needed
-                if handler == handlers.asset_state_control or handler == handlers.create_asset:
-                    service_dict = address_book(exchange)
+        # a new set only when some asset is listed or re-initialized
+        service_addresses = exchange.service_addresses()
 
     # other updates
     exchange.processed_block_height = block.height
     exchange.processed_block_hash = block.hash
 
+
+def process_block(exchange, block, asset_init_data=None, observers=None):
+    """
+    be aware that the exchange object is changed in-place, and this should be run in a stand-clone process for efficiency
+    also no history management is involved for memory efficiency, but one can implement that for their use with ease,
+    by observers called for every request as it's processed
+    :param exchange: current exchange state
+    :type exchange: OpenExchange
+    :param block:  next block, its transactions could be all of the block or only the candidates of it
+    :type block: Block
+    :type asset_init_data: dict
+    :param asset_init_data: the content depend on whether it's on asset creation or asset re-initialization
+    :param observers: see observers.py
+    :type observers: list of Observer or None
+    :return: list of processed requests
+    :rtype: list of Request
+    """
+    from pybit.types import Block
+
+    assert isinstance(block, Block)
+    requests = []
+    _process_block(exchange, block, asset_init_data, _service_handlers(), requests, observers)
     return requests
+
+
+def process_blocks(exchange, block_iter, asset_init_data=None, keep_requests=True, observers=None, prepare=None):
+    """
+    process_block for a stream of blocks, e.g. catching up or replaying from EXCHANGE_INIT_BLOCK_HEIGHT after data
+    loss. blocks are pulled from block_iter one by one and the per-call setup of process_block is done only once
+    :type exchange: OpenExchange
+    :type block_iter: iterable of Block
+    :type asset_init_data: dict
+    :param keep_requests: if False, processed requests are dropped as soon as they are handled and None is yielded
+    in place of them, only the exchange state is advanced
+    :type keep_requests: bool
+    :param observers: see observers.py, they see every request even if it's not kept
+    :type observers: list of Observer or None
+    :param prepare: function(block) -> (asset_init_data, observers), called right before each block is processed. if
+    given, its result is used in place of asset_init_data and observers, for init data and observers that change
+    from block to block
+    :type prepare: callable or None
+    :return: generator of (block, requests) after each block is processed
+    """
+    from pybit.types import Block
+
+    service_handlers = _service_handlers()
+    for block in block_iter:
+        assert isinstance(block, Block)
+        if prepare is not None:
+            asset_init_data, observers = prepare(block)
+        requests = [] if keep_requests else None
+        _process_block(exchange, block, asset_init_data, service_handlers, requests, observers)
+        yield block, requests
@@ -0,0 +1,155 @@
+#  OHLCV candles of the trades of an asset, kept up to date trade by trade at a few resolutions, so a chart asks for
+#  the candles of the range it shows instead of every trade ever made.
+#
+#  a candle is [open time, open, high, low, close, volume], times in milliseconds since the epoch, prices in BTC.
+#  dump packs the candles into fixed size rows, sorted by time: query answers a range on the packed bytes by binary
+#  search, without unpacking the rest, e.g. right from a snapshot (see snapshot.Snapshot.get_buffer)
+
+import struct
+from bisect import bisect_left, bisect_right
+
+RESOLUTIONS = {'1m': 60 * 1000, '1h': 60 * 60 * 1000, '1d': 24 * 60 * 60 * 1000}
+_ROW = struct.Struct('<qddddq')  # open time, open, high, low, close, volume
+
+
+class Candles(object):
+    def __init__(self, resolution):
+        """
+        :param resolution: the length of a candle, in milliseconds
+        :type resolution: int
+        """
+        self.resolution = resolution
+        self.times = []
+        """:type: list of int"""
+        self.candles = []
+        """:type: list of list"""
+
+    def add(self, timestamp, price, amount):
+        """
+        block times are not monotonic: a trade older than the latest candle goes into its own candle, only its high,
+        low and volume are updated then
+        :param timestamp: in milliseconds
+        :type timestamp: int
+        :type price: float
+        :type amount: int
+        """
+        open_time = timestamp - timestamp % self.resolution
+        if self.times and open_time == self.times[-1]:
+            candle = self.candles[-1]
+            candle[2] = max(candle[2], price)
+            candle[3] = min(candle[3], price)
+            candle[4] = price
+            candle[5] += amount
+            return
+
+        i = bisect_left(self.times, open_time)
+        if i < len(self.times) and self.times[i] == open_time:
+            candle = self.candles[i]
+            candle[2] = max(candle[2], price)
+            candle[3] = min(candle[3], price)
+            candle[5] += amount
+        else:
+            self.times.insert(i, open_time)
+            self.candles.insert(i, [open_time, price, price, price, price, amount])
+
+    def dump(self):
+        """
+        :rtype: str
+        """
+        return ''.join(_ROW.pack(*candle) for candle in self.candles)
+
+
+def add_trades(candles, trades):
+    """
+    :param candles: resolution name -> Candles, see build
+    :type candles: dict
+    :param trades: [timestamp in milliseconds, price, amount] in trade order
+    """
+    for timestamp, price, amount in trades:
+        for c in candles.itervalues():
+            c.add(timestamp, price, amount)
+
+
+def add_rows(candles, rows):
+    """
+    :param candles: see add_trades
+    :param rows: trades as rows of the trade tape, see tape.trade_row
+    :type rows: list of tuple
+    """
+    add_trades(candles, ((row[0], row[1] / 100000000.0, row[2]) for row in rows))
+
+
+def build(trades):
+    """
+    :param trades: see add_trades
+    :return: resolution name -> Candles
+    :rtype: dict
+    """
+    candles = {name: Candles(resolution) for name, resolution in RESOLUTIONS.iteritems()}
+    add_trades(candles, trades)
+    return candles
+
+
+def build_from_tape(trade_tape, end=None):
+    """
+    :param trade_tape: the trades of an asset, see tape.Tape
+    :type trade_tape: tape.Tape
+    :param end: only the trades before it, see tape.Tape.first_after
+    :type end: int or None
+    :return: see build
+    :rtype: dict
+    """
+    end = len(trade_tape) if end is None else end
+    times, prices, volumes = [trade_tape.column(name) for name in ['time', 'price', 'volume']]
+    return build((int(times[i]), int(prices[i]) / 100000000.0, int(volumes[i])) for i in xrange(end))
+
+
+class _Times(object):
+    """
+    the open times of packed candles, as a sequence for bisect
+    """
+    def __init__(self, packed):
+        self.packed = packed
+
+    def __len__(self):
+        return len(self.packed) // _ROW.size
+
+    def __getitem__(self, i):
+        return _ROW.unpack_from(self.packed, i * _ROW.size)[0]
+
+
+def _range(packed, from_time, to_time):
+    """
+    :return: the first and the end row of the candles opening from from_time to to_time
+    :rtype: tuple
+    """
+    times = _Times(packed)
+    first = 0 if from_time is None else bisect_left(times, from_time)
+    end = len(times) if to_time is None else bisect_right(times, to_time)
+    return first, max(first, end)
+
+
+def query(packed, from_time=None, to_time=None, limit=None):
+    """
+    :param packed: see Candles.dump, str or buffer
+    :param from_time: the candles opening at or after it, in milliseconds
+    :type from_time: int or None
+    :param to_time: the candles opening at or before it, in milliseconds
+    :type to_time: int or None
+    :param limit: only the latest this many candles of the range
+    :type limit: int or None
+    :rtype: list of list
+    """
+    first, end = _range(packed, from_time, to_time)
+    if limit is not None:
+        first = max(first, end - limit)
+    return [list(_ROW.unpack_from(packed, i * _ROW.size)) for i in xrange(first, end)]
+
+
+def count(packed, from_time=None, to_time=None):
+    """
+    the number of candles query would return without a limit, without unpacking them
+    :rtype: int
+    """
+    first, end = _range(packed, from_time, to_time)
+    return end - first
@@ -0,0 +1,433 @@
+#  write-ahead journal of processed blocks, next to full checkpoints of a chained state.
+#
+#  <folder>/<height>           a checkpoint, the whole state right after block <height> is processed
+#  <folder>/<height>.z         a cold checkpoint, compressed with zlib
+#  <folder>/journal.<height>   the blocks processed after checkpoint <height>, one record per block
+#  <folder>/LATEST             the height of the latest checkpoint, so finding it needs no directory listing
+#
+#  a record keeps what is needed to process its block again: the candidate transactions of the block, plus the asset
+#  init data only when they may touch the asset registry. so the bytes written for a block follow the activity in it,
+#  not the size of the exchange. the latest state is the latest checkpoint with its journal replayed.
+#  states are duck typed, they have `exchange` and `apply_block(block, asset_init_data)`.
+#  old checkpoints are compressed and pruned by maintain, which may run in the background
+
+import os
+import struct
+
+_HEADER = struct.Struct('<iI')  # block height, length of the pickled entry
+JOURNAL_PREFIX = 'journal.'
+COMPRESSED_SUFFIX = '.z'
+LATEST_FILE_NAME = 'LATEST'
+
+
+def dump_entry(exchange, block, asset_init_data):
+    """
+    the journal record of a block. it must be taken before the block is processed, which may change the init data.
+    the init data, if kept, are saved as a plain dict, so a lazy util.AssetInitData is read in full
+    :type exchange: Exchange
+    :type block: Block
+    :type asset_init_data: dict or AssetInitData
+    :rtype: str
+    """
+    import copy
+    from itertools import imap
+    from operator import itemgetter
+    from openexchangelib import candidate_transactions, _registry_addresses
+
+    entry_block = copy.copy(block)
+    entry_block.transactions = candidate_transactions(exchange, block.transactions)
+
+    registry_addresses = _registry_addresses(exchange)
+    output_address = itemgetter(1)
+    if any(not registry_addresses.isdisjoint(imap(output_address, tx.outputs)) for tx in entry_block.transactions):
+        init_data = asset_init_data
+    else:
+        init_data = None  # no asset can be listed or re-initialized in this block
+
+    return dump_record(block.height, (entry_block, init_data))
+
+
+def dump_record(height, obj):
+    """
+    a record of any picklable obj, for BlockJournal.append. entries yields obj back
+    :type height: int
+    :rtype: str
+    """
+    from openexchangelib import util
+
+    data = util.dump_obj(obj)
+    return _HEADER.pack(height, len(data)) + data
+
+
+class BlockJournal(object):
+    def __init__(self, file_name):
+        """
+        records are only appended. a record cut by a crash is ignored by readers, and dropped by truncate
+        :type file_name: str
+        """
+        self.file_name = file_name
+
+    def _records(self):
+        """
+        yields (offset, height, length) of every complete record
+        """
+        if not os.path.isfile(self.file_name):
+            return
+
+        size = os.path.getsize(self.file_name)
+        with open(self.file_name, 'rb') as f:
+            offset = 0
+            while offset + _HEADER.size <= size:
+                f.seek(offset)
+                height, length = _HEADER.unpack(f.read(_HEADER.size))
+                if offset + _HEADER.size + length > size:
+                    return
+                yield offset, height, length
+                offset += _HEADER.size + length
+
+    def heights(self):
+        """
+        :rtype: list of int
+        """
+        return [height for _, height, _ in self._records()]
+
+    def offsets(self):
+        """
+        the records by height, for read_at. a height recorded twice maps to its last record
+        :return: height -> offset of its record, and the end of the last complete record
+        :rtype: (dict from int to int, int)
+        """
+        offsets, end = {}, 0
+        for offset, height, length in self._records():
+            offsets[height] = offset
+            end = offset + _HEADER.size + length
+        return offsets, end
+
+    def read_at(self, offset):
+        """
+        :param offset: of a complete record, see offsets
+        :type offset: int
+        :return: the obj of the record, see dump_record
+        """
+        import cPickle
+
+        with open(self.file_name, 'rb') as f:
+            f.seek(offset)
+            _, length = _HEADER.unpack(f.read(_HEADER.size))
+            return cPickle.loads(f.read(length))
+
+    def entries(self, max_height=None):
+        """
+        yields (block, asset_init_data) of the records, up to block max_height if it's given
+        """
+        for _, entry in self.items(max_height):
+            yield entry
+
+    def items(self, max_height=None):
+        """
+        yields (height, obj) of the records, up to height max_height if it's given. see dump_record
+        """
+        import cPickle
+
+        records = list(self._records())
+        if not records:
+            return
+
+        with open(self.file_name, 'rb') as f:
+            for offset, height, length in records:
+                if max_height is not None and height > max_height:
+                    return
+                f.seek(offset + _HEADER.size)
+                yield height, cPickle.loads(f.read(length))
+
+    def append(self, record):
+        """
+        :param record: see dump_entry
+        :type record: str
+        """
+        with open(self.file_name, 'ab') as f:
+            f.write(record)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def truncate(self, from_height=None):
+        """
+        drops the records of block from_height on, and the incomplete record at the end if any
+        :type from_height: int or None
+        """
+        if not os.path.isfile(self.file_name):
+            return
+
+        end = 0
+        for offset, height, length in self._records():
+            if from_height is not None and height >= from_height:
+                break
+            end = offset + _HEADER.size + length
+
+        if end < os.path.getsize(self.file_name):
+            with open(self.file_name, 'r+b') as f:
+                f.truncate(end)
+
+    def pop(self):
+        """
+        drops the last record
+        :return: the height of the dropped record, or None if there's no record
+        :rtype: int or None
+        """
+        heights = self.heights()
+        if not heights:
+            return None
+        self.truncate(heights[-1])
+        return heights[-1]
+
+    def remove(self):
+        if os.path.isfile(self.file_name):
+            os.remove(self.file_name)
+
+
+def checkpoint_heights(folder):
+    """
+    lists the folder, for the latest checkpoint use latest_checkpoint_height instead
+    :type folder: str
+    :rtype: list of int
+    """
+    heights = set()
+    for f in os.listdir(folder):
+        if f.endswith(COMPRESSED_SUFFIX):
+            f = f[:-len(COMPRESSED_SUFFIX)]
+        if f.isdigit():
+            heights.add(int(f))
+    return sorted(heights)
+
+
+def _checkpoint_file_name(folder, height):
+    """
+    :rtype: str or None
+    :return: the file of the checkpoint, compressed or not, None if there's no such checkpoint
+    """
+    file_name = os.path.join(folder, str(height))
+    if os.path.isfile(file_name):
+        return file_name
+    if os.path.isfile(file_name + COMPRESSED_SUFFIX):
+        return file_name + COMPRESSED_SUFFIX
+    return None
+
+
+def _update_latest(folder, height=None):
+    """
+    points LATEST to checkpoint `height`, or to the latest one found by listing the folder
+    """
+    from openexchangelib import util
+
+    if height is None:
+        heights = checkpoint_heights(folder)
+        if not heights:
+            if os.path.isfile(os.path.join(folder, LATEST_FILE_NAME)):
+                os.remove(os.path.join(folder, LATEST_FILE_NAME))
+            return
+        height = heights[-1]
+    util.save_bytes(str(height), os.path.join(folder, LATEST_FILE_NAME))
+
+
+def latest_checkpoint_height(folder):
+    """
+    O(1) by the LATEST pointer. folders written before the pointer, or whose pointer is stale, are listed instead
+    :type folder: str
+    :rtype: int or None
+    """
+    try:
+        with open(os.path.join(folder, LATEST_FILE_NAME), 'rb') as f:
+            height = int(f.read())
+        if _checkpoint_file_name(folder, height) is not None:
+            return height
+    except (IOError, ValueError):
+        pass
+
+    heights = checkpoint_heights(folder)
+    return heights[-1] if heights else None
+
+
+def save_checkpoint(folder, data, height):
+    """
+    :type folder: str
+    :param data: the pickled state
+    :type data: str
+    :type height: int
+    """
+    from openexchangelib import util
+
+    journal_of(folder, height).remove()
+    util.save_bytes(data, os.path.join(folder, str(height)))
+    _update_latest(folder, height)
+
+
+def load_checkpoint(folder, height):
+    """
+    :type folder: str
+    :type height: int
+    """
+    import cPickle
+    import zlib
+
+    file_name = _checkpoint_file_name(folder, height)
+    with open(file_name, 'rb') as f:
+        data = f.read()
+    if file_name.endswith(COMPRESSED_SUFFIX):
+        data = zlib.decompress(data)
+    return cPickle.loads(data)
+
+
+def _remove_checkpoint(folder, height):
+    journal_of(folder, height).remove()
+    os.remove(_checkpoint_file_name(folder, height))
+
+
+def journal_of(folder, checkpoint_height):
+    """
+    :type folder: str
+    :type checkpoint_height: int
+    :rtype: BlockJournal
+    """
+    return BlockJournal(os.path.join(folder, JOURNAL_PREFIX + str(checkpoint_height)))
+
+
+def latest_height(folder):
+    """
+    the height of the latest state, without loading it
+    :type folder: str
+    :rtype: int or None
+    """
+    checkpoint_height = latest_checkpoint_height(folder)
+    if checkpoint_height is None:
+        return None
+    journal_heights = journal_of(folder, checkpoint_height).heights()
+    return journal_heights[-1] if journal_heights else checkpoint_height
+
+
+def version(folder):
+    """
+    changes whenever a block is saved or dropped, cheap enough to be checked on every web request
+    :type folder: str
+    :rtype: tuple
+    :return: (height of the latest checkpoint, size of its journal)
+    """
+    checkpoint_height = latest_checkpoint_height(folder)
+    if checkpoint_height is None:
+        return None, None
+    journal = journal_of(folder, checkpoint_height)
+    return checkpoint_height, os.path.getsize(journal.file_name) if os.path.isfile(journal.file_name) else 0
+
+
+def load_state(folder, height=None, repair=False):
+    """
+    the state after block `height`, or the latest one: the nearest checkpoint with its journal replayed.
+    if the journals do not reach `height`, it's the latest state before it
+    :type folder: str
+    :type height: int or None
+    :param repair: drop the incomplete record at the end of the journal, only for the process appending to it
+    :type repair: bool
+    :return: (state, height of the checkpoint it's loaded from), or (None, None) if there's no checkpoint
+    :rtype: tuple
+    """
+    if height is None:
+        checkpoint_height = latest_checkpoint_height(folder)
+    else:
+        heights = [h for h in checkpoint_heights(folder) if h <= height]
+        checkpoint_height = heights[-1] if heights else None
+    if checkpoint_height is None:
+        return None, None
+
+    state = load_checkpoint(folder, checkpoint_height)
+    journal = journal_of(folder, checkpoint_height)
+    if repair:
+        journal.truncate()
+    for block, asset_init_data in journal.entries(height):
+        state.apply_block(block, asset_init_data)
+    return state, checkpoint_height
+
+
+def rewind(folder):
+    """
+    drops the latest block, from the journal or with its checkpoint
+    :type folder: str
+    :return: False if there's nothing to drop
+    :rtype: bool
+    """
+    checkpoint_height = latest_checkpoint_height(folder)
+    if checkpoint_height is None:
+        return False
+
+    if journal_of(folder, checkpoint_height).pop() is None:
+        _remove_checkpoint(folder, checkpoint_height)
+        _update_latest(folder)
+    return True
+
+
+def remove_from(folder, height):
+    """
+    drops every state from block `height` on (inclusive)
+    :type folder: str
+    :type height: int
+    :return: heights of the removed checkpoints
+    :rtype: list of int
+    """
+    removed = [h for h in checkpoint_heights(folder) if h >= height]
+    for h in removed:
+        _remove_checkpoint(folder, h)
+    _update_latest(folder)
+
+    checkpoint_height = latest_checkpoint_height(folder)
+    if checkpoint_height is not None:
+        journal_of(folder, checkpoint_height).truncate(height)
+    return removed
+
+
+def remove_to(folder, height):
+    """
+    drops the checkpoints up to block `height` (inclusive), and their journals
+    :type folder: str
+    :type height: int
+    :return: heights of the removed checkpoints
+    :rtype: list of int
+    """
+    removed = [h for h in checkpoint_heights(folder) if h <= height]
+    for h in removed:
+        _remove_checkpoint(folder, h)
+    _update_latest(folder)
+    return removed
+
+
+def maintain(folder, keep_last, keep_every, compress=True):
+    """
+    retention of old checkpoints: the last keep_last checkpoints are kept, older ones only if they are the first in
+    their span of keep_every blocks. a checkpoint goes with its journal. kept checkpoints but the latest one are cold,
+    they are compressed if `compress`
+    :type folder: str
+    :type keep_last: int
+    :type keep_every: int
+    :type compress: bool
+    :return: heights of the removed checkpoints
+    :rtype: list of int
+    """
+    import zlib
+    from openexchangelib import util
+
+    heights = checkpoint_heights(folder)
+    removed = []
+    spans = set()
+    for h in heights[:max(len(heights) - keep_last, 0)]:
+        if h // keep_every in spans:
+            _remove_checkpoint(folder, h)
+            removed.append(h)
+        else:
+            spans.add(h // keep_every)
+
+    if compress:
+        for h in heights[:-1]:
+            file_name = os.path.join(folder, str(h))
+            if h not in removed and os.path.isfile(file_name):
+                with open(file_name, 'rb') as f:
+                    data = f.read()
+                util.save_bytes(zlib.compress(data), file_name + COMPRESSED_SUFFIX)
+                os.remove(file_name)
+    return removed
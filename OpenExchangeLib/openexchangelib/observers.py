@@ -0,0 +1,184 @@
+#  observers of process_block. derived views (histories, recent trades, payments to make ...) are kept up to date in
+#  the same pass that processes the block: every request is handed to the observers right after it is handled,
+#  instead of walking the processed requests again afterwards.
+#
+#  subclass Observer and override the hooks you need, then pass the observers to process_block or process_blocks.
+#  on_request is called for every request, then one hook by the type of the request. asset_name is None for exchange
+#  level requests. the state the hooks see is the state right after the request is handled.
+#  for requests processed elsewhere (e.g. taken from the stream, see stream.py) notify_all calls the same hooks
+#  afterwards, then the hooks see the state after the whole block
+
+
+class Observer(object):
+    def on_request(self, req, asset_name):
+        """
+        every request, before the hook of its type
+        :type req: Request
+        :type asset_name: str or None
+        """
+        pass
+
+    def on_failed(self, req, asset_name):
+        """
+        a request in STATE_FATAL, including the ones ignored because the exchange or the asset is paused. no other hook
+        is called for it
+        """
+        pass
+
+    def on_order_placed(self, req, asset_name):
+        """
+        a limit or market order
+        """
+        pass
+
+    def on_trade(self, req, asset_name, trades):
+        """
+        after on_order_placed, if the order traded at once
+        :param trades: the trades the order made, as the taker
+        :type trades: list of TradeItem
+        """
+        pass
+
+    def on_orders_touched(self, req, asset_name, orders):
+        """
+        after the hook of the request, the resting orders it traded with or cancelled. they may have left the order
+        book since. only process_block calls it, the orders are not known for requests processed elsewhere
+        :type orders: list of BuyLimitOrderRequest or SellLimitOrderRequest
+        """
+        pass
+
+    def on_cancel(self, req, asset_name):
+        """
+        :type req: ClearOrderRequest
+        """
+        pass
+
+    def on_transfer(self, req, asset_name):
+        """
+        :type req: TransferRequest
+        """
+        pass
+
+    def on_dividend(self, req, asset_name, asset):
+        """
+        :type req: PayRequest
+        :param asset: the asset paying, its users hold the shares they are paid for
+        :type asset: Asset
+        """
+        pass
+
+    def on_vote(self, req, asset_name):
+        """
+        :type req: CreateVoteRequest or UserVoteRequest
+        """
+        pass
+
+    def on_state_control(self, req, asset_name):
+        """
+        :type req: ExchangeStateControlRequest or AssetStateControlRequest
+        """
+        pass
+
+    def on_asset_created(self, req, asset_name):
+        """
+        :type req: CreateAssetRequest
+        """
+        pass
+
+    def on_init_data_used(self, req, asset_name, index):
+        """
+        after on_asset_created or on_state_control, when the request lists or re-initializes an asset and is in
+        STATE_OK. a partial change of an asset stays in STATE_NOT_PROCESSED, so it doesn't use up its init data
+        :param index: the index of the asset init data used
+        :type index: int
+        """
+        pass
+
+
+_dispatch_table = None
+
+
+def _dispatch():
+    """
+    :return: request class -> function(observer, req, asset_name, asset) calling its hooks
+    :rtype: dict
+    """
+    global _dispatch_table
+    from openexchangelib import types
+
+    if _dispatch_table is not None:
+        return _dispatch_table
+
+    def limit_order(observer, req, asset_name, asset):
+        observer.on_order_placed(req, asset_name)
+        if req.immediate_executed_trades:
+            observer.on_trade(req, asset_name, req.immediate_executed_trades)
+
+    def market_order(observer, req, asset_name, asset):
+        observer.on_order_placed(req, asset_name)
+        if req.trade_history:
+            observer.on_trade(req, asset_name, req.trade_history)
+
+    def create_asset(observer, req, asset_name, asset):
+        observer.on_asset_created(req, asset_name)
+        if req.state == types.Request.STATE_OK:
+            observer.on_init_data_used(req, asset_name, req.file_id)
+
+    def asset_state_control(observer, req, asset_name, asset):
+        observer.on_state_control(req, asset_name)
+        if req.state == types.Request.STATE_OK and req.request_state % 10 in [3, 4]:
+            observer.on_init_data_used(req, asset_name, req.request_state // 10)
+
+    _dispatch_table = {
+        types.BuyLimitOrderRequest: limit_order,
+        types.SellLimitOrderRequest: limit_order,
+        types.BuyMarketOrderRequest: market_order,
+        types.SellMarketOrderRequest: market_order,
+        types.ClearOrderRequest: lambda observer, req, asset_name, asset: observer.on_cancel(req, asset_name),
+        types.TransferRequest: lambda observer, req, asset_name, asset: observer.on_transfer(req, asset_name),
+        types.PayRequest: lambda observer, req, asset_name, asset: observer.on_dividend(req, asset_name, asset),
+        types.CreateVoteRequest: lambda observer, req, asset_name, asset: observer.on_vote(req, asset_name),
+        types.UserVoteRequest: lambda observer, req, asset_name, asset: observer.on_vote(req, asset_name),
+        types.ExchangeStateControlRequest:
+            lambda observer, req, asset_name, asset: observer.on_state_control(req, asset_name),
+        types.AssetStateControlRequest: asset_state_control,
+        types.CreateAssetRequest: create_asset,
+    }
+    return _dispatch_table
+
+
+def notify(observers, req, asset_name, asset, touched_orders=None):
+    """
+    :type observers: list of Observer
+    :type req: Request
+    :type asset_name: str or None
+    :param asset: the asset of the service address, None for exchange level requests
+    :type asset: Asset or None
+    :param touched_orders: the resting orders the request traded with or cancelled
+    :type touched_orders: list or None
+    """
+    from openexchangelib import types
+
+    hooks = None if req.state == types.Request.STATE_FATAL else _dispatch().get(req.__class__)
+    for observer in observers:
+        observer.on_request(req, asset_name)
+        if req.state == types.Request.STATE_FATAL:
+            observer.on_failed(req, asset_name)
+        elif hooks is not None:
+            hooks(observer, req, asset_name, asset)
+        if touched_orders:
+            observer.on_orders_touched(req, asset_name, touched_orders)
+
+
+def notify_all(observers, requests, exchange):
+    """
+    calls the hooks for the requests of a block processed elsewhere
+    :type observers: list of Observer
+    :type requests: list of Request
+    :param exchange: the exchange after the block
+    :type exchange: Exchange
+    """
+    address_book = exchange.address_book()
+    for req in requests:
+        asset_name = address_book[req.service_address][0]
+        notify(observers, req, asset_name, exchange.assets[asset_name] if asset_name is not None else None)
@@ -0,0 +1,292 @@
+from bisect import bisect_left
+from itertools import islice
+
+
+class PriceLevel(object):
+    """
+    all resting orders of one unit price, in the order of their arrival (FIFO).
+    every order carries its position in the level as `order.book_position`, which is the handle to remove it in O(1):
+    removed orders leave a None slot behind, slots are compacted lazily.
+    """
+
+    def __init__(self, unit_price):
+        """
+        :type unit_price: int
+        """
+        self.unit_price = unit_price
+        self.orders = []
+        """:type: list of BuyLimitOrderRequest or SellLimitOrderRequest or None"""
+        self.head = 0  # slots before head are already consumed
+        self.base = 0  # position of orders[0], positions stay valid when consumed slots are dropped
+        self.order_n = 0  # number of orders, None slots excluded
+        self.volume = 0  # total unfulfilled volume of the level
+
+    def __len__(self):
+        return self.order_n
+
+    def __iter__(self):
+        for order in islice(self.orders, self.head, None):
+            if order is not None:
+                yield order
+
+    def _skip_removed(self):
+        while self.head < len(self.orders) and self.orders[self.head] is None:
+            self.head += 1
+        if self.head * 2 >= len(self.orders):  # drop consumed slots when they are the majority, amortized O(1)
+            del self.orders[:self.head]
+            self.base += self.head
+            self.head = 0
+
+    def first(self):
+        return self.orders[self.head]
+
+    def append(self, order):
+        order.book_position = self.base + len(self.orders)
+        self.orders.append(order)
+        self.order_n += 1
+        self.volume += order.volume_unfulfilled
+
+    def pop_first(self):
+        order = self.orders[self.head]
+        self.orders[self.head] = None
+        self.order_n -= 1
+        self.volume -= order.volume_unfulfilled
+        order.book_position = None
+        self._skip_removed()
+        return order
+
+    def remove(self, order):
+        """
+        O(1) by the position handle of the order
+        """
+        if order.book_position is None:
+            raise ValueError('order is not in this price level')
+        i = order.book_position - self.base
+        if not (self.head <= i < len(self.orders) and self.orders[i] is order):
+            raise ValueError('order is not in this price level')
+
+        self.orders[i] = None
+        self.order_n -= 1
+        self.volume -= order.volume_unfulfilled
+        order.book_position = None
+        if i == self.head:
+            self._skip_removed()
+        elif self.order_n * 2 < len(self.orders) - self.head:  # mostly holes, renumber the remaining orders
+            self.orders = [o for o in self.orders if o is not None]
+            self.base = self.head = 0
+            for position, o in enumerate(self.orders):
+                o.book_position = position
+
+
+class OrderBook(object):
+    """
+    one side of the limit orders of an asset: price levels sorted by unit price, each of them is a FIFO queue.
+    the price levels are kept in a sorted list whose last element is the best price, so reading or dropping the best
+    level never shifts the others.
+    since we execute the requests in the order of their transactions, arrival order is the only time priority we need.
+    for sweeping, cumulative volume and value of the levels are kept as prefix sums counted from the worst level, so a
+    change near the best price (where almost all the activity is) only invalidates the tail of them
+    """
+    SIDE_BUY = 1  # the best price is the highest one
+    SIDE_SELL = 2  # the best price is the lowest one
+
+    def __init__(self, side, orders=None):
+        """
+        :type side: int
+        :type orders: list of BuyLimitOrderRequest or SellLimitOrderRequest or None
+        :param orders: resting orders sorted by priority, e.g. an order book saved as a plain list
+        """
+        self.side = side
+        self._keys = []  # sorted in ascending order, the key of the best price is the biggest one
+        """:type: list of int"""
+        self._levels = {}
+        """:type: dict from int to PriceLevel"""
+        self._order_n = 0
+        self._cum_volume = []  # _cum_volume[i] is the total volume of levels 0..i, valid for a prefix of _keys
+        """:type: list of int"""
+        self._cum_value = []  # same as _cum_volume, but sums unit_price * volume
+        """:type: list of int"""
+
+        for order in orders or []:
+            self.add(order)
+
+    def _key(self, unit_price):
+        """
+        maps unit price to sort key and vice versa
+        """
+        return unit_price if self.side == self.SIDE_BUY else -unit_price
+
+    def _invalidate_depth(self, i):
+        """
+        level i is changed, so are the prefix sums from i on
+        """
+        del self._cum_volume[i:]
+        del self._cum_value[i:]
+
+    def _update_depth(self):
+        volume = self._cum_volume[-1] if self._cum_volume else 0
+        value = self._cum_value[-1] if self._cum_value else 0
+        for key in self._keys[len(self._cum_volume):]:
+            level = self._levels[self._key(key)]
+            volume += level.volume
+            value += level.volume * level.unit_price
+            self._cum_volume.append(volume)
+            self._cum_value.append(value)
+
+    def _exhausted_level_n(self, cum, amount):
+        """
+        the number of levels, counted from the best one, whose total is covered by amount. O(log L)
+        """
+        self._update_depth()
+        if not cum or cum[-1] <= amount:
+            return len(self._keys)
+        # levels i.. are exhausted when cum[i - 1] >= total - amount
+        return len(self._keys) - bisect_left(cum, cum[-1] - amount) - 1
+
+    def __len__(self):
+        return self._order_n
+
+    def __nonzero__(self):
+        return self._order_n > 0
+
+    def __iter__(self):
+        """
+        all resting orders, ordered by their priority
+        """
+        for key in reversed(self._keys):
+            for order in self._levels[self._key(key)]:
+                yield order
+
+    def __str__(self):
+        return str(list(self))
+
+    def __repr__(self):
+        return str(self)
+
+    def levels(self):
+        """
+        yields (unit_price, volume) of every price level, from the best one
+        """
+        for key in reversed(self._keys):
+            level = self._levels[self._key(key)]
+            yield level.unit_price, level.volume
+
+    def best_price(self):
+        """
+        :rtype: int or None
+        """
+        return self._key(self._keys[-1]) if self._keys else None
+
+    def best(self):
+        """
+        the order that would be matched first, O(1)
+        :rtype: BuyLimitOrderRequest or SellLimitOrderRequest or None
+        """
+        if not self._keys:
+            return None
+        return self._levels[self._key(self._keys[-1])].first()
+
+    def add(self, order):
+        """
+        O(log L) search for the price level. a new price level is inserted into the sorted keys, which is O(L), but a
+        memmove of L ints is cheap next to a balanced tree in python, and most orders join an existing level
+        :type order: BuyLimitOrderRequest or SellLimitOrderRequest
+        """
+        key = self._key(order.unit_price)
+        i = bisect_left(self._keys, key)
+        level = self._levels.get(order.unit_price)
+        if level is None:
+            level = self._levels[order.unit_price] = PriceLevel(order.unit_price)
+            self._keys.insert(i, key)
+
+        level.append(order)
+        self._order_n += 1
+        self._invalidate_depth(i)
+
+    def sweep_volume(self, volume):
+        """
+        the number of price levels, from the best one, that are exhausted by taking `volume` out of the book
+        :type volume: int
+        :rtype: int
+        """
+        return self._exhausted_level_n(self._cum_volume, volume)
+
+    def sweep_value(self, value):
+        """
+        the number of price levels, from the best one, that are exhausted by spending `value` on them
+        :type value: int
+        :rtype: int
+        """
+        return self._exhausted_level_n(self._cum_value, value)
+
+    def best_levels(self, n):
+        """
+        :type n: int
+        :rtype: list of PriceLevel
+        :return: the n best price levels, from the best one
+        """
+        return [self._levels[self._key(key)] for key in reversed(self._keys[len(self._keys) - n:])]
+
+    def drop_best_levels(self, n):
+        """
+        removes the n best price levels in one slice, all of their orders must be fulfilled already
+        :type n: int
+        """
+        if n == 0:
+            return
+
+        for key in self._keys[-n:]:
+            level = self._levels.pop(self._key(key))
+            for order in level:
+                assert order.volume_unfulfilled == 0
+                order.book_position = None
+            self._order_n -= len(level)
+        del self._keys[-n:]
+        self._invalidate_depth(len(self._keys))
+
+    def fill_best(self, volume):
+        """
+        book keeping after the best order is traded with `volume`, whose volume_unfulfilled is already reduced by the
+        trade. the best order leaves the book once it's fully fulfilled
+        :type volume: int
+        """
+        level = self._levels[self._key(self._keys[-1])]
+        level.volume -= volume
+        self._invalidate_depth(len(self._keys) - 1)
+        if level.first().volume_unfulfilled == 0:
+            level.pop_first()
+            self._order_n -= 1
+            if not level:
+                del self._levels[level.unit_price]
+                self._keys.pop()
+
+    def update_volume(self, order, volume_unfulfilled):
+        """
+        sets the unfulfilled volume of a resting order, which keeps its place, e.g. when its trades are replayed
+        from a processed block
+        :type order: BuyLimitOrderRequest or SellLimitOrderRequest
+        :type volume_unfulfilled: int
+        """
+        level = self._levels[order.unit_price]
+        level.volume += volume_unfulfilled - order.volume_unfulfilled
+        order.volume_unfulfilled = volume_unfulfilled
+        self._invalidate_depth(bisect_left(self._keys, self._key(order.unit_price)))
+
+    def remove(self, order):
+        """
+        the order is located in its price level in O(1) by its unit price and book position. the prefix sums from its
+        level on are invalidated, and a level left empty is deleted from the sorted keys, which is O(L) like in add
+        :type order: BuyLimitOrderRequest or SellLimitOrderRequest
+        :raise ValueError: the order is not in the book
+        """
+        level = self._levels.get(order.unit_price)
+        if level is None:
+            raise ValueError('order is not in this order book')
+        level.remove(order)
+        self._order_n -= 1
+
+        i = bisect_left(self._keys, self._key(order.unit_price))
+        self._invalidate_depth(i)
+        if not level:
+            del self._levels[order.unit_price]
+            del self._keys[i]
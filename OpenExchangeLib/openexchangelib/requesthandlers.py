@@ -17,50 +17,15 @@ def _add_payment(request, payments):
         request.related_payments[address] = amount + request.related_payments.get(address, 0)
 
 
-def _place_buy_limit_order(buy_order_book, buy_order):
+def _touch(kwargs, order):
     """
-    since we execute the requests in the order of their transactions, so we don't need timestamp for sorting.
-    in fact, their incoming order is more trustworthy than their timestamp since timestamp could be manipulated
-    the buy_order_book is sorted in descending order by unit price; if two requests have the same unit price, the new
-    one should be the latter
-    TODO: can improve time efficiency by binary search
-    :type buy_order_book: list of BuyLimitOrderRequest
-    :type buy_order: BuyLimitOrderRequest
-    :rtype : None
+    notes a resting order the request trades with or cancels, for the observers of process_block
+    :type kwargs: dict
+    :type order: BuyLimitOrderRequest or SellLimitOrderRequest
     """
-    loc = None
-    for i, buy_order_i in enumerate(buy_order_book):
-        if buy_order_i.unit_price < buy_order.unit_price:
-            loc = i
-            break
-
-    if loc is None:
-        buy_order_book.append(buy_order)
-    else:
-        buy_order_book.insert(loc, buy_order)
-
-
-def _place_sell_limit_order(sell_order_book, sell_order):
-    """
-    since we execute the requests in the order of their transactions, so we don't need timestamp for sorting.
-    in fact, their incoming order is more trustworthy than their timestamp since timestamp could be manipulated
-    the sell_order_book is sorted in ascending order by unit price; if two requests have the same unit price, the new
-    one should be the latter
-    TODO: can improve time efficiency by binary search
-    :type sell_order_book: list of SellLimitOrderRequest
-    :type sell_order: SellLimitOrderRequest
-    :rtype : None
-    """
-    loc = None
-    for i, sell_order_i in enumerate(sell_order_book):
-        if sell_order_i.unit_price > sell_order.unit_price:
-            loc = i
-            break
-
-    if loc is None:
-        sell_order_book.append(sell_order)
-    else:
-        sell_order_book.insert(loc, sell_order)
+    touched_orders = kwargs.get('touched_orders')
+    if touched_orders is not None:
+        touched_orders.append(order)
 
 
 def _trade_general(buy_request, sell_request, buyer, seller, unit_price, volume, timestamp, initiate_action):
@@ -141,7 +106,7 @@ def create_asset(transaction, service_address, block_timestamp, **kwargs):
             req.message = CreateAssetRequest.MSG_ASSET_ALREADY_REGISTERED
         else:
             req.state = Request.STATE_OK
-            exchange.assets[asset_name] = new_asset
+            exchange.register_asset(asset_name, new_asset)
 
     return req
 
@@ -200,6 +165,7 @@ def limit_buy(transaction, service_address, block_timestamp, **kwargs):
         assert isinstance(seller, User)
 
         _trade_general(req, sell_order, buyer, seller, unit_price, volume, block_timestamp, TradeItem.TRADE_TYPE_BUY)
+        _touch(kwargs, sell_order)
 
         #refund to buyer
         _add_payment(req, {req.user_address: (req.unit_price - unit_price) * volume})
@@ -253,27 +219,22 @@ def limit_buy(transaction, service_address, block_timestamp, **kwargs):
         #change
         _add_payment(req, {buyer_address: volume})
 
-        while True:
-            if asset.sell_order_book and asset.sell_order_book[0].unit_price <= req.unit_price:  # can buy something
-                if asset.sell_order_book[0].volume_unfulfilled >= req.volume_unfulfilled:  # req is fully fulfilled
-                    _trade(req, req.volume_unfulfilled, asset.sell_order_book[0])
-                    del buyer.active_orders[req.order_index]
-
-                    if asset.sell_order_book[0].volume_unfulfilled == 0:  # two orders both fulfilled
-                        del asset.users[asset.sell_order_book[0].user_address].active_orders[
-                            asset.sell_order_book[0].order_index]
-                        del asset.sell_order_book[0]
-
-                    break
-                else:  # only the sell order is fully fulfilled
-                    _trade(req, asset.sell_order_book[0].volume_unfulfilled, asset.sell_order_book[0])
-                    del asset.users[asset.sell_order_book[0].user_address].active_orders[
-                        asset.sell_order_book[0].order_index]
-                    del asset.sell_order_book[0]
-            else:  # can not buy anything
-                _place_buy_limit_order(asset.buy_order_book, req)
+        while req.volume_unfulfilled > 0:
+            sell_order = asset.sell_order_book.best()
+            if sell_order is None or sell_order.unit_price > req.unit_price:  # can not buy anything
                 break
 
+            volume = min(sell_order.volume_unfulfilled, req.volume_unfulfilled)
+            _trade(req, volume, sell_order)
+            asset.sell_order_book.fill_best(volume)
+            if sell_order.volume_unfulfilled == 0:  # the sell order is fully fulfilled
+                del asset.users[sell_order.user_address].active_orders[sell_order.order_index]
+
+        if req.volume_unfulfilled == 0:  # req is fully fulfilled
+            del buyer.active_orders[req.order_index]
+        else:
+            asset.buy_order_book.add(req)
+
         req.state = BuyLimitOrderRequest.STATE_OK
         return req
 
@@ -303,6 +264,7 @@ def limit_sell(transaction, service_address, block_timestamp, **kwargs):
         assert isinstance(buyer, User)
 
         _trade_general(buy_order, req, buyer, seller, unit_price, volume, block_timestamp, TradeItem.TRADE_TYPE_SELL)
+        _touch(kwargs, buy_order)
 
         #withdraw to seller
         _add_payment(req, {req.user_address: unit_price * volume})
@@ -359,27 +321,22 @@ def limit_sell(transaction, service_address, block_timestamp, **kwargs):
         #change
         _add_payment(req, {seller_address: sbtc_amount})
 
-        while True:
-            if asset.buy_order_book and asset.buy_order_book[0].unit_price >= req.unit_price:  # can sell something
-                if asset.buy_order_book[0].volume_unfulfilled >= req.volume_unfulfilled:  # req is fully fulfilled
-                    _trade(req, req.volume_unfulfilled, asset.buy_order_book[0])
-                    del seller.active_orders[req.order_index]
-
-                    if asset.buy_order_book[0].volume_unfulfilled == 0:  # two orders both fulfilled
-                        del asset.users[asset.buy_order_book[0].user_address].active_orders[
-                            asset.buy_order_book[0].order_index]
-                        del asset.buy_order_book[0]
-
-                    break
-                else:  # only the buy order is fully fulfilled
-                    _trade(req, asset.buy_order_book[0].volume_unfulfilled, asset.buy_order_book[0])
-                    del asset.users[asset.buy_order_book[0].user_address].active_orders[
-                        asset.buy_order_book[0].order_index]
-                    del asset.buy_order_book[0]
-            else:  # can not sell anything
-                _place_sell_limit_order(asset.sell_order_book, req)
+        while req.volume_unfulfilled > 0:
+            buy_order = asset.buy_order_book.best()
+            if buy_order is None or buy_order.unit_price < req.unit_price:  # can not sell anything
                 break
 
+            volume = min(buy_order.volume_unfulfilled, req.volume_unfulfilled)
+            _trade(req, volume, buy_order)
+            asset.buy_order_book.fill_best(volume)
+            if buy_order.volume_unfulfilled == 0:  # the buy order is fully fulfilled
+                del asset.users[buy_order.user_address].active_orders[buy_order.order_index]
+
+        if req.volume_unfulfilled == 0:  # req is fully fulfilled
+            del seller.active_orders[req.order_index]
+        else:
+            asset.sell_order_book.add(req)
+
         req.state = Request.STATE_OK
         return req
 
@@ -411,9 +368,11 @@ def market_buy(transaction, service_address, block_timestamp, **kwargs):
         assert volume > 0
 
         _trade_general(req, sell_order, buyer, seller, unit_price, volume, block_timestamp, TradeItem.TRADE_TYPE_BUY)
+        _touch(kwargs, sell_order)
 
         #withdraw to seller
         _add_payment(req, {sell_order.user_address: unit_price * volume})
+        return volume
 
     asset = kwargs['asset']
     assert isinstance(asset, Asset)
@@ -443,27 +402,25 @@ def market_buy(transaction, service_address, block_timestamp, **kwargs):
         req.message = message
         return req
     else:  # start processing limit buy
+        #sweep the price levels that are fully bought at once, then buy what is possible from the next level
+        exhausted_level_n = asset.sell_order_book.sweep_value(req.total_price_unfulfilled)
+        for level in asset.sell_order_book.best_levels(exhausted_level_n):
+            for sell_order in level:
+                _trade(req, sell_order)
+                assert sell_order.volume_unfulfilled == 0
+                del asset.users[sell_order.user_address].active_orders[sell_order.order_index]
+        asset.sell_order_book.drop_best_levels(exhausted_level_n)
+
         while True:
-            if asset.sell_order_book and asset.sell_order_book[
-                0].unit_price <= req.total_price_unfulfilled:  # can buy something
-                if asset.sell_order_book[0].volume_unfulfilled * asset.sell_order_book[
-                    0].unit_price >= req.total_price_unfulfilled:  # req is fully fulfilled
-                    _trade(req, asset.sell_order_book[0])
-
-                    if asset.sell_order_book[0].volume_unfulfilled == 0:  # two orders both fulfilled
-                        del asset.users[asset.sell_order_book[0].user_address].active_orders[
-                            asset.sell_order_book[0].order_index]
-                        del asset.sell_order_book[0]
-
-                    break
-                else:  # only the sell order is fully fulfilled
-                    _trade(req, asset.sell_order_book[0])
-                    del asset.users[asset.sell_order_book[0].user_address].active_orders[
-                        asset.sell_order_book[0].order_index]
-                    del asset.sell_order_book[0]
-            else:  # can not buy anything
+            sell_order = asset.sell_order_book.best()
+            if sell_order is None or sell_order.unit_price > req.total_price_unfulfilled:  # can not buy anything
                 break
 
+            volume = _trade(req, sell_order)
+            asset.sell_order_book.fill_best(volume)
+            if sell_order.volume_unfulfilled == 0:  # the sell order is fully fulfilled
+                del asset.users[sell_order.user_address].active_orders[sell_order.order_index]
+
         #add change payments
         _add_payment(req, {req.user_address: req.total_price_unfulfilled})
 
@@ -497,9 +454,11 @@ def market_sell(transaction, service_address, block_timestamp, **kwargs):
         volume = min(buy_order.volume_unfulfilled, req.volume_unfulfilled)
 
         _trade_general(buy_order, req, buyer, seller, unit_price, volume, block_timestamp, TradeItem.TRADE_TYPE_SELL)
+        _touch(kwargs, buy_order)
 
         #withdraw to seller
         _add_payment(req, {req.user_address: unit_price * volume})
+        return volume
 
     asset = kwargs['asset']
     assert isinstance(asset, Asset)
@@ -539,25 +498,25 @@ def market_sell(transaction, service_address, block_timestamp, **kwargs):
         _add_payment(req, {seller_address: sbtc_amount})
         seller.available -= volume
 
-        while True:
-            if asset.buy_order_book:  # can sell something
-                if asset.buy_order_book[0].volume_unfulfilled >= req.volume_unfulfilled:  # req is fully fulfilled
-                    _trade(req, asset.buy_order_book[0])
-
-                    if asset.buy_order_book[0].volume_unfulfilled == 0:  # two orders both fulfilled
-                        del asset.users[asset.buy_order_book[0].user_address].active_orders[
-                            asset.buy_order_book[0].order_index]
-                        del asset.buy_order_book[0]
-
-                    break
-                else:  # only the buy order is fully fulfilled
-                    _trade(req, asset.buy_order_book[0])
-                    del asset.users[asset.buy_order_book[0].user_address].active_orders[
-                        asset.buy_order_book[0].order_index]
-                    del asset.buy_order_book[0]
-            else:  # can not sell anything
+        #sweep the price levels that are fully sold to at once, then sell what is left to the next level
+        exhausted_level_n = asset.buy_order_book.sweep_volume(req.volume_unfulfilled)
+        for level in asset.buy_order_book.best_levels(exhausted_level_n):
+            for buy_order in level:
+                _trade(req, buy_order)
+                assert buy_order.volume_unfulfilled == 0
+                del asset.users[buy_order.user_address].active_orders[buy_order.order_index]
+        asset.buy_order_book.drop_best_levels(exhausted_level_n)
+
+        while req.volume_unfulfilled > 0:
+            buy_order = asset.buy_order_book.best()
+            if buy_order is None:  # can not sell anything
                 break
 
+            volume = _trade(req, buy_order)
+            asset.buy_order_book.fill_best(volume)
+            if buy_order.volume_unfulfilled == 0:  # the buy order is fully fulfilled
+                del asset.users[buy_order.user_address].active_orders[buy_order.order_index]
+
         req.state = Request.STATE_OK
         return req
 
@@ -595,8 +554,10 @@ def clear_order(transaction, service_address, block_timestamp, **kwargs):
             order = user.active_orders[index]
             order.trade_history.append(TradeItem.trade_cancelled(block_timestamp))
             del user.active_orders[index]
+            _touch(kwargs, order)
 
             assert isinstance(order, BuyLimitOrderRequest) or isinstance(order, SellLimitOrderRequest)
+            #the order is located by its book_position, no other resting order is touched
             if isinstance(order, BuyLimitOrderRequest):
                 asset.buy_order_book.remove(order)
                 _add_payment(req, {order.user_address: order.volume_unfulfilled * order.unit_price})
@@ -822,7 +783,7 @@ def asset_state_control(transaction, service_address, block_timestamp, **kwargs)
                     raise InitDataError('Please consider republishing the data file', asset=asset,
                                         asset_state=asset.state)
 
-                exchange.assets[kwargs['asset_name']] = asset
+                exchange.register_asset(kwargs['asset_name'], asset)
                 req.state = Request.STATE_OK
         else:
             assert request_state % 10 == 4  # partial change
@@ -884,4 +845,7 @@ def asset_state_control(transaction, service_address, block_timestamp, **kwargs)
                         raise InitDataError('Please consider republishing the data file',
                                                     update=u, host=host, inner_exception=e)
 
+            #service addresses may be changed by the updates
+            exchange.register_asset(kwargs['asset_name'], asset)
+
     return req
@@ -0,0 +1,452 @@
+#  compact binary format of an Exchange: its assets, users, votes and resting orders.
+#
+#  the content is a header, a table of all strings (addresses, hashes, asset names) and a sequence of integer tables.
+#  a table is n rows of integers stored column by column, every column has a fixed width, the narrowest of 1, 2, 4 or 8
+#  bytes its values fit in. strings are referred to by their index in the string table, datetimes are microseconds
+#  since the unix epoch. no class path is stored, so classes can move.
+#  resting orders are stored once per asset, the order books and active orders of users refer to them by index.
+#  transactions of resting orders keep only the fields the exchange uses: hash, input_addresses and outputs.
+#
+#  bump VERSION for any change of the layout, and keep decoders of the older versions in _DECODERS
+
+import gc
+import struct
+from datetime import timedelta
+from pybit.types import Transaction
+from types import OEBaseException, Exchange, Asset, User, Vote, BuyLimitOrderRequest, SellLimitOrderRequest, TradeItem
+from orderbook import OrderBook
+from util import UNIX_EPOCH
+
+MAGIC = 'OEXB'
+VERSION = 1
+_HEADER = struct.Struct('<4sH')  # magic, version
+_TABLE_HEADER = struct.Struct('<II')  # row number, width; followed by the type code of every column
+_COLUMN_TYPES = [('b', 1, -2 ** 7, 2 ** 7), ('h', 2, -2 ** 15, 2 ** 15), ('i', 4, -2 ** 31, 2 ** 31),
+                 ('q', 8, -2 ** 63, 2 ** 63)]
+_NONE = -2 ** 63  # None in integer columns
+_NO_STRING = -1  # None in string columns
+
+
+class SerializationError(OEBaseException):
+    pass
+
+
+def _to_micro(dt):
+    """
+    :type dt: datetime or None
+    :rtype: int
+    """
+    if dt is None:
+        return _NONE
+    delta = dt - UNIX_EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _from_micro(micro):
+    """
+    :type micro: int
+    :rtype: datetime or None
+    """
+    if micro == _NONE:
+        return None
+    return UNIX_EPOCH + timedelta(microseconds=micro)
+
+
+def _int(value):
+    return _NONE if value is None else value
+
+
+def _value(value):
+    return None if value == _NONE else value
+
+
+def _check_fields(obj, fields):
+    """
+    refuses to drop what the format does not know about
+    """
+    unknown = set(obj.__dict__) - fields
+    if unknown:
+        raise SerializationError('fields not supported by the binary format', type=type(obj).__name__,
+                                 fields=sorted(unknown))
+
+
+class _Writer(object):
+    def __init__(self):
+        self._string_ids = {}
+        self._strings = []
+        self._tables = []
+
+    def string(self, s):
+        """
+        :type s: str or None
+        :rtype: int
+        """
+        if s is None:
+            return _NO_STRING
+        if isinstance(s, unicode):
+            s = s.encode('utf-8')
+        string_id = self._string_ids.get(s)
+        if string_id is None:
+            string_id = self._string_ids[s] = len(self._strings)
+            self._strings.append(s)
+        return string_id
+
+    def table(self, rows, width):
+        """
+        :type rows: list of tuple
+        :type width: int
+        """
+        type_codes = []
+        columns = []
+        for column in zip(*rows):
+            low, high = min(column), max(column)
+            type_code = next(code for code, size, min_value, max_value in _COLUMN_TYPES
+                             if min_value <= low and high < max_value)
+            type_codes.append(type_code)
+            columns.append(struct.pack('<%d%s' % (len(column), type_code), *column))
+        if not rows:
+            type_codes = ['b'] * width
+        self._tables.append(''.join([_TABLE_HEADER.pack(len(rows), width)] + type_codes + columns))
+
+    def getvalue(self):
+        lengths = [len(s) for s in self._strings]
+        return ''.join([_HEADER.pack(MAGIC, VERSION), struct.pack('<I%dI' % len(lengths), len(lengths), *lengths)] +
+                       self._strings + self._tables)
+
+
+class _Reader(object):
+    def __init__(self, data, offset):
+        self._data = data
+        self._offset = offset
+
+        string_n, = struct.unpack_from('<I', data, self._offset)
+        self._offset += 4
+        lengths = struct.unpack_from('<%dI' % string_n, data, self._offset)
+        self._offset += string_n * 4
+
+        self.strings = []
+        for length in lengths:
+            self.strings.append(data[self._offset:self._offset + length])
+            self._offset += length
+        self.strings.append(None)  # strings[_NO_STRING]
+        self._times = {_NONE: None}
+
+    def time(self, micro):
+        """
+        datetimes repeat a lot, e.g. all the orders of a block share the block timestamp
+        :type micro: int
+        :rtype: datetime or None
+        """
+        dt = self._times.get(micro)
+        if dt is None and micro != _NONE:
+            dt = self._times[micro] = _from_micro(micro)
+        return dt
+
+    def table(self):
+        """
+        :rtype: list of tuple
+        """
+        row_n, width = _TABLE_HEADER.unpack_from(self._data, self._offset)
+        self._offset += _TABLE_HEADER.size
+        type_codes = self._data[self._offset:self._offset + width]
+        self._offset += width
+
+        columns = []
+        for type_code in type_codes:
+            columns.append(struct.unpack_from('<%d%s' % (row_n, type_code), self._data, self._offset))
+            self._offset += row_n * struct.calcsize(type_code)
+        return zip(*columns) if row_n else []
+
+
+_EXCHANGE_FIELDS = frozenset(['processed_block_height', 'processed_block_hash', 'state_control_address',
+                              'create_asset_address', 'open_exchange_address', 'payment_log_address', 'assets',
+                              'state', '_address_book', '_asset_addresses', '_service_addresses'])
+_ASSET_ADDRESSES = ['limit_buy_address', 'limit_sell_address', 'market_buy_address', 'market_sell_address',
+                    'clear_order_address', 'transfer_address', 'pay_address', 'create_vote_address', 'vote_address',
+                    'state_control_address', 'issuer_address']
+_ASSET_FIELDS = frozenset(_ASSET_ADDRESSES + ['total_shares', 'sell_order_book', 'buy_order_book', 'state', 'users',
+                                              'votes'])
+_USER_FIELDS = frozenset(['available', 'total', 'vote', 'order_counter', 'active_orders'])
+_VOTE_FIELDS = frozenset(['start_time', 'expire_time', 'vote_stat'])
+_ORDER_FIELDS = frozenset(['transaction', 'service_address', 'block_timestamp', 'state', 'message', 'related_payments',
+                           'user_address', 'order_index', 'volume_requested', 'volume_unfulfilled', 'unit_price',
+                           'book_position', 'trade_history', 'immediate_executed_trades'])
+_TRADE_FIELDS = frozenset(['unit_price', 'amount', 'timestamp', 'trade_type'])
+_SIDE_BUY = 1
+_SIDE_SELL = 2
+
+
+def _encode_asset(w, asset_name, asset, transactions):
+    """
+    :type w: _Writer
+    :type asset_name: str
+    :type asset: Asset
+    :param transactions: transactions of the resting orders met so far, from id of transaction to (index, transaction)
+    :type transactions: dict
+    :rtype: list of tuple
+    :return: the tables of the asset, as (rows, width)
+    """
+    _check_fields(asset, _ASSET_FIELDS)
+
+    orders = []
+    order_ids = {}
+
+    def order_id(order):
+        i = order_ids.get(id(order))
+        if i is None:
+            i = order_ids[id(order)] = len(orders)
+            orders.append(order)
+        return i
+
+    sell_book = [(order_id(order),) for order in asset.sell_order_book]
+    buy_book = [(order_id(order),) for order in asset.buy_order_book]
+
+    users, user_votes, user_active = [], [], []
+    for address, user in asset.users.iteritems():
+        _check_fields(user, _USER_FIELDS)
+        users.append((w.string(address), user.available, user.total, user.order_counter, len(user.vote),
+                      len(user.active_orders)))
+        user_votes.extend(user.vote.iteritems())
+        user_active.extend((index, order_id(order)) for index, order in user.active_orders.iteritems())
+
+    votes, vote_stats = [], []
+    for vote_id, vote in asset.votes.iteritems():
+        _check_fields(vote, _VOTE_FIELDS)
+        votes.append((vote_id, _to_micro(vote.start_time), _to_micro(vote.expire_time), len(vote.vote_stat)))
+        vote_stats.extend(vote.vote_stat.iteritems())
+
+    order_rows, payments, trades = [], [], []
+    for order in orders:
+        _check_fields(order, _ORDER_FIELDS)
+        if isinstance(order, BuyLimitOrderRequest):
+            side = _SIDE_BUY
+        elif isinstance(order, SellLimitOrderRequest):
+            side = _SIDE_SELL
+        else:
+            raise SerializationError('not a limit order', order=order)
+
+        tx = order.transaction
+        tx_id = transactions.get(id(tx))
+        if tx_id is None:
+            tx_id = transactions[id(tx)] = (len(transactions), tx)
+
+        order_rows.append((side, tx_id[0], w.string(order.service_address), _to_micro(order.block_timestamp),
+                           order.state, _int(order.message), w.string(order.user_address), _int(order.order_index),
+                           order.volume_requested, order.volume_unfulfilled, _int(order.unit_price),
+                           len(order.related_payments), len(order.trade_history),
+                           len(order.immediate_executed_trades)))
+        payments.extend((w.string(address), amount) for address, amount in order.related_payments.iteritems())
+        for trade in order.trade_history + order.immediate_executed_trades:
+            _check_fields(trade, _TRADE_FIELDS)
+            trades.append((_int(trade.unit_price), _int(trade.amount), _to_micro(trade.timestamp), trade.trade_type))
+
+    asset_row = tuple([w.string(asset_name), asset.total_shares, asset.state, len(users), len(votes)] +
+                      [w.string(getattr(asset, address)) for address in _ASSET_ADDRESSES])
+    return [([asset_row], len(asset_row)), (users, 6), (user_votes, 2), (user_active, 2), (votes, 4),
+            (vote_stats, 2), (order_rows, 14), (payments, 2), (trades, 4), (sell_book, 1), (buy_book, 1)]
+
+
+def dumps(exchange):
+    """
+    :type exchange: Exchange
+    :rtype: str
+    """
+    _check_fields(exchange, _EXCHANGE_FIELDS)
+
+    w = _Writer()
+    transactions = {}
+    asset_tables = [_encode_asset(w, asset_name, asset, transactions)
+                    for asset_name, asset in exchange.assets.iteritems()]
+
+    w.table([(exchange.processed_block_height, w.string(exchange.processed_block_hash),
+              w.string(exchange.state_control_address), w.string(exchange.create_asset_address),
+              w.string(exchange.open_exchange_address), w.string(exchange.payment_log_address), exchange.state,
+              len(exchange.assets))], 8)
+
+    txs, inputs, outputs = [], [], []
+    for _, tx in sorted(transactions.itervalues()):
+        txs.append((w.string(tx.hash), len(tx.input_addresses), len(tx.outputs)))
+        inputs.extend((w.string(address),) for address in tx.input_addresses)
+        outputs.extend((n, w.string(address), value) for n, address, value in tx.outputs)
+    w.table(txs, 3)
+    w.table(inputs, 1)
+    w.table(outputs, 3)
+
+    for tables in asset_tables:
+        for rows, width in tables:
+            w.table(rows, width)
+    return w.getvalue()
+
+
+def _decode_asset_v1(r, transactions):
+    """
+    :type r: _Reader
+    :type transactions: list of Transaction
+    :rtype: tuple of (str, Asset)
+    """
+    (asset_row,), users, user_votes, user_active, votes, vote_stats, order_rows, payments, trades, sell_book, \
+        buy_book = [r.table() for _ in xrange(11)]
+    strings, time = r.strings, r.time
+
+    orders = []
+    payment_i = trade_i = 0
+    for side, tx_id, service_address, block_timestamp, state, message, user_address, order_index, volume_requested, \
+            volume_unfulfilled, unit_price, payment_n, trade_n, immediate_n in order_rows:
+        order_class = BuyLimitOrderRequest if side == _SIDE_BUY else SellLimitOrderRequest
+        order = order_class.__new__(order_class)
+        order.__dict__ = {
+            'transaction': transactions[tx_id], 'service_address': strings[service_address],
+            'block_timestamp': time(block_timestamp), 'state': state, 'message': _value(message),
+            'related_payments': {strings[address]: amount
+                                 for address, amount in payments[payment_i:payment_i + payment_n]},
+            'user_address': strings[user_address], 'order_index': _value(order_index),
+            'volume_requested': volume_requested, 'volume_unfulfilled': volume_unfulfilled,
+            'unit_price': _value(unit_price), 'book_position': None,
+            'trade_history': [_trade_v1(row, time) for row in trades[trade_i:trade_i + trade_n]],
+            'immediate_executed_trades': [_trade_v1(row, time) for row in
+                                          trades[trade_i + trade_n:trade_i + trade_n + immediate_n]],
+        }
+        payment_i += payment_n
+        trade_i += trade_n + immediate_n
+        orders.append(order)
+
+    asset = Asset.__new__(Asset)
+    asset_name, total_shares, state, user_n, vote_n = asset_row[:5]
+    asset.__dict__.update((name, strings[address]) for name, address in zip(_ASSET_ADDRESSES, asset_row[5:]))
+    asset.total_shares = total_shares
+    asset.state = state
+    asset.sell_order_book = OrderBook(OrderBook.SIDE_SELL, [orders[i] for i, in sell_book])
+    asset.buy_order_book = OrderBook(OrderBook.SIDE_BUY, [orders[i] for i, in buy_book])
+
+    asset.users = {}
+    vote_i = active_i = 0
+    for address, available, total, order_counter, user_vote_n, active_n in users:
+        user = User.__new__(User)
+        user.__dict__ = {
+            'available': available, 'total': total, 'order_counter': order_counter,
+            'vote': dict(user_votes[vote_i:vote_i + user_vote_n]) if user_vote_n else {},
+            'active_orders': {index: orders[i] for index, i in user_active[active_i:active_i + active_n]}
+            if active_n else {},
+        }
+        vote_i += user_vote_n
+        active_i += active_n
+        asset.users[strings[address]] = user
+
+    asset.votes = {}
+    stat_i = 0
+    for vote_id, start_time, expire_time, stat_n in votes:
+        vote = Vote.__new__(Vote)
+        vote.__dict__ = {'start_time': time(start_time), 'expire_time': time(expire_time),
+                         'vote_stat': dict(vote_stats[stat_i:stat_i + stat_n])}
+        stat_i += stat_n
+        asset.votes[vote_id] = vote
+
+    assert len(asset.users) == user_n and len(asset.votes) == vote_n
+    return strings[asset_name], asset
+
+
+def _trade_v1(row, time):
+    unit_price, amount, timestamp, trade_type = row
+    trade = TradeItem.__new__(TradeItem)
+    trade.__dict__ = {'unit_price': _value(unit_price), 'amount': _value(amount), 'timestamp': time(timestamp),
+                      'trade_type': trade_type}
+    return trade
+
+
+def _decode_v1(r):
+    """
+    :type r: _Reader
+    :rtype: Exchange
+    """
+    (exchange_row,), txs, inputs, outputs = [r.table() for _ in xrange(4)]
+    strings = r.strings
+
+    transactions = []
+    input_i = output_i = 0
+    for tx_hash, input_n, output_n in txs:
+        tx = Transaction.__new__(Transaction)
+        tx.hash = strings[tx_hash]
+        tx.input_addresses = [strings[address] for address, in inputs[input_i:input_i + input_n]]
+        tx.outputs = [(n, strings[address], value) for n, address, value in outputs[output_i:output_i + output_n]]
+        input_i += input_n
+        output_i += output_n
+        transactions.append(tx)
+
+    height, block_hash, state_control, create_asset, open_exchange, payment_log, state, asset_n = exchange_row
+    exchange = Exchange.__new__(Exchange)
+    exchange.processed_block_height = height
+    exchange.processed_block_hash = strings[block_hash]
+    exchange.state_control_address = strings[state_control]
+    exchange.create_asset_address = strings[create_asset]
+    exchange.open_exchange_address = strings[open_exchange]
+    exchange.payment_log_address = strings[payment_log]
+    exchange.state = state
+    exchange.assets = dict(_decode_asset_v1(r, transactions) for _ in xrange(asset_n))
+    return exchange
+
+
+_DECODERS = {
+    1: _decode_v1,
+}
+
+
+def is_binary(data):
+    """
+    :type data: str
+    :rtype: bool
+    """
+    return data[:len(MAGIC)] == MAGIC
+
+
+def loads(data):
+    """
+    :type data: str
+    :rtype: Exchange
+    """
+    if not is_binary(data):
+        raise SerializationError('not an exchange in the binary format')
+    magic, version = _HEADER.unpack_from(data)
+    decoder = _DECODERS.get(version)
+    if decoder is None:
+        raise SerializationError('unsupported version of the binary format', version=version)
+
+    # decoding creates lots of objects and no garbage, collections triggered by the allocations are wasted
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return decoder(_Reader(data, _HEADER.size))
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def save_exchange(exchange, file_full_name):
+    """
+    :type exchange: Exchange
+    :type file_full_name: str
+    """
+    from util import save_bytes
+
+    save_bytes(dumps(exchange), file_full_name)
+
+
+def load_exchange(file_full_name):
+    """
+    reads an exchange in the binary format, or pickled by util.save_obj
+    :type file_full_name: str
+    :rtype: Exchange
+    """
+    import cPickle
+
+    with open(file_full_name, 'rb') as f:
+        data = f.read()
+    return loads(data) if is_binary(data) else cPickle.loads(data)
+
+
+def convert_pickle(src_file_name, dst_file_name=None):
+    """
+    rewrites an exchange pickled by util.save_obj in the binary format, in place if dst_file_name is None
+    :type src_file_name: str
+    :type dst_file_name: str or None
+    """
+    save_exchange(load_exchange(src_file_name), dst_file_name or src_file_name)
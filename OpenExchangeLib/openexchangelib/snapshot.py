@@ -0,0 +1,232 @@
+#  read-only snapshots: key -> bytes in one file, queried in place through mmap. many processes reading the same
+#  snapshot share one copy of it in the page cache, instead of each holding the whole unpickled state.
+#
+#  <folder>/<height>           the snapshot of the state after block <height>
+#  <folder>/LATEST             the height of the latest snapshot
+#
+#  a snapshot file is the header, the values, the keys, then the table: one fixed size record per key, sorted by key,
+#  so a key is found by binary search without loading anything. values are usually pickles, keys are str
+
+import os
+import struct
+
+MAGIC = 'OESNAP01'
+LATEST_FILE_NAME = 'LATEST'
+_HEADER = struct.Struct('<8sIQ')  # magic, number of keys, offset of the table
+_RECORD = struct.Struct('<QIQQ')  # key offset, key length, value offset, value length
+
+
+def key(*parts):
+    """
+    :param parts: str or int
+    :rtype: str
+    """
+    return '\x00'.join(str(part) for part in parts)
+
+
+def dump_snapshot(items):
+    """
+    :param items: (key, value) pairs, keys are unique
+    :type items: iterable of (str, str)
+    :rtype: str
+    """
+    items = sorted(items)
+    data = [None]
+    offset = _HEADER.size
+    value_offsets = []
+    for k, value in items:
+        data.append(value)
+        value_offsets.append(offset)
+        offset += len(value)
+    key_offsets = []
+    for k, value in items:
+        data.append(k)
+        key_offsets.append(offset)
+        offset += len(k)
+    for (k, value), key_offset, value_offset in zip(items, key_offsets, value_offsets):
+        data.append(_RECORD.pack(key_offset, len(k), value_offset, len(value)))
+    data[0] = _HEADER.pack(MAGIC, len(items), offset)
+    return ''.join(data)
+
+
+class Snapshot(object):
+    def __init__(self, file_name):
+        """
+        :type file_name: str
+        """
+        import mmap
+        from openexchangelib.types import OEBaseException
+
+        self.file_name = file_name
+        with open(file_name, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < _HEADER.size:  # mmap refuses empty files
+                raise OEBaseException('not a snapshot', file_name=file_name)
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._n, self._table = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or self._table + self._n * _RECORD.size > len(self._map):  # foreign or truncated
+            self._map.close()
+            raise OEBaseException('not a snapshot', file_name=file_name)
+
+    def _record(self, i):
+        return _RECORD.unpack_from(self._map, self._table + i * _RECORD.size)
+
+    def _key(self, i):
+        key_offset, key_length, value_offset, value_length = self._record(i)
+        return self._map[key_offset:key_offset + key_length]
+
+    def _find(self, k):
+        """
+        :return: index of the first key >= k
+        :rtype: int
+        """
+        low, high = 0, self._n
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < k:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def get(self, k, default=None):
+        """
+        :type k: str
+        :rtype: str
+        """
+        i = self._find(k)
+        if i == self._n or self._key(i) != k:
+            return default
+        key_offset, key_length, value_offset, value_length = self._record(i)
+        return self._map[value_offset:value_offset + value_length]
+
+    def get_buffer(self, k):
+        """
+        like get, but the value is not copied out of the map, for values read in parts, e.g. by struct.unpack_from
+        :type k: str
+        :rtype: buffer or None
+        """
+        i = self._find(k)
+        if i == self._n or self._key(i) != k:
+            return None
+        key_offset, key_length, value_offset, value_length = self._record(i)
+        return buffer(self._map, value_offset, value_length)
+
+    def __contains__(self, k):
+        i = self._find(k)
+        return i < self._n and self._key(i) == k
+
+    def __len__(self):
+        return self._n
+
+    def keys(self, prefix=''):
+        """
+        the keys starting with prefix, in order
+        """
+        for i in xrange(self._find(prefix), self._n):
+            k = self._key(i)
+            if not k.startswith(prefix):
+                break
+            yield k
+
+    def items(self, prefix=''):
+        """
+        (key, value) of the keys starting with prefix, in order, e.g. to copy them into the next snapshot
+        """
+        for i in xrange(self._find(prefix), self._n):
+            key_offset, key_length, value_offset, value_length = self._record(i)
+            k = self._map[key_offset:key_offset + key_length]
+            if not k.startswith(prefix):
+                break
+            yield k, self._map[value_offset:value_offset + value_length]
+
+    def close(self):
+        self._map.close()
+
+
+def save_snapshot(folder, data, height, keep=None):
+    """
+    writes the snapshot, then points LATEST to it. snapshots above the previous latest one are from blocks dropped
+    since, they are removed
+    :type folder: str
+    :param data: see dump_snapshot
+    :type data: str
+    :type height: int
+    :param keep: only this many latest snapshots are kept. readers may still have the removed ones open
+    :type keep: int or None
+    """
+    from openexchangelib import util
+
+    previous_height = latest_height(folder)
+    util.save_bytes(data, os.path.join(folder, str(height)))
+    set_latest(folder, height)
+
+    others = [h for h in snapshot_heights(folder) if h != height]
+    stale = [h for h in others if previous_height is not None and h > previous_height]
+    old = [h for h in others if h not in stale]
+    old = old[:max(len(old) - keep + 1, 0)] if keep is not None else []
+    for h in stale + old:
+        os.remove(os.path.join(folder, str(h)))
+
+
+def set_latest(folder, height):
+    """
+    points LATEST to an existing snapshot, e.g. after the latest block is dropped
+    :type folder: str
+    :type height: int
+    """
+    from openexchangelib import util
+
+    util.save_bytes(str(height), os.path.join(folder, LATEST_FILE_NAME))
+
+
+def snapshot_heights(folder):
+    """
+    :rtype: list of int
+    """
+    return sorted(int(f) for f in os.listdir(folder) if f.isdigit())
+
+
+def latest_height(folder):
+    """
+    :rtype: int or None
+    """
+    try:
+        with open(os.path.join(folder, LATEST_FILE_NAME), 'rb') as f:
+            return int(f.read())
+    except (IOError, ValueError):
+        return None
+
+
+def version(folder):
+    """
+    changes whenever a snapshot is saved, cheap enough to be checked on every web request
+    :rtype: tuple or None
+    """
+    try:
+        stat = os.stat(os.path.join(folder, LATEST_FILE_NAME))
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime, stat.st_size
+
+
+def open_snapshot(folder, height):
+    """
+    :type folder: str
+    :type height: int
+    :return: None if the snapshot is not kept, or its file is not a whole snapshot
+    :rtype: Snapshot or None
+    """
+    from openexchangelib.types import OEBaseException
+
+    try:
+        return Snapshot(os.path.join(folder, str(height)))
+    except (IOError, OSError, OEBaseException):
+        return None
+
+
+def open_latest(folder):
+    """
+    :rtype: Snapshot or None
+    """
+    height = latest_height(folder)
+    return open_snapshot(folder, height) if height is not None else None
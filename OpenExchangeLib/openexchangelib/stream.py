@@ -0,0 +1,328 @@
+#  an ordered, durable stream of processed blocks. one process runs process_block and publishes every block it
+#  processes; any number of consumers read the stream, each keeping its own cursor, instead of fetching and
+#  processing the blocks again.
+#
+#  <folder>/stream.<seq>       a segment: the items from sequence number <seq> on, one record per item, see journal.py
+#  <folder>/cursor.<name>      the sequence number of the last item consumer <name> is done with
+#
+#  an item is a ProcessedBlock, or a Rewind when the publisher drops its latest block for a fork. sequence numbers
+#  grow by one per item, starting from 1. a height comes again after a rewind, so consumers should check heights:
+#  an item for a block they already have (a duplicate after a crash) is skipped
+
+import os
+
+from openexchangelib.observers import Observer
+
+SEGMENT_PREFIX = 'stream.'
+CURSOR_PREFIX = 'cursor.'
+SEGMENT_SIZE = 1000  # items per segment
+
+
+#the fields of an asset that a ProcessedBlock ships as changes, the others are shipped whole
+_DELTA_FIELDS = ('users', 'sell_order_book', 'buy_order_book')
+
+
+class ChangeCollector(Observer):
+    def __init__(self, exchange):
+        """
+        created right before the block is processed, and passed to process_block with the other observers. it notes
+        what the requests of the block change, for ProcessedBlock
+        :type exchange: Exchange
+        """
+        self.assets_before = dict(exchange.assets)
+        #the assets with requests in the block
+        self.asset_names = set()
+        #the assets a request changed in place beyond their users and orders
+        self.reinitialized = set()
+        #asset name -> set of the addresses of the users the requests may change
+        self.user_addresses = {}
+        #(asset_name, order) of the limit orders of the block, and of the resting orders they traded with or cancelled
+        self.placed_orders = []
+        self.touched_orders = []
+
+    def _users(self, asset_name):
+        users = self.user_addresses.get(asset_name)
+        if users is None:
+            users = self.user_addresses[asset_name] = set()
+        return users
+
+    def on_request(self, req, asset_name):
+        if asset_name is not None:
+            self.asset_names.add(asset_name)
+            #an order creates its user, even if it fails
+            self._users(asset_name).update(req.transaction.input_addresses[:1])
+
+    def on_order_placed(self, req, asset_name):
+        from openexchangelib.types import BuyLimitOrderRequest, SellLimitOrderRequest
+
+        if isinstance(req, (BuyLimitOrderRequest, SellLimitOrderRequest)):
+            self.placed_orders.append((asset_name, req))
+
+    def on_orders_touched(self, req, asset_name, orders):
+        self._users(asset_name).update(order.user_address for order in orders)
+        self.touched_orders.extend((asset_name, order) for order in orders)
+
+    def on_transfer(self, req, asset_name):
+        self._users(asset_name).update(req.transfer_targets)
+
+    def on_state_control(self, req, asset_name):
+        from openexchangelib.types import AssetStateControlRequest
+
+        if isinstance(req, AssetStateControlRequest) and req.request_state % 10 in [3, 4]:
+            self.reinitialized.add(asset_name)
+
+
+def _update_order(order, processed):
+    """
+    the consumer's order takes the state of the processed copy, but keeps its place in the consumer's order book
+    """
+    order.__dict__.update((k, v) for k, v in processed.__dict__.iteritems() if k != 'book_position')
+
+
+def _find_order(exchange, key):
+    asset_name, user_address, order_index = key
+    return exchange.assets[asset_name].users[user_address].active_orders[order_index]
+
+
+def _order_book(asset, order):
+    from openexchangelib.types import SellLimitOrderRequest
+
+    return asset.sell_order_book if isinstance(order, SellLimitOrderRequest) else asset.buy_order_book
+
+
+class ProcessedBlock(object):
+    def __init__(self, exchange, block, requests, changes):
+        """
+        taken right after the block is processed. it keeps the changes of the block: the assets listed or
+        re-initialized in full, and for the other assets with requests in the block, their fields but the users and
+        order books, the users the requests touched, and the orders that entered, changed in or left the order books.
+        they are taken from what the requests touched, not by comparing the assets before and after the block
+        :type exchange: Exchange
+        :type block: Block
+        :type requests: list of Request
+        :type changes: ChangeCollector
+        """
+        self.height = block.height
+        self.hash = block.hash
+        self.previous_hash = block.previous_hash
+        self.timestamp = block.timestamp
+        self.requests = requests
+        self.exchange_state = exchange.state
+
+        self.new_assets = {asset_name: asset for asset_name, asset in exchange.assets.iteritems()
+                           if asset is not changes.assets_before.get(asset_name) or asset_name in changes.reinitialized}
+        #asset name -> field -> value, of the fields not in _DELTA_FIELDS
+        self.asset_fields = {}
+        #asset name -> user address -> User, the users changed or added
+        self.users = {}
+        for asset_name in changes.asset_names - set(self.new_assets):
+            asset = exchange.assets[asset_name]
+            self.asset_fields[asset_name] = {k: v for k, v in asset.__dict__.iteritems() if k not in _DELTA_FIELDS}
+            self.users[asset_name] = {user_address: asset.users[user_address]
+                                      for user_address in changes.user_addresses.get(asset_name, ())
+                                      if user_address in asset.users}
+
+        #(asset_name, order) of the orders that entered an order book, in the order they did
+        self.placed_orders = [(asset_name, order) for asset_name, order in changes.placed_orders
+                              if asset_name in self.asset_fields and order.book_position is not None]
+        #(asset_name, user_address, order_index) -> order, of the orders traded but still in an order book
+        self.changed_orders = {}
+        #(asset_name, user_address, order_index) -> order, of the orders that left an order book
+        self.closed_orders = {}
+        placed = set(id(order) for asset_name, order in changes.placed_orders)
+        for asset_name, order in changes.touched_orders:
+            if asset_name in self.asset_fields and id(order) not in placed:
+                key = (asset_name, order.user_address, order.order_index)
+                if order.book_position is None:
+                    self.closed_orders[key] = order
+                else:
+                    self.changed_orders[key] = order
+
+    def asset_names(self):
+        """
+        :return: the names of the assets the block changed or listed
+        :rtype: set of str
+        """
+        return set(self.new_assets) | set(self.asset_fields)
+
+    def apply_to(self, exchange):
+        """
+        brings the consumer's exchange to the state after the block. the consumer's order objects stay in place,
+        changed ones are updated, so the requests in its histories remain the orders in its order books
+        :type exchange: Exchange
+        :rtype: list of Request
+        """
+        for asset_name, asset in self.new_assets.iteritems():
+            exchange.register_asset(asset_name, asset)
+
+        for key, closed in self.closed_orders.iteritems():
+            asset = exchange.assets[key[0]]
+            order = _find_order(exchange, key)
+            _order_book(asset, order).remove(order)
+            _update_order(order, closed)
+        for key, changed in self.changed_orders.iteritems():
+            asset = exchange.assets[key[0]]
+            order = _find_order(exchange, key)
+            _order_book(asset, order).update_volume(order, changed.volume_unfulfilled)
+            _update_order(order, changed)
+
+        for asset_name, fields in self.asset_fields.iteritems():
+            asset = exchange.assets[asset_name]
+            asset.__dict__.update(fields)
+            for user_address, user in self.users[asset_name].iteritems():
+                old_orders = asset.users[user_address].active_orders if user_address in asset.users else {}
+                for order_index in user.active_orders:
+                    if order_index in old_orders:
+                        user.active_orders[order_index] = old_orders[order_index]
+                asset.users[user_address] = user
+        for asset_name, order in self.placed_orders:
+            asset = exchange.assets[asset_name]
+            _order_book(asset, order).add(order)
+
+        exchange.state = self.exchange_state
+        exchange.processed_block_height = self.height
+        exchange.processed_block_hash = self.hash
+        return self.requests
+
+
+class Rewind(object):
+    def __init__(self, height):
+        """
+        the publisher dropped block `height`
+        :type height: int
+        """
+        self.height = height
+
+
+def _segments(folder):
+    """
+    :rtype: list of int
+    :return: the first sequence numbers of the segments
+    """
+    if not os.path.isdir(folder):
+        return []
+    return sorted(int(f[len(SEGMENT_PREFIX):]) for f in os.listdir(folder)
+                  if f.startswith(SEGMENT_PREFIX) and f[len(SEGMENT_PREFIX):].isdigit())
+
+
+def _segment(folder, first_seq):
+    from openexchangelib import journal
+
+    return journal.BlockJournal(os.path.join(folder, SEGMENT_PREFIX + str(first_seq)))
+
+
+class StreamWriter(object):
+    def __init__(self, folder):
+        """
+        only one writer per folder. the item cut by a crash at the end of the stream is dropped
+        :type folder: str
+        """
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.folder = folder
+
+        segments = _segments(folder)
+        self._first_seq = segments[-1] if segments else 1
+        segment = _segment(folder, self._first_seq)
+        segment.truncate()
+        seqs = segment.heights()
+        self.last_seq = seqs[-1] if seqs else self._first_seq - 1
+
+    def append(self, item, writer=None):
+        """
+        the item is pickled right away, it may be written later by the writer
+        :type item: ProcessedBlock or Rewind
+        :param writer: anything with submit(func, *args), e.g. ExchangeServer's BackgroundWriter
+        :return: the sequence number of the item
+        :rtype: int
+        """
+        from openexchangelib import journal
+
+        seq = self.last_seq + 1
+        jobs = []
+        if seq - self._first_seq >= SEGMENT_SIZE:
+            self._first_seq = seq
+            jobs.append((self.prune, ()))
+        jobs.append((_segment(self.folder, self._first_seq).append, (journal.dump_record(seq, item),)))
+        self.last_seq = seq
+
+        for func, args in jobs:
+            if writer is None:
+                func(*args)
+            else:
+                writer.submit(func, *args)
+        return seq
+
+    def prune(self):
+        """
+        removes the segments every consumer is done with. without any consumer, everything is kept
+        """
+        cursors = [StreamReader(self.folder, name).cursor() for name in consumers(self.folder)]
+        if not cursors:
+            return
+        segments = _segments(self.folder)
+        for first_seq, next_first_seq in zip(segments, segments[1:]):
+            if next_first_seq - 1 <= min(cursors):
+                _segment(self.folder, first_seq).remove()
+
+
+def exists(folder):
+    """
+    :return: whether anything was ever published to the folder
+    :rtype: bool
+    """
+    return bool(_segments(folder))
+
+
+def consumers(folder):
+    """
+    :rtype: list of str
+    """
+    if not os.path.isdir(folder):
+        return []
+    return sorted(f[len(CURSOR_PREFIX):] for f in os.listdir(folder)
+                  if f.startswith(CURSOR_PREFIX) and not f.endswith('.tmp'))
+
+
+class StreamReader(object):
+    def __init__(self, folder, name):
+        """
+        :type folder: str
+        :param name: the consumer, its cursor is kept in the stream folder
+        :type name: str
+        """
+        self.folder = folder
+        self.name = name
+
+    def cursor(self):
+        """
+        :return: the sequence number of the last item done with, 0 for none
+        :rtype: int
+        """
+        try:
+            with open(os.path.join(self.folder, CURSOR_PREFIX + self.name), 'rb') as f:
+                return int(f.read())
+        except (IOError, ValueError):
+            return 0
+
+    def commit(self, seq):
+        """
+        :type seq: int
+        """
+        from openexchangelib import util
+
+        util.save_bytes(str(seq), os.path.join(self.folder, CURSOR_PREFIX + self.name))
+
+    def items(self, after=None):
+        """
+        yields (seq, item) after the cursor, or after seq `after`. it stops at the end of the stream at the time of
+        the call
+        """
+        after = self.cursor() if after is None else after
+        segments = _segments(self.folder)
+        for i, first_seq in enumerate(segments):
+            if i + 1 < len(segments) and segments[i + 1] <= after + 1:
+                continue
+            for seq, item in _segment(self.folder, first_seq).items():
+                if seq > after:
+                    yield seq, item
@@ -0,0 +1,235 @@
+#  the trade tape: every trade of an asset, append only, stored by column. each column is a file of fixed size
+#  little-endian numbers, one per trade, in trade order; the columns are memory mapped when read, as numpy arrays if
+#  numpy is installed.
+#
+#  <folder>/<asset_name>/<column>    see COLUMNS
+#
+#  the height column never decreases, the trades of a block dropped for a fork are cut by truncate. appends are not
+#  synced one by one, the tape is synced with the checkpoints of the state instead (see sync): after a crash, the
+#  blocks after the checkpoint are replayed and appended again, the ones the tape already holds are skipped.
+#  a crash may leave the columns at different lengths, the trades only some of them hold are dropped
+
+import os
+import struct
+
+#name, struct format
+COLUMNS = [
+    ('time', 'q'),  # milliseconds since the epoch, the block time
+    ('price', 'q'),  # unit price in satoshi
+    ('volume', 'q'),
+    ('side', 'b'),  # TradeItem.TRADE_TYPE_BUY or TRADE_TYPE_SELL, the side of the taker
+    ('height', 'i'),  # the block of the trade
+    ('order_index', 'q'),  # the taker's order, see BuyLimitOrderRequest.order_index, -1 for market orders
+]
+_FORMATS = dict(COLUMNS)
+_HEIGHT = 4  # the index of the height column
+
+
+def trade_row(trade, height, order_index):
+    """
+    :type trade: TradeItem
+    :type height: int
+    :type order_index: int or None
+    :return: the values of the trade, in the order of COLUMNS
+    :rtype: tuple
+    """
+    from openexchangelib import util
+
+    return (util.datetime_to_timestamp(trade.timestamp) * 1000, trade.unit_price, trade.amount, trade.trade_type,
+            height, -1 if order_index is None else order_index)
+
+
+def _column_file(folder, name):
+    return os.path.join(folder, name)
+
+
+def _length(folder):
+    """
+    :return: the number of trades all the columns hold
+    :rtype: int
+    """
+    lengths = [os.path.getsize(_column_file(folder, name)) // struct.calcsize('<' + fmt)
+               if os.path.isfile(_column_file(folder, name)) else 0 for name, fmt in COLUMNS]
+    return min(lengths)
+
+
+class TapeWriter(object):
+    def __init__(self, folder):
+        """
+        only one writer per tape
+        :param folder: the tape of one asset
+        :type folder: str
+        """
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.folder = folder
+        self._truncate_rows(_length(folder))
+
+    def _truncate_rows(self, n):
+        for name, fmt in COLUMNS:
+            file_name = _column_file(self.folder, name)
+            size = n * struct.calcsize('<' + fmt)
+            if not os.path.isfile(file_name):
+                open(file_name, 'wb').close()
+            elif os.path.getsize(file_name) > size:
+                with open(file_name, 'r+b') as f:
+                    f.truncate(size)
+
+    def truncate(self, height):
+        """
+        drops the trades of the blocks after height
+        :type height: int
+        """
+        tape = Tape(self.folder)
+        try:
+            n = tape.first_after(height)
+            if n < len(tape):
+                self._truncate_rows(n)
+        finally:
+            tape.close()
+
+    def append(self, rows):
+        """
+        the trades of one or more blocks, in order. the tape may already hold some of these blocks, e.g. replayed after
+        a crash: the blocks it holds as many trades of are skipped, from the first other one on, the trades it holds
+        are dropped and replaced. not synced, see sync
+        :param rows: see trade_row
+        :type rows: list of tuple
+        """
+        from bisect import bisect_right
+
+        heights = [row[_HEIGHT] for row in rows]
+        tape = Tape(self.folder)
+        try:
+            i = 0
+            while i < len(rows):
+                end = bisect_right(heights, heights[i])
+                first = tape.first_after(heights[i] - 1)
+                if tape.first_after(heights[i]) - first != end - i:
+                    break
+                i = end
+        finally:
+            tape.close()
+        if i == len(rows):
+            return
+
+        self._truncate_rows(first)
+
+        for column, (name, fmt) in enumerate(COLUMNS):
+            with open(_column_file(self.folder, name), 'ab') as f:
+                f.write(struct.pack('<%d%s' % (len(rows) - i, fmt), *[row[column] for row in rows[i:]]))
+
+    def sync(self):
+        """
+        makes the trades appended so far durable
+        """
+        for name, fmt in COLUMNS:
+            with open(_column_file(self.folder, name), 'r+b') as f:
+                os.fsync(f.fileno())
+
+
+class _Column(object):
+    """
+    a read-only sequence over a mapped column, when numpy is not installed
+    """
+    def __init__(self, data, fmt, n):
+        self._data = data
+        self._struct = struct.Struct('<' + fmt)
+        self._n = n
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in xrange(*i.indices(self._n))]
+        if i < 0:
+            i += self._n
+        if not 0 <= i < self._n:
+            raise IndexError(i)
+        return self._struct.unpack_from(self._data, i * self._struct.size)[0]
+
+    def __iter__(self):
+        for i in xrange(self._n):
+            yield self[i]
+
+
+class Tape(object):
+    def __init__(self, folder):
+        """
+        the trades on the tape when it's opened, the ones appended later are not seen
+        :param folder: the tape of one asset
+        :type folder: str
+        """
+        self.folder = folder
+        self._n = _length(folder) if os.path.isdir(folder) else 0
+        self._maps = {}
+
+    def __len__(self):
+        return self._n
+
+    def column(self, name):
+        """
+        :param name: see COLUMNS
+        :type name: str
+        :return: numpy array if numpy is installed, or a read-only sequence
+        """
+        import mmap
+
+        fmt = _FORMATS[name]
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+
+        if self._n == 0:
+            return numpy.zeros(0, dtype='<' + fmt) if numpy is not None else _Column('', fmt, 0)
+        if name not in self._maps:
+            with open(_column_file(self.folder, name), 'rb') as f:
+                self._maps[name] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if numpy is not None:
+            return numpy.frombuffer(self._maps[name], dtype='<' + fmt, count=self._n)
+        return _Column(self._maps[name], fmt, self._n)
+
+    def first_after(self, height):
+        """
+        :return: the index of the first trade of the blocks after height
+        :rtype: int
+        """
+        from bisect import bisect_right
+
+        return bisect_right(self.column('height'), height)
+
+    def rows(self, start=0, end=None):
+        """
+        :return: the trades from start to end, in the order of COLUMNS, as python ints
+        :rtype: list of tuple
+        """
+        end = self._n if end is None else min(end, self._n)
+        columns = [self.column(name) for name, fmt in COLUMNS]
+        return [tuple(int(column[i]) for column in columns) for i in xrange(start, end)]
+
+    def close(self):
+        """
+        drops the references of the tape to its maps, it doesn't unmap them: a column taken from the tape holds its map,
+        which is unmapped once the column is gone too. so the columns stay valid after close
+        """
+        self._maps = {}
+
+
+def tape_folder(folder, asset_name):
+    """
+    :type folder: str
+    :type asset_name: str
+    :rtype: str
+    """
+    return os.path.join(folder, asset_name)
+
+
+def asset_names(folder):
+    """
+    :rtype: list of str
+    """
+    if not os.path.isdir(folder):
+        return []
+    return sorted(f for f in os.listdir(folder) if os.path.isdir(os.path.join(folder, f)))
@@ -65,11 +65,9 @@ def start():
     block_n = pybit.get_block_count()
     util.write_log(logger, block_n=block_n, blank_lines=2)
 
-    for i in xrange(1, block_n+1):
-        block = pybit.get_block_by_height(i)
-        util.write_log(logger, i=i, block=block, blank_lines=2)
-
-        requests = openexchangelib.process_block(exchange, block, asset_data)
+    blocks = (pybit.get_block_by_height(i) for i in xrange(1, block_n+1))
+    for block, requests in openexchangelib.process_blocks(exchange, blocks, asset_data):
+        util.write_log(logger, i=block.height, block=block, blank_lines=2)
         util.write_log(logger, requests=requests, blank_lines=2)
 
         util.write_log(logger, exchange=exchange, blank_lines=2)
@@ -0,0 +1,74 @@
+import unittest
+
+from openexchangelib import candles
+
+MINUTE = candles.RESOLUTIONS['1m']
+
+
+class CandlesTest(unittest.TestCase):
+    def test_add(self):
+        c = candles.Candles(MINUTE)
+        c.add(MINUTE + 1, 2.0, 10)
+        c.add(MINUTE + 2, 3.0, 1)
+        c.add(MINUTE + 3, 1.0, 2)
+        c.add(3 * MINUTE, 4.0, 5)
+        self.assertEqual(c.candles, [[MINUTE, 2.0, 3.0, 1.0, 1.0, 13], [3 * MINUTE, 4.0, 4.0, 4.0, 4.0, 5]])
+
+    def test_older_trade(self):
+        c = candles.Candles(MINUTE)
+        c.add(3 * MINUTE, 4.0, 5)
+        c.add(MINUTE, 2.0, 1)  # block times are not monotonic
+        c.add(3 * MINUTE + 1, 5.0, 1)
+        c.add(MINUTE + 1, 1.0, 1)
+        self.assertEqual(c.candles, [[MINUTE, 2.0, 2.0, 1.0, 2.0, 2], [3 * MINUTE, 4.0, 5.0, 4.0, 5.0, 6]])
+
+    def test_build(self):
+        built = candles.build([[MINUTE, 2.0, 1], [2 * MINUTE, 3.0, 1]])
+        self.assertEqual(sorted(built), sorted(candles.RESOLUTIONS))
+        self.assertEqual(len(built['1m'].candles), 2)
+        self.assertEqual(built['1h'].candles, [[0, 2.0, 3.0, 2.0, 3.0, 2]])
+
+
+class QueryTest(unittest.TestCase):
+    def setUp(self):
+        c = candles.Candles(MINUTE)
+        for i in xrange(10):
+            c.add(i * 2 * MINUTE, float(i), i)
+        self.rows = c.candles
+        self.packed = c.dump()
+
+    def times(self, rows):
+        return [row[0] // MINUTE for row in rows]
+
+    def test_all(self):
+        self.assertEqual(candles.query(self.packed), self.rows)
+        self.assertEqual(candles.query(buffer(self.packed)), self.rows)
+
+    def test_range(self):
+        self.assertEqual(self.times(candles.query(self.packed, 4 * MINUTE, 8 * MINUTE)), [4, 6, 8])
+        # the bounds don't have to be open times
+        self.assertEqual(self.times(candles.query(self.packed, 3 * MINUTE, 9 * MINUTE)), [4, 6, 8])
+        self.assertEqual(self.times(candles.query(self.packed, from_time=15 * MINUTE)), [16, 18])
+        self.assertEqual(self.times(candles.query(self.packed, to_time=2 * MINUTE)), [0, 2])
+
+    def test_out_of_range(self):
+        self.assertEqual(candles.query(self.packed, 19 * MINUTE), [])
+        self.assertEqual(candles.query(self.packed, to_time=-1), [])
+        self.assertEqual(candles.query(self.packed, 8 * MINUTE, 4 * MINUTE), [])
+        self.assertEqual(candles.query(''), [])
+
+    def test_limit(self):
+        self.assertEqual(self.times(candles.query(self.packed, limit=2)), [16, 18])
+        self.assertEqual(self.times(candles.query(self.packed, 2 * MINUTE, 10 * MINUTE, 2)), [8, 10])
+        self.assertEqual(len(candles.query(self.packed, limit=100)), 10)
+        self.assertEqual(candles.query(self.packed, limit=0), [])
+
+    def test_count(self):
+        self.assertEqual(candles.count(self.packed), 10)
+        self.assertEqual(candles.count(self.packed, 3 * MINUTE, 9 * MINUTE), 3)
+        self.assertEqual(candles.count(self.packed, 8 * MINUTE, 4 * MINUTE), 0)
+        self.assertEqual(candles.count(''), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+
+from openexchangelib.types import Exchange, Asset, AddressCollisionError
+
+
+def _asset(prefix, issuer='issuer'):
+    names = ['limit_buy', 'limit_sell', 'market_buy', 'market_sell', 'clear_order', 'transfer', 'pay', 'create_vote',
+             'vote', 'state_control']
+    return Asset(1000, *([prefix + name for name in names] + [issuer]))
+
+
+class RegisterAssetTest(unittest.TestCase):
+    def setUp(self):
+        self.exchange = Exchange(state_control_address='ex_state', create_asset_address='ex_create')
+        self.exchange.register_asset('A', _asset('a_'))
+
+    def test_address_book(self):
+        self.assertEqual(self.exchange.address_book()['a_pay'], ('A', 'pay'))
+        self.assertEqual(self.exchange.address_book()['ex_create'], (None, 'create_asset'))
+        self.assertIn('a_vote', self.exchange.service_addresses())
+
+    def test_reinit_replaces_the_addresses(self):
+        self.exchange.register_asset('A', _asset('a2_'))
+        self.assertNotIn('a_pay', self.exchange.address_book())
+        self.assertEqual(self.exchange.address_book()['a2_pay'], ('A', 'pay'))
+        self.assertNotIn('a_pay', self.exchange.service_addresses())
+
+    def test_collision_changes_nothing(self):
+        old_b = _asset('b_')
+        self.exchange.register_asset('B', old_b)
+        before = dict(self.exchange.address_book())
+
+        colliding = _asset('b2_')
+        colliding.pay_address = 'a_pay'
+        self.assertRaises(AddressCollisionError, self.exchange.register_asset, 'B', colliding)
+        self.assertIs(self.exchange.assets['B'], old_b)
+        self.assertEqual(self.exchange.address_book(), before)
+
+        colliding.pay_address = 'ex_state'
+        self.assertRaises(AddressCollisionError, self.exchange.register_asset, 'C', colliding)
+        self.assertNotIn('C', self.exchange.assets)
+        self.assertEqual(self.exchange.address_book(), before)
+
+        colliding.pay_address = colliding.vote_address
+        self.assertRaises(AddressCollisionError, self.exchange.register_asset, 'C', colliding)
+        self.assertEqual(self.exchange.address_book(), before)
+
+
+if __name__ == '__main__':
+    unittest.main()
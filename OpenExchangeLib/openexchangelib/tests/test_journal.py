@@ -0,0 +1,143 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from openexchangelib import journal, util
+
+
+class _Exchange(object):
+    def __init__(self, height):
+        self.processed_block_height = height
+
+
+class _State(object):
+    """
+    a chained state whose blocks are their heights, it keeps the blocks applied to it
+    """
+    def __init__(self, height):
+        self.exchange = _Exchange(height)
+        self.blocks = []
+
+    def apply_block(self, block, asset_init_data):
+        assert block == self.exchange.processed_block_height + 1
+        self.blocks.append(block)
+        self.exchange.processed_block_height = block
+
+
+class BlockJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.journal = journal.BlockJournal(os.path.join(self.folder, 'journal.0'))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_append_and_read(self):
+        for h in [1, 2, 3]:
+            self.journal.append(journal.dump_record(h, ('block', h)))
+        self.assertEqual(self.journal.heights(), [1, 2, 3])
+        self.assertEqual(list(self.journal.items()), [(1, ('block', 1)), (2, ('block', 2)), (3, ('block', 3))])
+        self.assertEqual(list(self.journal.entries(2)), [('block', 1), ('block', 2)])
+
+    def test_record_cut_by_a_crash(self):
+        for h in [1, 2]:
+            self.journal.append(journal.dump_record(h, h))
+        size = os.path.getsize(self.journal.file_name)
+        self.journal.append(journal.dump_record(3, 'x' * 100)[:50])
+        self.assertEqual(self.journal.heights(), [1, 2])
+
+        self.journal.truncate()
+        self.assertEqual(os.path.getsize(self.journal.file_name), size)
+        self.journal.append(journal.dump_record(3, 3))
+        self.assertEqual(list(self.journal.items()), [(1, 1), (2, 2), (3, 3)])
+
+    def test_cut_header(self):
+        self.journal.append(journal.dump_record(1, 1))
+        self.journal.append(journal.dump_record(2, 2)[:3])
+        self.assertEqual(self.journal.heights(), [1])
+
+    def test_truncate_and_pop(self):
+        for h in [1, 2, 3, 4]:
+            self.journal.append(journal.dump_record(h, h))
+        self.journal.truncate(3)
+        self.assertEqual(self.journal.heights(), [1, 2])
+        self.assertEqual(self.journal.pop(), 2)
+        self.assertEqual(self.journal.pop(), 1)
+        self.assertIsNone(self.journal.pop())
+
+
+class CheckpointTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def push(self, state, checkpoint=False):
+        height = state.exchange.processed_block_height
+        if checkpoint:
+            journal.save_checkpoint(self.folder, util.dump_obj(state), height)
+        else:
+            journal.journal_of(self.folder, journal.latest_checkpoint_height(self.folder)).append(
+                journal.dump_record(height, (height, None)))
+
+    def build(self, last_height, checkpoint_every):
+        state = _State(0)
+        self.push(state, True)
+        for h in xrange(1, last_height + 1):
+            state.apply_block(h, None)
+            self.push(state, h % checkpoint_every == 0)
+        return state
+
+    def test_load_replays_the_journal(self):
+        self.build(7, 3)
+        self.assertEqual(journal.checkpoint_heights(self.folder), [0, 3, 6])
+        self.assertEqual(journal.latest_height(self.folder), 7)
+        state, checkpoint_height = journal.load_state(self.folder)
+        self.assertEqual((state.exchange.processed_block_height, checkpoint_height), (7, 6))
+        self.assertEqual(state.blocks, range(1, 8))
+        state, checkpoint_height = journal.load_state(self.folder, 5)
+        self.assertEqual((state.exchange.processed_block_height, checkpoint_height), (5, 3))
+        self.assertEqual(state.blocks, range(1, 6))
+
+    def test_rewind(self):
+        self.build(4, 3)
+        heights = []
+        while journal.rewind(self.folder):
+            heights.append(journal.latest_height(self.folder))
+        self.assertEqual(heights, [3, 2, 1, 0, None])
+        self.assertIsNone(journal.load_state(self.folder)[0])
+
+    def test_remove_from(self):
+        self.build(8, 3)
+        self.assertEqual(journal.remove_from(self.folder, 5), [6])
+        self.assertEqual(journal.latest_checkpoint_height(self.folder), 3)
+        self.assertEqual(journal.load_state(self.folder)[0].exchange.processed_block_height, 4)
+
+    def test_load_after_a_crash_during_append(self):
+        self.build(4, 3)
+        journal.journal_of(self.folder, 3).append(journal.dump_record(5, (5, None))[:10])
+        self.assertEqual(journal.latest_height(self.folder), 4)
+        state, _ = journal.load_state(self.folder, repair=True)
+        self.assertEqual(state.exchange.processed_block_height, 4)
+        self.push(_State(5))
+        self.assertEqual(journal.latest_height(self.folder), 5)
+
+    def test_stale_latest_pointer(self):
+        self.build(6, 3)
+        util.save_bytes('9', os.path.join(self.folder, journal.LATEST_FILE_NAME))
+        self.assertEqual(journal.latest_checkpoint_height(self.folder), 6)
+
+    def test_maintain(self):
+        self.build(12, 1)
+        removed = journal.maintain(self.folder, keep_last=3, keep_every=5)
+        self.assertEqual(removed, [1, 2, 3, 4, 6, 7, 8, 9])
+        self.assertEqual(journal.checkpoint_heights(self.folder), [0, 5, 10, 11, 12])
+        self.assertTrue(os.path.isfile(os.path.join(self.folder, '5' + journal.COMPRESSED_SUFFIX)))
+        self.assertTrue(os.path.isfile(os.path.join(self.folder, '12')))
+        self.assertEqual(journal.load_state(self.folder, 7)[0].exchange.processed_block_height, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
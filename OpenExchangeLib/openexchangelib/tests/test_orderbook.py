@@ -0,0 +1,135 @@
+import random
+import unittest
+
+from openexchangelib.orderbook import OrderBook
+
+
+class _Order(object):
+    def __init__(self, n, unit_price, volume):
+        self.n = n
+        self.unit_price = unit_price
+        self.volume_unfulfilled = volume
+        self.book_position = None
+
+    def __repr__(self):
+        return '<%d %d@%d>' % (self.n, self.volume_unfulfilled, self.unit_price)
+
+
+class _ListBook(object):
+    """
+    the order book as it was before OrderBook: a plain list sorted by priority, new orders go after the ones of the
+    same price
+    """
+    def __init__(self, side):
+        self.side = side
+        self.orders = []
+
+    def _better(self, a, b):
+        return a > b if self.side == OrderBook.SIDE_BUY else a < b
+
+    def add(self, order):
+        for i, o in enumerate(self.orders):
+            if self._better(order.unit_price, o.unit_price):
+                self.orders.insert(i, order)
+                return
+        self.orders.append(order)
+
+    def remove(self, order):
+        self.orders.remove(order)
+
+    def levels(self):
+        levels = []
+        for o in self.orders:
+            if levels and levels[-1][0] == o.unit_price:
+                levels[-1][1] += o.volume_unfulfilled
+            else:
+                levels.append([o.unit_price, o.volume_unfulfilled])
+        return [tuple(level) for level in levels]
+
+    def sweep(self, amount, value):
+        n, total = 0, 0
+        for unit_price, volume in self.levels():
+            total += volume * unit_price if value else volume
+            if total > amount:
+                break
+            n += 1
+        return n
+
+
+class OrderBookTest(unittest.TestCase):
+    def check(self, book, reference):
+        self.assertEqual(list(book), reference.orders)
+        self.assertEqual(len(book), len(reference.orders))
+        self.assertEqual(list(book.levels()), reference.levels())
+        self.assertIs(book.best(), reference.orders[0] if reference.orders else None)
+        self.assertEqual(book.best_price(), reference.orders[0].unit_price if reference.orders else None)
+
+    def test_fifo_within_price_level(self):
+        book = OrderBook(OrderBook.SIDE_SELL)
+        orders = [_Order(0, 5, 1), _Order(1, 3, 1), _Order(2, 5, 1), _Order(3, 3, 1)]
+        for order in orders:
+            book.add(order)
+        self.assertEqual([o.n for o in book], [1, 3, 0, 2])
+
+        book = OrderBook(OrderBook.SIDE_BUY, orders)
+        self.assertEqual([o.n for o in book], [0, 2, 1, 3])
+
+    def test_cancel_keeps_the_order_of_the_others(self):
+        orders = [_Order(i, 10, 1) for i in xrange(10)]
+        book = OrderBook(OrderBook.SIDE_BUY, orders)
+        for i in [0, 5, 9, 3, 4, 6]:
+            book.remove(orders[i])
+            self.assertIsNone(orders[i].book_position)
+        self.assertEqual([o.n for o in book], [1, 2, 7, 8])
+        book.add(_Order(10, 10, 1))
+        self.assertEqual([o.n for o in book], [1, 2, 7, 8, 10])
+        self.assertRaises(ValueError, book.remove, _Order(11, 10, 1))
+        self.assertRaises(ValueError, book.remove, _Order(12, 20, 1))  # no level of its price
+
+    def test_sweep(self):
+        book = OrderBook(OrderBook.SIDE_SELL, [_Order(0, 2, 5), _Order(1, 1, 3), _Order(2, 3, 4), _Order(3, 1, 2)])
+        # levels from the best: 1 x 5, 2 x 5, 3 x 4
+        self.assertEqual([book.sweep_volume(v) for v in [0, 4, 5, 9, 10, 13, 14, 100]], [0, 0, 1, 1, 2, 2, 3, 3])
+        self.assertEqual([book.sweep_value(v) for v in [4, 5, 14, 15, 26, 27]], [0, 1, 1, 2, 2, 3])
+
+        self.assertEqual([level.unit_price for level in book.best_levels(2)], [1, 2])
+        for level in book.best_levels(2):
+            for order in level:
+                order.volume_unfulfilled = 0
+        book.drop_best_levels(2)
+        self.assertEqual([o.n for o in book], [2])
+        self.assertEqual(book.sweep_volume(4), 1)
+
+    def test_random_against_list_book(self):
+        rnd = random.Random(7)
+        for side in [OrderBook.SIDE_BUY, OrderBook.SIDE_SELL]:
+            book, reference = OrderBook(side), _ListBook(side)
+            n = 0
+            for step in xrange(3000):
+                action = rnd.random()
+                if action < 0.5 or not reference.orders:
+                    order = _Order(n, rnd.randint(90, 110), rnd.randint(1, 20))
+                    n += 1
+                    book.add(order)
+                    reference.add(order)
+                elif action < 0.75:
+                    order = rnd.choice(reference.orders)
+                    book.remove(order)
+                    reference.remove(order)
+                else:
+                    best = reference.orders[0]
+                    volume = rnd.randint(1, best.volume_unfulfilled)
+                    best.volume_unfulfilled -= volume
+                    book.fill_best(volume)
+                    if best.volume_unfulfilled == 0:
+                        reference.orders.pop(0)
+                amount = rnd.randint(0, 200)
+                self.assertEqual(book.sweep_volume(amount), reference.sweep(amount, False))
+                self.assertEqual(book.sweep_value(amount * 100), reference.sweep(amount * 100, True))
+                if step % 50 == 0:
+                    self.check(book, reference)
+            self.check(book, reference)
+
+
+if __name__ == '__main__':
+    unittest.main()
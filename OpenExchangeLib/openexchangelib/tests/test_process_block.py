@@ -0,0 +1,152 @@
+import unittest
+from datetime import datetime
+
+from pybit.types import Block, Transaction
+from openexchangelib import candidate_transactions, process_block, process_blocks
+from openexchangelib.observers import Observer
+from openexchangelib.tests.test_serialization import _canonical, _exchange
+
+
+class _NeverDisjoint(object):
+    """
+    in place of the service addresses: no transaction is skipped before looping over its outputs
+    """
+    def isdisjoint(self, addresses):
+        return False
+
+
+def _fixture():
+    exchange = _exchange()
+    asset = exchange.assets['A']
+    for order in asset.sell_order_book:  # the shares on sale are not available
+        asset.users[order.user_address].available -= order.volume_unfulfilled
+    return exchange
+
+
+def _block(exchange, transactions):
+    return Block(exchange.processed_block_height + 1, 'h', exchange.processed_block_hash, datetime(2014, 1, 3),
+                 transactions)
+
+
+def _blocks(exchange, transaction_lists):
+    height, previous_hash = exchange.processed_block_height, exchange.processed_block_hash
+    blocks = []
+    for n, transactions in enumerate(transaction_lists):
+        blocks.append(Block(height + n + 1, 'h%d' % n, previous_hash, datetime(2014, 1, 3 + n), transactions))
+        previous_hash = blocks[-1].hash
+    return blocks
+
+
+class _Recorder(Observer):
+    def __init__(self):
+        self.seen = []
+
+    def on_request(self, req, asset_name):
+        self.seen.append((req.transaction.hash, asset_name))
+
+
+#unrelated transactions around requests, and requests whose service output is not the first one
+TRANSACTIONS = [
+    Transaction('x1', ['z1'], [(0, 'nobody', 5), (1, 'z1', 7)]),
+    Transaction('t1', ['u4'], [(0, 'nobody', 1), (1, 'u4', 2), (2, 'a_limit_buy', 10000 * 5 + 5)]),
+    Transaction('x2', ['z2'], [(0, 'nobody', 5)]),
+    Transaction('t2', ['u1'], [(0, 'u1', 1), (1, 'a_transfer', 1), (2, 'u5', 100)]),
+    Transaction('t3', ['u2'], [(0, 'a_limit_sell', 20000 + 1), (1, 'b_limit_sell', 20000 + 1)]),
+    Transaction('x3', ['z3'], []),
+]
+
+
+class CandidateTransactionsTest(unittest.TestCase):
+    def test_service_transactions(self):
+        exchange = _fixture()
+        self.assertEqual([tx.hash for tx in candidate_transactions(exchange, TRANSACTIONS)], ['t1', 't2', 't3'])
+
+    def test_everything_after_a_listing_is_kept(self):
+        exchange = _fixture()
+        listing = Transaction('t0', ['z0'], [(0, 'z0', 1), (1, exchange.create_asset_address, 1)])
+        transactions = TRANSACTIONS[:1] + [listing] + TRANSACTIONS[1:]
+        self.assertEqual([tx.hash for tx in candidate_transactions(exchange, transactions)],
+                         ['t0', 't1', 'x2', 't2', 't3', 'x3'])
+
+        re_init = Transaction('t0', ['z0'], [(0, exchange.assets['B'].state_control_address, 1)])
+        self.assertEqual([tx.hash for tx in candidate_transactions(exchange, [re_init] + TRANSACTIONS)],
+                         ['t0'] + [tx.hash for tx in TRANSACTIONS])
+
+
+class FastPathTest(unittest.TestCase):
+    def process(self, transactions, skip=True):
+        exchange = _fixture()
+        if not skip:
+            exchange.service_addresses = lambda: _NeverDisjoint()
+        requests = process_block(exchange, _block(exchange, transactions))
+        if not skip:
+            del exchange.service_addresses
+        return _canonical(requests), _canonical(exchange)
+
+    def test_same_as_the_slow_path(self):
+        requests, state = self.process(TRANSACTIONS)
+        #asset B is paused, its request is ignored
+        self.assertEqual([req[0] for req in requests],
+                         ['BuyLimitOrderRequest', 'TransferRequest', 'SellLimitOrderRequest', 'Request'])
+        self.assertEqual((requests, state), self.process(TRANSACTIONS, skip=False))
+
+    def test_only_the_candidates(self):
+        exchange = _fixture()
+        self.assertEqual(self.process(candidate_transactions(exchange, TRANSACTIONS)), self.process(TRANSACTIONS))
+
+    def test_service_output_after_unrelated_ones(self):
+        requests, state = self.process(TRANSACTIONS[1:2])
+        self.assertEqual(len(requests), 1)
+        self.assertEqual((requests, state), self.process(TRANSACTIONS[1:2], skip=False))
+
+
+class ProcessBlocksTest(unittest.TestCase):
+    BLOCKS = [TRANSACTIONS[:2], [], TRANSACTIONS[2:4], TRANSACTIONS[4:]]
+
+    def one_by_one(self):
+        exchange = _fixture()
+        recorder = _Recorder()
+        requests = [_canonical(process_block(exchange, block, observers=[recorder]))
+                    for block in _blocks(exchange, self.BLOCKS)]
+        return requests, _canonical(exchange), recorder.seen
+
+    def test_same_as_process_block(self):
+        exchange = _fixture()
+        blocks = _blocks(exchange, self.BLOCKS)
+        recorder = _Recorder()
+        processed = list(process_blocks(exchange, iter(blocks), observers=[recorder]))
+        self.assertEqual([block for block, requests in processed], blocks)
+        requests, state, seen = self.one_by_one()
+        self.assertEqual([_canonical(r) for block, r in processed], requests)
+        self.assertEqual(_canonical(exchange), state)
+        self.assertEqual(recorder.seen, seen)
+
+    def test_requests_not_kept(self):
+        exchange = _fixture()
+        recorder = _Recorder()
+        processed = list(process_blocks(exchange, _blocks(exchange, self.BLOCKS), keep_requests=False,
+                                        observers=[recorder]))
+        self.assertEqual([r for block, r in processed], [None] * len(self.BLOCKS))
+        requests, state, seen = self.one_by_one()
+        self.assertEqual((_canonical(exchange), recorder.seen), (state, seen))
+
+    def test_prepare(self):
+        exchange = _fixture()
+        recorders = {}
+
+        def prepare(block):
+            self.assertEqual(exchange.processed_block_height, block.height - 1)  # called right before the block
+            recorders[block.height] = _Recorder()
+            return None, [recorders[block.height]]
+
+        replaced = _Recorder()
+        list(process_blocks(exchange, _blocks(exchange, self.BLOCKS), observers=[replaced], prepare=prepare))
+        requests, state, seen = self.one_by_one()
+        self.assertEqual(_canonical(exchange), state)
+        self.assertEqual(replaced.seen, [])
+        self.assertEqual(sum((recorders[h].seen for h in sorted(recorders)), []), seen)
+        self.assertEqual(len(recorders), len(self.BLOCKS))
+
+
+if __name__ == '__main__':
+    unittest.main()
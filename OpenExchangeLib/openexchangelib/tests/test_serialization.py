@@ -0,0 +1,96 @@
+import unittest
+from datetime import datetime
+
+from pybit.types import Transaction
+from openexchangelib import serialization
+from openexchangelib.orderbook import OrderBook
+from openexchangelib.types import Exchange, Asset, User, Vote, BuyLimitOrderRequest, SellLimitOrderRequest, \
+    TradeItem, Request
+from openexchangelib.tests.test_exchange import _asset
+
+
+def _canonical(obj):
+    """
+    the content of obj as plain values, to compare states without relying on __eq__
+    """
+    if isinstance(obj, OrderBook):
+        return [_canonical(order) for order in obj]
+    if isinstance(obj, dict):
+        return sorted((_canonical(k), _canonical(v)) for k, v in obj.iteritems())
+    if isinstance(obj, (list, tuple)):
+        return [_canonical(v) for v in obj]
+    if hasattr(obj, '__dict__'):
+        return type(obj).__name__, sorted((k, _canonical(v)) for k, v in obj.__dict__.iteritems()
+                                          if k not in ['book_position', '_address_book', '_asset_addresses',
+                                                       '_service_addresses'])
+    return obj
+
+
+def _order(cls, n, user_address, unit_price, volume, traded=0):
+    tx = Transaction('tx%d' % n, [user_address], [(0, 'service', 10000), (1, user_address, 5)])
+    order = cls(tx, 'service', datetime(2014, 1, 2, 3, 4, 5, n), n, volume, unit_price)
+    order.state = Request.STATE_OK
+    if traded:
+        trade = TradeItem(unit_price, traded, datetime(2014, 1, 2, 3, 5), TradeItem.TRADE_TYPE_BUY)
+        order.trade_history.append(trade)
+        order.immediate_executed_trades.append(trade)
+        order.volume_unfulfilled -= traded
+    return order
+
+
+def _exchange():
+    exchange = Exchange(processed_block_height=300000, processed_block_hash='00' * 32)
+    asset = _asset('a_')
+    asset.state = Asset.STATE_RUNNING
+    for i, address in enumerate(['u1', 'u2', 'u3']):
+        asset.users[address] = User(1000 * (i + 1))
+    asset.users['u1'].vote = {1: 2}
+    asset.votes[1] = Vote(datetime(2014, 1, 1), datetime(2014, 2, 1), {1: 1000, 2: 0})
+    asset.votes[2] = Vote(None, None, {})
+
+    orders = [_order(SellLimitOrderRequest, 0, 'u1', 120, 10), _order(SellLimitOrderRequest, 1, 'u2', 110, 5, 2),
+              _order(BuyLimitOrderRequest, 2, 'u3', 100, 7), _order(BuyLimitOrderRequest, 3, 'u1', 100, 1)]
+    for order in orders:
+        book = asset.sell_order_book if isinstance(order, SellLimitOrderRequest) else asset.buy_order_book
+        book.add(order)
+        asset.users[order.user_address].active_orders[order.order_index] = order
+        asset.users[order.user_address].order_counter += 1
+
+    exchange.register_asset('A', asset)
+    exchange.register_asset('B', _asset('b_'))
+    exchange.state = Exchange.STATE_RUNNING
+    return exchange
+
+
+class SerializationTest(unittest.TestCase):
+    def test_round_trip(self):
+        exchange = _exchange()
+        data = serialization.dumps(exchange)
+        self.assertTrue(serialization.is_binary(data))
+        loaded = serialization.loads(data)
+        self.assertEqual(_canonical(loaded), _canonical(exchange))
+        self.assertEqual(serialization.dumps(loaded), data)
+
+    def test_orders_are_shared(self):
+        loaded = serialization.loads(serialization.dumps(_exchange()))
+        asset = loaded.assets['A']
+        for order in list(asset.sell_order_book) + list(asset.buy_order_book):
+            self.assertIs(asset.users[order.user_address].active_orders[order.order_index], order)
+        self.assertEqual([o.order_index for o in asset.buy_order_book], [2, 3])
+        self.assertEqual(loaded.address_book()['a_pay'], ('A', 'pay'))
+
+        order = asset.buy_order_book.best()
+        asset.buy_order_book.remove(order)
+        self.assertEqual([o.order_index for o in asset.buy_order_book], [3])
+
+    def test_unknown_fields_are_refused(self):
+        exchange = _exchange()
+        exchange.assets['A'].users['u1'].nickname = 'x'
+        self.assertRaises(serialization.SerializationError, serialization.dumps, exchange)
+
+    def test_not_binary(self):
+        self.assertFalse(serialization.is_binary('\x80\x02cfoo'))
+
+
+if __name__ == '__main__':
+    unittest.main()
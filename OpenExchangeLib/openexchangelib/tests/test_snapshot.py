@@ -0,0 +1,81 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from openexchangelib import snapshot
+from openexchangelib.types import OEBaseException
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def open(self, items):
+        snapshot.save_snapshot(self.folder, snapshot.dump_snapshot(items), 1)
+        return snapshot.open_latest(self.folder)
+
+    def test_get_and_keys(self):
+        items = [(snapshot.key('user', 'A', 'u%d' % i), 'v%d' % i) for i in xrange(50)]
+        items += [(snapshot.key('user', 'AB', 'u1'), 'ab'), (snapshot.key('block'), ''), ('z', 'last')]
+        s = self.open(reversed(items))
+        self.assertEqual(len(s), len(items))
+        for k, value in items:
+            self.assertIn(k, s)
+            self.assertEqual(s.get(k), value)
+        self.assertIsNone(s.get(snapshot.key('user', 'A')))
+        self.assertEqual(s.get('zz', 'default'), 'default')
+        self.assertNotIn('a', s)
+
+        self.assertEqual(list(s.keys(snapshot.key('user', 'A', ''))), sorted(k for k, _ in items[:50]))
+        self.assertEqual(list(s.keys(snapshot.key('user', 'AB', ''))), [snapshot.key('user', 'AB', 'u1')])
+        self.assertEqual(list(s.keys('nothing')), [])
+        self.assertEqual(list(s.keys()), sorted(k for k, _ in items))
+        self.assertEqual(list(s.items(snapshot.key('user', 'AB', ''))), [(snapshot.key('user', 'AB', 'u1'), 'ab')])
+        self.assertEqual(list(s.items()), sorted(items))
+        s.close()
+
+    def test_get_buffer(self):
+        s = self.open([('packed', struct.pack('<qq', 3, 4))])
+        self.assertEqual(struct.unpack_from('<qq', s.get_buffer('packed')), (3, 4))
+        self.assertIsNone(s.get_buffer('missing'))
+        s.close()
+
+    def test_empty(self):
+        s = self.open([])
+        self.assertEqual((len(s), list(s.keys()), s.get('a')), (0, [], None))
+        s.close()
+
+    def test_latest_and_retention(self):
+        for height in xrange(1, 6):
+            snapshot.save_snapshot(self.folder, snapshot.dump_snapshot([('h', str(height))]), height, keep=3)
+        self.assertEqual(snapshot.snapshot_heights(self.folder), [3, 4, 5])
+        self.assertEqual(snapshot.latest_height(self.folder), 5)
+        self.assertIsNone(snapshot.open_snapshot(self.folder, 2))
+
+        # back to block 3 after a fork, a new block 4 replaces the stale 4 and 5
+        snapshot.set_latest(self.folder, 3)
+        snapshot.save_snapshot(self.folder, snapshot.dump_snapshot([('h', '4b')]), 4, keep=3)
+        self.assertEqual(snapshot.snapshot_heights(self.folder), [3, 4])
+        self.assertEqual(snapshot.open_latest(self.folder).get('h'), '4b')
+
+    def test_not_a_snapshot(self):
+        with open(os.path.join(self.folder, '1'), 'wb') as f:
+            f.write('x' * 100)
+        self.assertRaises(OEBaseException, snapshot.Snapshot, os.path.join(self.folder, '1'))
+        self.assertIsNone(snapshot.open_latest(self.folder))
+
+    def test_broken_files(self):
+        data = snapshot.dump_snapshot([('a', '1'), ('b', '2')])
+        for height, content in enumerate(['', data[:10], data[:-1], 'x' * 100], 1):
+            with open(os.path.join(self.folder, str(height)), 'wb') as f:
+                f.write(content)
+            self.assertIsNone(snapshot.open_snapshot(self.folder, height))
+
+
+if __name__ == '__main__':
+    unittest.main()
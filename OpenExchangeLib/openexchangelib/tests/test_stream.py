@@ -0,0 +1,183 @@
+import cPickle
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+from pybit.types import Block, Transaction
+from openexchangelib import process_block, stream, util
+from openexchangelib.types import Asset, SellLimitOrderRequest, TradeItem
+from openexchangelib.tests.test_exchange import _asset
+from openexchangelib.tests.test_serialization import _canonical, _exchange, _order
+
+
+class _Tx(object):
+    def __init__(self, outputs):
+        self.outputs = [(n, address, 10000) for n, address in enumerate(outputs)]
+
+
+class _Block(object):
+    def __init__(self, height, outputs):
+        self.height = height
+        self.hash = 'h%d' % height
+        self.previous_hash = 'h%d' % (height - 1)
+        self.timestamp = datetime(2014, 1, 3)
+        self.transactions = [_Tx(outputs)]
+
+
+def _advance(exchange, block):
+    exchange.processed_block_height = block.height
+    exchange.processed_block_hash = block.hash
+
+
+class ProcessedBlockTest(unittest.TestCase):
+    def process(self, exchange, changes):
+        """
+        does to the exchange what a block would: a new sell order, a buy order partially traded, a sell order
+        cancelled and the asset paused, and tells the collector what the requests touched
+        """
+        asset = exchange.assets['A']
+        placed = _order(SellLimitOrderRequest, 4, 'u3', 110, 4)
+        asset.sell_order_book.add(placed)
+        asset.users['u3'].active_orders[placed.order_index] = placed
+        asset.users['u3'].order_counter += 1
+
+        traded = asset.buy_order_book.best()
+        traded.volume_unfulfilled -= 3
+        traded.trade_history.append(TradeItem(100, 3, datetime(2014, 1, 3), TradeItem.TRADE_TYPE_SELL))
+        asset.buy_order_book.fill_best(3)
+        asset.users['u3'].available += 300
+
+        cancelled = asset.users['u1'].active_orders.pop(0)
+        asset.sell_order_book.remove(cancelled)
+        asset.state = Asset.STATE_PAUSED
+
+        changes.on_request(placed, 'A')
+        changes.on_order_placed(placed, 'A')
+        changes.on_orders_touched(placed, 'A', [traded, cancelled])
+        return [placed]
+
+    def test_apply_to(self):
+        exchange = _exchange()
+        consumer = cPickle.loads(util.dump_obj(exchange))
+        block = _Block(300001, ['a_limit_sell', 'a_limit_buy'])
+
+        changes = stream.ChangeCollector(exchange)
+        requests = self.process(exchange, changes)
+        _advance(exchange, block)
+        processed = cPickle.loads(util.dump_obj(stream.ProcessedBlock(exchange, block, requests, changes)))
+        self.assertEqual(processed.asset_names(), {'A'})
+        self.assertEqual(sorted(processed.users['A']), ['u1', 'u3'])
+        self.assertEqual(list(processed.closed_orders), [('A', 'u1', 0)])
+        self.assertEqual(list(processed.changed_orders), [('A', 'u3', 2)])
+
+        kept = consumer.assets['A'].users['u3'].active_orders[2]
+        self.assertEqual(processed.apply_to(consumer), processed.requests)
+        self.assertEqual(_canonical(consumer), _canonical(exchange))
+        self.assertEqual(consumer.processed_block_height, 300001)
+
+        asset = consumer.assets['A']
+        self.assertIs(asset.users['u3'].active_orders[2], kept)
+        self.assertIs(asset.users['u3'].active_orders[4], processed.requests[0])
+        self.assertEqual([o.order_index for o in asset.sell_order_book], [1, 4])
+        self.assertEqual(list(asset.buy_order_book.levels()), [(100, 5)])
+        for order in list(asset.sell_order_book) + list(asset.buy_order_book):
+            self.assertIs(asset.users[order.user_address].active_orders[order.order_index], order)
+
+    def test_new_asset_is_shipped_whole(self):
+        exchange = _exchange()
+        consumer = cPickle.loads(util.dump_obj(exchange))
+        block = _Block(300001, ['ex_create'])
+
+        changes = stream.ChangeCollector(exchange)
+        exchange.register_asset('C', _asset('c_'))
+        _advance(exchange, block)
+        processed = stream.ProcessedBlock(exchange, block, [], changes)
+        self.assertEqual(processed.asset_names(), {'C'})
+        processed.apply_to(consumer)
+        self.assertEqual(_canonical(consumer), _canonical(exchange))
+        self.assertEqual(consumer.address_book()['c_pay'], ('C', 'pay'))
+
+    def test_processed_requests(self):
+        exchange = _exchange()
+        asset = exchange.assets['A']
+        for order in asset.sell_order_book:  # the shares on sale are not available
+            asset.users[order.user_address].available -= order.volume_unfulfilled
+        consumer = cPickle.loads(util.dump_obj(exchange))
+        transactions = [Transaction('t1', ['u4'], [(0, 'a_limit_buy', 10000 * 5 + 5)]),  # takes 3 + 2 of 10
+                        Transaction('t2', ['u3'], [(0, 'u3', 1), (1, 'a_clear_order', 2)]),
+                        Transaction('t3', ['u1'], [(0, 'a_transfer', 1), (1, 'u5', 100)]),
+                        Transaction('t4', ['u2'], [(0, 'a_limit_sell', 20000 + 1)]),
+                        Transaction('t5', ['u6'], [(0, 'a_limit_buy', 20000 + 3)])]  # fails, but adds u6
+        block = Block(300001, 'h300001', exchange.processed_block_hash, datetime(2014, 1, 3), transactions)
+
+        changes = stream.ChangeCollector(exchange)
+        requests = process_block(exchange, block, {}, [changes])
+        processed = cPickle.loads(util.dump_obj(stream.ProcessedBlock(exchange, block, requests, changes)))
+        self.assertEqual(processed.asset_names(), {'A'})
+        self.assertEqual(sorted(processed.users['A']), ['u1', 'u2', 'u3', 'u4', 'u5', 'u6'])
+        self.assertEqual(sorted(processed.closed_orders), [('A', 'u2', 1), ('A', 'u3', 2)])
+        self.assertEqual(list(processed.changed_orders), [('A', 'u1', 0)])
+        self.assertEqual([order.user_address for asset_name, order in processed.placed_orders], ['u2'])
+
+        processed.apply_to(consumer)
+        self.assertEqual(_canonical(consumer), _canonical(exchange))
+
+
+class StreamTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = os.path.join(tempfile.mkdtemp(), 'stream')
+        self.segment_size = stream.SEGMENT_SIZE
+        stream.SEGMENT_SIZE = 3
+
+    def tearDown(self):
+        stream.SEGMENT_SIZE = self.segment_size
+        shutil.rmtree(os.path.dirname(self.folder))
+
+    def test_cursors(self):
+        writer = stream.StreamWriter(self.folder)
+        self.assertFalse(stream.exists(self.folder))
+        self.assertEqual([writer.append(stream.Rewind(h)) for h in xrange(1, 8)], range(1, 8))
+        self.assertTrue(stream.exists(self.folder))
+
+        web, other = stream.StreamReader(self.folder, 'web'), stream.StreamReader(self.folder, 'other')
+        self.assertEqual([(seq, item.height) for seq, item in web.items()], [(seq, seq) for seq in xrange(1, 8)])
+        web.commit(5)
+        self.assertEqual([seq for seq, _ in web.items()], [6, 7])
+        self.assertEqual([seq for seq, _ in web.items(after=2)], range(3, 8))
+        self.assertEqual(other.cursor(), 0)
+        self.assertEqual(stream.consumers(self.folder), ['web'])
+
+    def test_prune(self):
+        writer = stream.StreamWriter(self.folder)
+        for h in xrange(1, 8):
+            writer.append(stream.Rewind(h))
+        writer.prune()
+        self.assertEqual(stream._segments(self.folder), [1, 4, 7])
+
+        web, other = stream.StreamReader(self.folder, 'web'), stream.StreamReader(self.folder, 'other')
+        web.commit(7)
+        other.commit(3)
+        writer.prune()
+        self.assertEqual(stream._segments(self.folder), [4, 7])
+        other.commit(6)
+        writer.prune()
+        self.assertEqual(stream._segments(self.folder), [7])
+        self.assertEqual([seq for seq, _ in other.items()], [7])
+
+    def test_reopen_after_a_crash(self):
+        writer = stream.StreamWriter(self.folder)
+        for h in xrange(1, 6):
+            writer.append(stream.Rewind(h))
+        with open(os.path.join(self.folder, stream.SEGMENT_PREFIX + '4'), 'ab') as f:
+            f.write('\x06\x00')
+
+        writer = stream.StreamWriter(self.folder)
+        self.assertEqual(writer.append(stream.Rewind(6)), 6)
+        reader = stream.StreamReader(self.folder, 'web')
+        self.assertEqual([item.height for _, item in reader.items()], range(1, 7))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from openexchangelib import tape, candles
+
+
+def _rows(height, n, price=100):
+    return [(60000 * height + i, price + i, i + 1, 1, height, i) for i in xrange(n)]
+
+
+class TapeTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.tape_folder = tape.tape_folder(self.folder, 'A')
+        self.writer = tape.TapeWriter(self.tape_folder)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def read(self):
+        t = tape.Tape(self.tape_folder)
+        try:
+            return t.rows()
+        finally:
+            t.close()
+
+    def test_append_and_read(self):
+        self.writer.append(_rows(1, 2) + _rows(3, 1))
+        self.writer.append(_rows(4, 2))
+        self.writer.sync()
+        self.assertEqual(self.read(), _rows(1, 2) + _rows(3, 1) + _rows(4, 2))
+        self.assertEqual(tape.asset_names(self.folder), ['A'])
+
+        t = tape.Tape(self.tape_folder)
+        self.assertEqual(len(t), 5)
+        self.assertEqual(list(t.column('height')), [1, 1, 3, 4, 4])
+        self.assertEqual([t.first_after(h) for h in [0, 1, 2, 3, 4]], [0, 2, 2, 3, 5])
+        self.writer.append(_rows(5, 1))
+        self.assertEqual(len(t), 5)  # opened before the append
+        t.close()
+
+    def test_columns_outlive_the_tape(self):
+        self.writer.append(_rows(1, 3))
+        t = tape.Tape(self.tape_folder)
+        prices = t.column('price')
+        t.close()
+        del t
+        self.assertEqual(list(prices), [100, 101, 102])
+
+    def test_empty(self):
+        t = tape.Tape(tape.tape_folder(self.folder, 'B'))
+        self.assertEqual((len(t), t.rows(), t.first_after(1)), (0, [], 0))
+        t.close()
+
+    def test_truncate(self):
+        self.writer.append(_rows(1, 2) + _rows(2, 1) + _rows(4, 3))
+        self.writer.truncate(3)
+        self.assertEqual(self.read(), _rows(1, 2) + _rows(2, 1))
+        self.writer.truncate(1)
+        self.assertEqual(self.read(), _rows(1, 2))
+        self.writer.truncate(-1)
+        self.assertEqual(self.read(), [])
+
+    def test_replayed_blocks_are_skipped(self):
+        self.writer.append(_rows(1, 2) + _rows(2, 1))
+        self.writer.append(_rows(1, 2) + _rows(2, 1) + _rows(3, 2))
+        self.assertEqual(self.read(), _rows(1, 2) + _rows(2, 1) + _rows(3, 2))
+
+    def test_lost_trades_are_replaced(self):
+        self.writer.append(_rows(1, 2) + _rows(2, 3) + _rows(3, 1))
+        self.writer.truncate(1)
+        self.writer.append(_rows(2, 3)[:1])  # block 2 cut by a crash
+        self.writer.append(_rows(1, 2) + _rows(2, 3) + _rows(3, 1))
+        self.assertEqual(self.read(), _rows(1, 2) + _rows(2, 3) + _rows(3, 1))
+
+    def test_block_processed_again(self):
+        self.writer.append(_rows(1, 2) + _rows(2, 2))
+        self.writer.append(_rows(2, 1, price=200))
+        self.assertEqual(self.read(), _rows(1, 2) + _rows(2, 1, price=200))
+
+    def test_columns_cut_by_a_crash(self):
+        self.writer.append(_rows(1, 2))
+        with open(os.path.join(self.tape_folder, 'price'), 'ab') as f:
+            f.write('\x00' * 8 * 2)
+        with open(os.path.join(self.tape_folder, 'time'), 'ab') as f:
+            f.write('\x00' * 4)
+        self.assertEqual(self.read(), _rows(1, 2))
+
+        writer = tape.TapeWriter(self.tape_folder)
+        sizes = [os.path.getsize(os.path.join(self.tape_folder, name)) for name, fmt in tape.COLUMNS]
+        self.assertEqual(sizes, [16, 16, 16, 2, 8, 16])
+        writer.append(_rows(2, 1))
+        self.assertEqual(self.read(), _rows(1, 2) + _rows(2, 1))
+
+    def test_build_candles(self):
+        self.writer.append(_rows(1, 2) + _rows(2, 1))
+        t = tape.Tape(self.tape_folder)
+        built = candles.build_from_tape(t, t.first_after(1))
+        expected = candles.build([[60000, 100 / 100000000.0, 1], [60001, 101 / 100000000.0, 2]])
+        self.assertEqual(dict((r, c.candles) for r, c in built.iteritems()),
+                         dict((r, c.candles) for r, c in expected.iteritems()))
+        self.assertEqual(len(candles.build_from_tape(t)['1m'].candles), 2)
+        t.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
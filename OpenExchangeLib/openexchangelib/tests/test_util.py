@@ -0,0 +1,48 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from openexchangelib import util
+
+
+class AssetInitDataTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        for index in xrange(12):
+            util.save_obj(['asset%d' % index, {'n': index}], os.path.join(self.folder, str(index)))
+        util._init_data_cache.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+        util._init_data_cache.clear()
+
+    def test_lazy_mapping(self):
+        data = util.AssetInitData(self.folder, {1, 2})
+        self.assertEqual(list(data), [0] + range(3, 12))
+        self.assertIn(3, data)
+        self.assertNotIn(1, data)
+        self.assertRaises(KeyError, data.__getitem__, 1)
+        self.assertRaises(KeyError, data.__getitem__, 12)
+        self.assertEqual(data[3], ['asset3', {'n': 3}])
+        data[3][1]['n'] = 0
+        self.assertEqual(data[3], ['asset3', {'n': 3}])  # a new object every time
+
+    def test_file_changed(self):
+        data = util.AssetInitData(self.folder)
+        self.assertEqual(data[0][0], 'asset0')
+        util.save_obj(['changed', {}], os.path.join(self.folder, '0'))
+        self.assertEqual(data[0][0], 'changed')
+
+    def test_cache_is_bounded(self):
+        data = util.AssetInitData(self.folder)
+        for index in xrange(12):
+            data[index]
+        data[8]
+        self.assertEqual(len(util._init_data_cache), util.INIT_DATA_CACHE_SIZE)
+        cached = [int(os.path.basename(f)) for f in util._init_data_cache]
+        self.assertEqual(cached, [4, 5, 6, 7, 9, 10, 11, 8])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,12 @@
 ####################  Exceptions
 import settings
+from orderbook import OrderBook
 from pybit.types import Transaction, Printable
 
 
 class OEBaseException(Exception):
     def __init__(self, *args, **kwargs):
-        lkw = ["%s: %s" % (str(k), str(v)) for k, v in kwargs]
+        lkw = ["%s: %s" % (str(k), str(v)) for k, v in kwargs.iteritems()]
         Exception.__init__(self, *(args + tuple(lkw)))
 
 
@@ -156,6 +157,7 @@ class BuyLimitOrderRequest(Request):
         self.volume_requested = volume
         self.volume_unfulfilled = volume
         self.unit_price = unit_price
+        self.book_position = None  # handle into its price level while the order rests in the order book
 
         self.trade_history = []
         """:type: list of TradeItem"""
@@ -195,6 +197,7 @@ class SellLimitOrderRequest(Request):
         self.volume_requested = volume
         self.volume_unfulfilled = volume
         self.unit_price = unit_price
+        self.book_position = None  # handle into its price level while the order rests in the order book
 
         self.trade_history = []
         """:type: list of TradeItem"""
@@ -529,10 +532,12 @@ class Asset(Printable):
         self.state_control_address = state_control_address
         self.issuer_address = issuer_address
 
-        self.sell_order_book = kwargs.get('sell_order_book', [])  # only store ask limit orders, market order will be executed immediately
-        """:type: list of SellLimitOrderRequest"""
-        self.buy_order_book = kwargs.get('buy_order_book', [])  # only store bid limit orders, market order will be executed immediately
-        """:type: list of BuyLimitOrderRequest"""
+        # only store ask limit orders, market order will be executed immediately
+        self.sell_order_book = OrderBook(OrderBook.SIDE_SELL, kwargs.get('sell_order_book'))
+        """:type: OrderBook"""
+        # only store bid limit orders, market order will be executed immediately
+        self.buy_order_book = OrderBook(OrderBook.SIDE_BUY, kwargs.get('buy_order_book'))
+        """:type: OrderBook"""
 
         self.state = self.__class__.STATE_PAUSED
 
@@ -541,6 +546,36 @@ class Asset(Printable):
         self.votes = kwargs.get('votes', {})  # from vote_id to Vote
         """:type: dict from int to Vote"""
 
+    def service_addresses(self):
+        """
+        :rtype: list of tuple
+        :return: list of (address, service), service is the name of the request handler serving the address
+        """
+        return [
+            (self.limit_buy_address, 'limit_buy'),
+            (self.limit_sell_address, 'limit_sell'),
+            (self.market_buy_address, 'market_buy'),
+            (self.market_sell_address, 'market_sell'),
+            (self.clear_order_address, 'clear_order'),
+            (self.transfer_address, 'transfer'),
+            (self.create_vote_address, 'create_vote'),
+            (self.vote_address, 'user_vote'),
+            (self.pay_address, 'pay'),
+            (self.state_control_address, 'asset_state_control'),
+        ]
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # assets pickled before OrderBook was introduced keep their order books as sorted lists
+        if isinstance(self.sell_order_book, list):
+            self.sell_order_book = OrderBook(OrderBook.SIDE_SELL, self.sell_order_book)
+        if isinstance(self.buy_order_book, list):
+            self.buy_order_book = OrderBook(OrderBook.SIDE_BUY, self.buy_order_book)
+
+
+class AddressCollisionError(OEBaseException):
+    pass
+
 
 class Exchange(Printable):
     STATE_RUNNING = 0
@@ -573,3 +608,83 @@ class Exchange(Printable):
         self.assets = kwargs.get('assets', {})
         """:type: dict from str to Asset"""
         self.state = self.__class__.STATE_PAUSED
+
+    def __getstate__(self):
+        # the address book is derived data, it's rebuilt on the first use after loading
+        state = self.__dict__.copy()
+        state.pop('_address_book', None)
+        state.pop('_asset_addresses', None)
+        state.pop('_service_addresses', None)
+        return state
+
+    def address_book(self):
+        """
+        the index of all service addresses, built once and then kept up to date by register_asset
+        :rtype: dict
+        :return: dict from address to (asset_name, service), asset_name is None for exchange level services, service
+        is the name of the request handler serving the address
+        """
+        address_book = self.__dict__.get('_address_book')
+        if address_book is None:
+            self._address_book = address_book = {
+                self.create_asset_address: (None, 'create_asset'),
+                self.state_control_address: (None, 'exchange_state_control'),
+            }
+            self._asset_addresses = {}
+            for asset_name, asset in self.assets.iteritems():
+                self._index_asset(asset_name, asset)
+        return address_book
+
+    def service_addresses(self):
+        """
+        all service addresses as a frozenset, for discarding irrelevant transactions quickly. a new set is created
+        only when the address book changes
+        :rtype: frozenset
+        """
+        service_addresses = self.__dict__.get('_service_addresses')
+        if service_addresses is None:
+            self._service_addresses = service_addresses = frozenset(self.address_book())
+        return service_addresses
+
+    def _index_asset(self, asset_name, asset):
+        """
+        :type asset_name: str
+        :type asset: Asset
+        """
+        assert isinstance(asset_name, str)
+        assert isinstance(asset, Asset)
+
+        service_addresses = asset.service_addresses()
+        self._check_addresses(asset_name, service_addresses)
+        for address, service in service_addresses:
+            self._address_book[address] = (asset_name, service)
+        self._asset_addresses[asset_name] = [address for address, service in service_addresses]
+
+    def _check_addresses(self, asset_name, service_addresses):
+        """
+        :raise AddressCollisionError: if an address is used twice by the asset, or by another asset or the exchange
+        """
+        addresses = [address for address, service in service_addresses]
+        if len(set(addresses)) != len(addresses):
+            raise AddressCollisionError('an address serves the asset twice', asset_name=asset_name)
+        for address in addresses:
+            owner = self._address_book.get(address)
+            if owner is not None and owner[0] != asset_name:
+                raise AddressCollisionError(asset_name=asset_name, address=address, owner=owner[0])
+
+    def register_asset(self, asset_name, asset):
+        """
+        lists a new asset, or replaces / re-indexes an existing one after re-initialization. only the addresses of
+        this asset are touched in the address book. nothing is changed if an address collides
+        :type asset_name: str
+        :type asset: Asset
+        :raise AddressCollisionError:
+        """
+        self.address_book()
+        self._check_addresses(asset_name, asset.service_addresses())
+        for address in self._asset_addresses.pop(asset_name, []):
+            del self._address_book[address]
+
+        self.assets[asset_name] = asset
+        self._index_asset(asset_name, asset)
+        self._service_addresses = None
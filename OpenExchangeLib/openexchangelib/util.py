@@ -52,10 +52,52 @@ def write_log(logger, *args, **kwargs):
 
 #####################  serialization and deserialization
 def save_obj(obj, file_full_name):
+    """
+    atomic, see save_bytes
+    """
+    save_bytes(dump_obj(obj), file_full_name)
+
+
+def dump_obj(obj):
+    """
+    the bytes save_obj would write, e.g. to snapshot an object that is going to be changed before it's written
+    :rtype: str
+    """
     import cPickle
 
-    with open(file_full_name, 'wb') as f:
-        cPickle.dump(obj, f, -1)
+    return cPickle.dumps(obj, -1)
+
+
+def save_bytes(data, file_full_name):
+    """
+    the data goes to a temporary file in the same folder first, which is synced and then renamed to file_full_name.
+    so a reader, e.g. the web server loading the latest state, sees either the old file or the new one, never a part
+    of it; and a crash never leaves a torn file behind
+    :type data: str
+    """
+    import os
+    import tempfile
+
+    folder, name = os.path.split(os.path.abspath(file_full_name))
+    fd, temp_file_name = tempfile.mkstemp(suffix='.tmp', prefix=name + '.', dir=folder)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(temp_file_name, file_full_name)
+    except:
+        if os.path.exists(temp_file_name):
+            os.remove(temp_file_name)
+        raise
+
+    # the rename itself is durable only after the folder is synced
+    if hasattr(os, 'O_DIRECTORY'):
+        dir_fd = os.open(folder, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
 
 
 def load_obj(file_full_name):
@@ -66,6 +108,74 @@ def load_obj(file_full_name):
     return obj
 
 
+####################  asset init data
+from collections import Mapping, OrderedDict
+
+#file name -> (mtime, size, content) of the init data files read last, shared by all AssetInitData. a file is read
+#when a request lists or re-initializes an asset, so only a few are ever read again: the least recently used ones
+#are dropped beyond INIT_DATA_CACHE_SIZE
+INIT_DATA_CACHE_SIZE = 8
+_init_data_cache = OrderedDict()
+
+
+class AssetInitData(Mapping):
+    def __init__(self, folder, used_indexes=()):
+        """
+        the asset init data for process_block: index -> the unpickled data file <folder>/<index>, but the used ones.
+        nothing is read until a request asks for an index, and then only that file. a file is read again only if its
+        mtime or size changes, or it has left the cache (see INIT_DATA_CACHE_SIZE). every access unpickles a new
+        object, the exchange may take and change it
+        :type folder: str
+        :type used_indexes: set of int
+        """
+        self.folder = folder
+        self.used_indexes = frozenset(used_indexes)
+
+    def __getitem__(self, index):
+        import os
+        import cPickle
+
+        if not isinstance(index, (int, long)) or index < 0 or index in self.used_indexes:
+            raise KeyError(index)
+        file_name = os.path.join(self.folder, str(index))
+        try:
+            stat = os.stat(file_name)
+        except OSError:
+            raise KeyError(index)
+
+        cached = _init_data_cache.pop(file_name, None)
+        if cached is None or cached[:2] != (stat.st_mtime, stat.st_size):
+            with open(file_name, 'rb') as f:
+                cached = (stat.st_mtime, stat.st_size, f.read())
+        _init_data_cache[file_name] = cached
+        while len(_init_data_cache) > INIT_DATA_CACHE_SIZE:
+            _init_data_cache.popitem(last=False)
+        return cPickle.loads(cached[2])
+
+    def __iter__(self):
+        """
+        lists the folder
+        """
+        import os
+
+        indexes = [int(f) for f in os.listdir(self.folder)
+                   if f.isdigit() and os.path.isfile(os.path.join(self.folder, f))]
+        return iter(sorted(set(indexes) - self.used_indexes))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __contains__(self, index):
+        import os
+
+        return isinstance(index, (int, long)) and index >= 0 and index not in self.used_indexes \
+            and os.path.isfile(os.path.join(self.folder, str(index)))
+
+    def __reduce__(self):
+        # pickled, e.g. into a journal record, as the plain dict it stands for
+        return dict, (dict(self),)
+
+
 ####################  timestamp and datetime transformation
 from datetime import datetime
 